@@ -0,0 +1,290 @@
+"""
+Alarm engine: hi-hi, hi, lo, lo-lo and rate-of-change alarms per channel.
+
+Evaluated once per sample on the channel voltages, the same units as
+sensors.threshold_high/low, which hi and lo default to. Per channel
+(alarms.channels[n], volts and seconds, null = off):
+
+    hihi, hi, lo, lolo  limits
+    roc                 rate-of-change limit, volts per second either way
+    deadband            an active alarm clears only this far back inside its limit
+    roc_deadband        the same for roc, in volts per second (default 10% of roc)
+    on_delay_s          the condition must hold this long before the alarm trips
+    off_delay_s         ... and be gone this long before it clears
+    latch               a cleared alarm stays shown until acknowledged
+
+State changes go to an event ring (/alarms/events), the log and MQTT on
+<topic>/alarm/s<n>. The LED shows the most urgent state with a pattern
+stepped by a timer, so nothing waits on it.
+"""
+from machine import Pin, Timer
+from array import array
+import time
+import config
+from config import load_config
+from sensors import sensors, threshold_low, threshold_high
+from mqtt_client import mqtt_publish
+import metrics
+from debug import logger
+
+log = logger("alarms")
+
+KINDS = ("hihi", "hi", "lo", "lolo", "roc")
+ROC = 4
+
+# Alarm states
+NORMAL = 0
+UNACK = 1        # active, not acknowledged
+ACKED = 2        # active, acknowledged
+RTN_UNACK = 3    # back to normal but latched until acknowledged
+STATES = ("normal", "unack", "acked", "rtn_unack")
+
+# Event types
+ACTIVE = 0
+CLEAR = 1
+ACK = 2
+EVENT_NAMES = ("active", "clear", "ack")
+
+# LED patterns, one bit per LED_TICK_MS step, lowest bit first
+LED_TICK_MS = 100
+PATTERNS = (0, 0x5555, 0x00FF, 0x0005)    # by state: off, fast, slow, double pulse
+_URGENCY = (0, 3, 1, 2)                   # which state the LED shows first
+
+N_CH = len(sensors)
+EVENTS = 32
+
+
+class Alarm:
+    """One limit on one channel and its state machine."""
+
+    __slots__ = ("ch", "kind", "limit", "deadband", "on_ms", "off_ms", "latch",
+                 "cond", "changed", "state", "since", "value")
+
+    def __init__(self, ch, kind):
+        self.ch = ch
+        self.kind = kind
+        self.limit = None
+        self.deadband = 0.0
+        self.on_ms = 0
+        self.off_ms = 0
+        self.latch = False
+        self.cond = False      # limit exceeded, with deadband
+        self.changed = 0       # ticks_ms when cond last changed
+        self.state = NORMAL
+        self.since = 0         # time of the last state change
+        self.value = 0.0       # value at the last state change
+
+    def active(self):
+        return self.state == UNACK or self.state == ACKED
+
+    def update(self, x, now):
+        lim = self.limit
+        if self.kind <= 1 or self.kind == ROC:
+            cond = x >= lim - self.deadband if self.cond else x > lim
+        else:
+            cond = x <= lim + self.deadband if self.cond else x < lim
+        if cond != self.cond:
+            self.cond = cond
+            self.changed = now
+        if cond:
+            if not self.active() and time.ticks_diff(now, self.changed) >= self.on_ms:
+                _change(self, UNACK, ACTIVE, x)
+        elif self.active() and time.ticks_diff(now, self.changed) >= self.off_ms:
+            _change(self, RTN_UNACK if self.latch and self.state == UNACK else NORMAL, CLEAR, x)
+
+    def ack(self):
+        if self.state == UNACK:
+            _change(self, ACKED, ACK, self.value)
+        elif self.state == RTN_UNACK:
+            _change(self, NORMAL, ACK, self.value)
+        else:
+            return False
+        return True
+
+
+# alarms[ch][kind]; all five exist, the ones without a limit stay NORMAL
+alarms = [[Alarm(ch, k) for k in range(len(KINDS))] for ch in range(N_CH)]
+_enabled = []            # Alarm objects with a limit, evaluated every sample
+
+_prev = array("f", [0.0] * N_CH)
+_prev_ms = 0
+_have_prev = False
+
+# Event ring; entry n is in slot n % EVENTS
+event_seq = 0
+_ev_time = array("i", [0] * EVENTS)
+_ev_ch = bytearray(EVENTS)
+_ev_kind = bytearray(EVENTS)
+_ev_type = bytearray(EVENTS)
+_ev_state = bytearray(EVENTS)
+_ev_value = array("f", [0.0] * EVENTS)
+
+_topics = []    # <mqtt topic>/alarm/s<n> per channel, rebuilt by apply_config()
+LED = True
+_led = Pin("LED", Pin.OUT)
+_timer = None
+_pattern = 0
+_step = 0
+_lit = 0
+
+# Counters for metrics
+tripped = 0
+acknowledged = 0
+
+
+def apply_config(cfg):
+    global LED, _topics
+    a = cfg.get("alarms", {})
+    LED = a.get("led", True)
+    channels = a.get("channels", [])
+    _enabled[:] = []
+    for ch in range(N_CH):
+        c = channels[ch] if ch < len(channels) else {}
+        limits = (c.get("hihi"), c.get("hi", threshold_high[ch] if ch < len(threshold_high) else None),
+                  c.get("lo", threshold_low[ch] if ch < len(threshold_low) else None),
+                  c.get("lolo"), c.get("roc"))
+        roc_db = c.get("roc_deadband")
+        if roc_db is None:
+            roc_db = limits[ROC] * 0.1 if limits[ROC] else 0.0
+        for k in range(len(KINDS)):
+            al = alarms[ch][k]
+            al.limit = limits[k]
+            al.deadband = roc_db if k == ROC else c.get("deadband", 0.0)
+            al.on_ms = int(c.get("on_delay_s", 0) * 1000)
+            al.off_ms = int(c.get("off_delay_s", 0) * 1000)
+            al.latch = c.get("latch", False)
+            if al.limit is None:
+                al.state = NORMAL
+                al.cond = False
+            else:
+                _enabled.append(al)
+    base = cfg["mqtt"]["topic"]
+    _topics = [(base + "/alarm/s" + str(ch + 1)).encode() for ch in range(N_CH)]
+    _update_led()
+
+
+def _change(al, state, event, value):
+    global event_seq, tripped, acknowledged
+    al.state = state
+    al.since = int(time.time())
+    al.value = value
+    j = event_seq % EVENTS
+    _ev_time[j] = al.since
+    _ev_ch[j] = al.ch
+    _ev_kind[j] = al.kind
+    _ev_type[j] = event
+    _ev_state[j] = state
+    _ev_value[j] = value
+    event_seq += 1
+    if event == ACTIVE:
+        tripped += 1
+        log.warn("S{} {} alarm: {} (limit {})", al.ch + 1, KINDS[al.kind], value, al.limit)
+    elif event == ACK:
+        acknowledged += 1
+        log("S{} {} alarm acknowledged", al.ch + 1, KINDS[al.kind])
+    else:
+        log("S{} {} alarm cleared: {}", al.ch + 1, KINDS[al.kind], value)
+    mqtt_publish('{{"seq":{},"t":{},"ch":{},"kind":"{}","event":"{}","state":"{}","value":{},"limit":{}}}'.format(
+        event_seq - 1, al.since, al.ch + 1, KINDS[al.kind], EVENT_NAMES[event], STATES[state],
+        value, al.limit), _topics[al.ch])
+    _update_led()
+
+
+def evaluate(values):
+    """Run every enabled alarm against this sample's values (volts)."""
+    global _prev_ms, _have_prev
+    now = time.ticks_ms()
+    dt = time.ticks_diff(now, _prev_ms)
+    for al in _enabled:
+        ch = al.ch
+        if al.kind == ROC:
+            if not _have_prev or dt <= 0:
+                continue
+            x = (values[ch] - _prev[ch]) * 1000 / dt
+            al.update(x if x >= 0 else -x, now)
+        else:
+            al.update(values[ch], now)
+    for ch in range(N_CH):
+        _prev[ch] = values[ch]
+    _prev_ms = now
+    _have_prev = True
+
+
+def find(ch=None, kind=None):
+    """Alarms with a limit on channel ch (0-based) and of kind (a KINDS name)."""
+    for al in _enabled:
+        if (ch is None or al.ch == ch) and (kind is None or KINDS[al.kind] == kind):
+            yield al
+
+
+def ack(ch=None, kind=None):
+    """Acknowledge matching alarms; returns how many changed."""
+    n = 0
+    for al in list(find(ch, kind)):
+        if al.ack():
+            n += 1
+    return n
+
+
+def events(after=-1):
+    """Yield (seq, time, ch, kind, event, state, value) of buffered events newer than after."""
+    for n in range(max(event_seq - EVENTS, after + 1, 0), event_seq):
+        j = n % EVENTS
+        yield n, _ev_time[j], _ev_ch[j], _ev_kind[j], _ev_type[j], _ev_state[j], _ev_value[j]
+
+
+def counts():
+    """(active, unacknowledged) alarm counts."""
+    active = unack = 0
+    for al in _enabled:
+        if al.active():
+            active += 1
+        if al.state == UNACK or al.state == RTN_UNACK:
+            unack += 1
+    return active, unack
+
+
+# --------------------------
+# LED indicator
+# --------------------------
+def _update_led():
+    global _pattern
+    worst = NORMAL
+    for al in _enabled:
+        if _URGENCY[al.state] > _URGENCY[worst]:
+            worst = al.state
+    _pattern = PATTERNS[worst] if LED else 0
+
+
+def _led_tick(_):
+    global _step, _lit
+    on = (_pattern >> _step) & 1
+    _step = (_step + 1) & 15
+    # Only touch the pin while a pattern runs (or to switch it off), so
+    # the web server's activity blink still shows when all is quiet
+    if on != _lit:
+        _led.value(on)
+        _lit = on
+
+
+apply_config(load_config())
+# hi and lo follow the sensor thresholds unless set here
+config.subscribe(apply_config, "alarms")
+config.subscribe(apply_config, "sensors")
+# _topics hang off the MQTT base topic
+config.subscribe(apply_config, "mqtt")
+
+
+def init_alarms():
+    global _timer
+    _timer = Timer(period=LED_TICK_MS, mode=Timer.PERIODIC, callback=_led_tick)
+    log("Alarms initialized ({} limits)", len(_enabled))
+
+
+@metrics.collector
+def _metrics(out):
+    active, unack = counts()
+    metrics.gauge(out, "alarms_active", active, "Active alarms")
+    metrics.gauge(out, "alarms_unacknowledged", unack, "Alarms awaiting acknowledgement")
+    metrics.counter(out, "alarms_tripped_total", tripped, "Alarm activations")
+    metrics.counter(out, "alarms_acknowledged_total", acknowledged, "Alarm acknowledgements")
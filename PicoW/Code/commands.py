@@ -0,0 +1,168 @@
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+import json
+import config
+import mqtt_client
+from mqtt_client import mqtt_publish
+from digital_io import digital_outputs, set_digital_output
+from sampler import snapshot
+import alarms
+import metrics
+from debug import logger
+
+log = logger("cmd")
+
+# Commands arrive on <topic>/cmd/<name>[/<index>] (enable with mqtt.commands):
+#   cmd/out/<n>          "1" / "0" / "on" / "off" / "toggle"
+#   cmd/threshold/<n>    {"low": 0.5, "high": 3.0}   (either key)
+#   cmd/calibration/<n>  {"offset": 0.0, "scale": 1.0}
+#   cmd/config/<section> JSON object merged into that config section
+#   cmd/state            anything; the current snapshot goes to <topic>/state
+#   cmd/ack[/<n>]        alarm kind ("hi", ...) or empty for all kinds; all channels without n
+# Every command is answered on <topic>/ack with
+#   {"cmd": "out/0", "ok": true, "value": 1}  or  {"cmd": ..., "ok": false, "error": "..."}
+
+# Sections that may be changed remotely. wifi and auth stay local-only, and
+# so do mqtt (a bad broker or topic would cut off the command channel
+# itself) and log (levels and persistence could flood the flash).
+CONFIG_SECTIONS = ("sensors", "digital", "sampling", "stream", "logging", "metrics", "alarms")
+
+# Counters, read by the web/metrics side
+handled = 0
+failed = 0
+
+
+@metrics.collector
+def _metrics(out):
+    metrics.counter(out, "mqtt_commands_total", handled, "MQTT commands carried out")
+    metrics.counter(out, "mqtt_command_errors_total", failed, "MQTT commands rejected")
+
+
+def _index(arg, count):
+    i = int(arg)
+    if not 0 <= i < count:
+        raise ValueError("index out of range")
+    return i
+
+
+def _object(payload):
+    obj = json.loads(payload)
+    if not isinstance(obj, dict):
+        raise ValueError("expected a JSON object")
+    return obj
+
+
+def _cmd_out(arg, payload):
+    i = _index(arg, len(digital_outputs))
+    p = payload.decode().strip().lower()
+    if p == "toggle":
+        value = 1 - digital_outputs[i].value()
+    elif p in ("1", "on", "true"):
+        value = 1
+    elif p in ("0", "off", "false"):
+        value = 0
+    else:
+        raise ValueError("expected 1, 0 or toggle")
+    set_digital_output(i, value)
+    return digital_outputs[i].value()
+
+
+def _cmd_threshold(arg, payload):
+    s = config.get("sensors")
+    i = _index(arg, len(s["threshold_low"]))
+    obj = _object(payload)
+    low = list(s["threshold_low"])
+    high = list(s["threshold_high"])
+    low[i] = float(obj.get("low", low[i]))
+    high[i] = float(obj.get("high", high[i]))
+    if low[i] > high[i]:
+        raise ValueError("low above high")
+    if not config.update_section("sensors", {"threshold_low": low, "threshold_high": high}):
+        raise ValueError("save failed")
+    return {"low": low[i], "high": high[i]}
+
+
+def _cmd_calibration(arg, payload):
+    s = config.get("sensors")
+    i = _index(arg, len(s["calibration"]))
+    obj = _object(payload)
+    calib = [dict(c) for c in s["calibration"]]
+    calib[i]["offset"] = float(obj.get("offset", calib[i]["offset"]))
+    calib[i]["scale"] = float(obj.get("scale", calib[i]["scale"]))
+    if not config.update_section("sensors", {"calibration": calib}):
+        raise ValueError("save failed")
+    return calib[i]
+
+
+def _cmd_config(arg, payload):
+    if arg not in CONFIG_SECTIONS:
+        raise ValueError("section not writable")
+    values = _object(payload)
+    # Same checks as POST /config; the ValueError text goes into the ack
+    config.check_section(arg, values)
+    if not config.update_section(arg, values):
+        raise ValueError("save failed")
+    return None
+
+
+def _cmd_ack(arg, payload):
+    ch = None if arg is None else _index(arg, alarms.N_CH)
+    kind = payload.decode().strip() or None
+    if kind is not None and kind not in alarms.KINDS:
+        raise ValueError("unknown alarm kind")
+    return alarms.ack(ch, kind)
+
+
+def _cmd_state(arg, payload):
+    mqtt_publish(snapshot.json(), config.get("mqtt", "topic") + "/state")
+    return None
+
+
+_HANDLERS = {
+    "out": _cmd_out,
+    "threshold": _cmd_threshold,
+    "calibration": _cmd_calibration,
+    "config": _cmd_config,
+    "state": _cmd_state,
+    "ack": _cmd_ack,
+}
+
+
+def dispatch(topic, payload):
+    """Run one command and queue its acknowledgement."""
+    global handled, failed
+    base = config.get("mqtt", "topic") + "/cmd/"
+    name = topic.decode()
+    if name.startswith(base):
+        name = name[len(base):]
+    parts = name.split("/", 1)
+    ack = {"cmd": name, "ok": True}
+    try:
+        handler = _HANDLERS.get(parts[0])
+        if handler is None:
+            raise ValueError("unknown command")
+        value = handler(parts[1] if len(parts) > 1 else None, payload)
+        if value is not None:
+            ack["value"] = value
+        handled += 1
+    except Exception as e:
+        ack["ok"] = False
+        ack["error"] = str(e)
+        failed += 1
+    log("MQTT command {}: {}", name, ack["ok"])
+    mqtt_publish(json.dumps(ack), config.get("mqtt", "topic") + "/ack")
+
+
+async def command_task():
+    """Handle commands queued by the MQTT client, one per event loop pass."""
+    while True:
+        await mqtt_client.received.wait()
+        mqtt_client.received.clear()
+        while True:
+            cmd = mqtt_client.next_command()
+            if cmd is None:
+                break
+            dispatch(*cmd)
+            await asyncio.sleep(0)
@@ -1,8 +1,17 @@
 import json
-from debug import log
+import os
+from debug import logger
+
+log = logger("config")
 
 ACTIVE_CONFIG_FILE = "config.json"
 DEFAULT_CONFIG_FILE = "def_config.json"
+TEMP_CONFIG_FILE = "config.json.tmp"
+
+# Parsed once and shared; load_config() hands out this object.
+_cache = None
+# (section or None, callback) pairs notified after save_config()
+_subscribers = []
 
 
 def load_json(path):
@@ -10,40 +19,252 @@ def load_json(path):
     try:
         with open(path) as f:
             data = json.load(f)
-            log(f"Loaded JSON file: {path}")
+            log("Loaded JSON file: {}", path)
             return data
     except Exception as e:
-        log(f"Failed to load {path}: {e}")
+        log.warn("Failed to load {}: {}", path, e)
         return None
 
 
+def _merge(base, extra):
+    """Fill keys missing from base with the ones in extra, recursively."""
+    for k in extra:
+        if k not in base:
+            base[k] = extra[k]
+        elif isinstance(base[k], dict) and isinstance(extra[k], dict):
+            _merge(base[k], extra[k])
+    return base
+
+
+# Settings are checked against the shape of def_config.json: the same
+# keys, value types and list lengths (one entry per channel or input).
+# These are read by the firmware but left out of the defaults; the value
+# gives the type, None allows a number or null.
+OPTIONAL = {
+    "mqtt": {"user": "", "password": "", "clean_session": False},
+    "digital.inputs": {"events": False},
+    "alarms.channels": {"hi": None, "lo": None},
+    "sensors.scaling": {"input": "", "ratio": 0.0, "x0": 0.0, "x1": 0.0,
+                        "fault_low": None, "fault_high": None,
+                        "points": [], "values": []},
+}
+# Strings that may also be null
+NULLABLE = ("mqtt.user", "mqtt.password", "log.persist_level")
+# Lists of any length (at least the first number), entries like the second
+LISTS = {
+    "sensors.scaling.points": (2, [0.0, 0.0]),
+    "sensors.scaling.values": (2, 0.0),
+}
+# Maps with free keys, values like the one given
+MAPS = {"log.modules": "info"}
+_LEVELS = ("debug", "info", "warn", "error")
+CHOICES = {
+    "digital.inputs.count": ("none", "rising", "falling", "both"),
+    "mqtt.publish.mode": ("snapshot", "channels"),
+    "mqtt.publish.format": ("json", "binary"),
+    "sensors.scaling.type": ("volts", "4-20mA", "0-10V", "piecewise", "table"),
+    "log.level": _LEVELS,
+    "log.persist_level": _LEVELS,
+    "log.modules.*": _LEVELS,
+}
+
+
+def _check(value, ref, path, strict):
+    """Raise ValueError unless value is shaped like ref. strict: no unknown keys."""
+    if path in MAPS:
+        if not isinstance(value, dict):
+            raise ValueError(path + " must be an object")
+        for k in value:
+            _check(value[k], MAPS[path], path + ".*", strict)
+    elif isinstance(ref, dict):
+        if not isinstance(value, dict):
+            raise ValueError((path or "config") + " must be an object")
+        extra = OPTIONAL.get(path, {})
+        for k in value:
+            sub = path + "." + k if path else k
+            if k in ref:
+                _check(value[k], ref[k], sub, strict)
+            elif k in extra:
+                _check(value[k], extra[k], sub, strict)
+            elif strict:
+                raise ValueError("unknown setting: " + sub)
+    elif isinstance(ref, list):
+        n, item = LISTS.get(path, (len(ref), None))
+        if not isinstance(value, list) or (len(value) < n if path in LISTS else len(value) != n):
+            raise ValueError("{} must be a list of {}{}".format(path, "at least " if path in LISTS else "", n))
+        for i in range(len(value)):
+            r = ref[i] if item is None else item
+            if isinstance(r, dict):
+                # One entry per channel: every setting the defaults have
+                if not isinstance(value[i], dict):
+                    raise ValueError("{}[{}] must be an object".format(path, i))
+                for k in r:
+                    if k not in value[i]:
+                        raise ValueError("{}[{}] needs {}".format(path, i, k))
+            _check(value[i], r, path + "[]" if item is not None else path, strict)
+    elif value is None:
+        if ref is not None and path not in NULLABLE:
+            raise ValueError(path + " must not be null")
+    elif isinstance(ref, bool):
+        if not isinstance(value, bool):
+            raise ValueError(path + " must be true or false")
+    elif isinstance(ref, str):
+        if not isinstance(value, str):
+            raise ValueError(path + " must be a string")
+        if path in CHOICES and value not in CHOICES[path]:
+            raise ValueError("{} must be one of {}".format(path, ", ".join(CHOICES[path])))
+    elif isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(path + " must be a number")
+
+
+def _reference():
+    ref = load_json(DEFAULT_CONFIG_FILE)
+    if ref is None:
+        raise ValueError("def_config.json missing")
+    return ref
+
+
+def _validate(cfg, ref=None):
+    if ref is None:
+        ref = _reference()
+    for section in ref:
+        if not isinstance(cfg.get(section), dict):
+            raise ValueError("config section missing: " + section)
+    _check(cfg, ref, "", False)
+
+
+def check_section(section, values):
+    """Raise ValueError unless values is a valid update of one section."""
+    ref = _reference()
+    if section not in ref:
+        raise ValueError("unknown section: " + str(section))
+    _check(values, ref[section], section, True)
+
+
 def load_config():
-    """Load active config.json, or fall back to def_config.json."""
-    log("Loading active config.json...")
+    """Return the cached config, reading config.json (or the defaults) the first time."""
+    global _cache
+    if _cache is not None:
+        return _cache
 
+    log("Loading active config.json...")
+    defaults = load_json(DEFAULT_CONFIG_FILE)
     cfg = load_json(ACTIVE_CONFIG_FILE)
+    if cfg is None:
+        # A reset between writing the temp file and renaming it
+        cfg = load_json(TEMP_CONFIG_FILE)
     if cfg is not None:
-        return cfg
+        try:
+            if defaults is not None:
+                _merge(cfg, defaults)
+                _validate(cfg, defaults)
+            else:
+                _validate(cfg, cfg)
+            _cache = cfg
+            return cfg
+        except Exception as e:
+            log.warn("Active config invalid: {}", e)
 
-    log("Active config missing or invalid — loading defaults...")
+    log.warn("Active config missing or invalid — loading defaults...")
 
-    defaults = load_json(DEFAULT_CONFIG_FILE)
     if defaults is None:
-        log("ERROR: def_config.json missing or invalid!")
+        log.error("def_config.json missing or invalid!")
         raise Exception("No valid configuration available")
 
     # Write defaults to active config
+    _cache = defaults
     save_config(defaults)
     return defaults
 
 
+def reload_config():
+    """Drop the cache and re-read config.json, notifying subscribers."""
+    global _cache
+    old = _cache
+    _cache = None
+    _notify(old, load_config())
+
+
+def get(section, key=None, default=None):
+    """Typed accessor: get("mqtt", "topic") or get("mqtt") for the whole section."""
+    s = load_config().get(section)
+    if key is None:
+        return s if s is not None else default
+    if s is None:
+        return default
+    return s.get(key, default)
+
+
+def subscribe(callback, section=None):
+    """Call callback(cfg) after a save that changed section (or any section if None)."""
+    _subscribers.append((section, callback))
+
+
+def _notify(old, new):
+    """Run the subscribers of changed sections. Returns False if one failed."""
+    ok = True
+    for section, cb in _subscribers:
+        if section is None or old is None or old.get(section) != new.get(section):
+            try:
+                cb(new)
+            except Exception as e:
+                log.error("Config subscriber failed: {}", e)
+                ok = False
+    return ok
+
+
+def _write(cfg):
+    # Write a temp file and rename over the old one, so a reset mid-save
+    # leaves either the old or the new config, never a truncated file.
+    with open(TEMP_CONFIG_FILE, "w") as f:
+        json.dump(cfg, f)
+    try:
+        os.rename(TEMP_CONFIG_FILE, ACTIVE_CONFIG_FILE)
+    except OSError:
+        # Filesystems that refuse to rename over an existing file
+        os.remove(ACTIVE_CONFIG_FILE)
+        os.rename(TEMP_CONFIG_FILE, ACTIVE_CONFIG_FILE)
+
+
 def save_config(cfg):
-    """Save configuration to config.json."""
+    """Save configuration to config.json atomically and apply it.
+
+    If a subscriber fails to apply it, the previous config is restored,
+    on flash and in the modules, and False is returned.
+    """
+    global _cache
     log("Saving config.json...")
     try:
-        with open(ACTIVE_CONFIG_FILE, "w") as f:
-            json.dump(cfg, f)
+        _validate(cfg)
+        _write(cfg)
         log("Config saved")
     except Exception as e:
-        log(f"Failed to save config.json: {e}")
+        log.error("Failed to save config.json: {}", e)
+        return False
+
+    old = _cache
+    _cache = cfg
+    # Edited in place: there is nothing to diff against, notify everyone
+    if _notify(None if old is cfg else old, cfg) or old is None or old is cfg:
+        return True
+    log.error("Config not applied, restoring the previous one")
+    try:
+        _write(old)
+    except Exception as e:
+        log.error("Failed to restore config.json: {}", e)
+    _cache = old
+    _notify(cfg, old)
+    return False
 
+
+def update_section(section, values):
+    """Validate values, merge them into one section and save. Returns True on success."""
+    try:
+        check_section(section, values)
+    except ValueError as e:
+        log.warn("Rejected {} settings: {}", section, e)
+        return False
+    old = load_config()
+    cfg = json.loads(json.dumps(old))  # copy, so subscribers can diff old vs new
+    cfg[section].update(values)
+    return save_config(cfg)
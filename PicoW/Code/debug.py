@@ -1,6 +1,243 @@
-DEBUG = True
+"""
+Leveled logging with per-module filters.
 
-def log(msg):
-    if DEBUG:
-        print("[DEBUG]", msg)
+    from debug import logger
+    log = logger("mqtt")
+    log("Connected to {}", host)          # info
+    log.warn("Publish failed: {}", e)
+    log.debug("Sample {}", seq)           # formatted only if "mqtt" logs debug
 
+Messages are only formatted when their level is enabled for the module.
+Entries go to the console, to a preallocated ring of recent entries (the
+/logs page) and, from persist_level up, to rotated files on flash. More
+than rate_burst repeats of one message within rate_window_s are dropped;
+the next one let through says how many were.
+"""
+import os
+import time
+from array import array
+
+DEBUG = 10
+INFO = 20
+WARN = 30
+ERROR = 40
+NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARN: "WARN", ERROR: "ERROR"}
+LEVELS = {"debug": DEBUG, "info": INFO, "warn": WARN, "error": ERROR}
+
+# From the "log" config section, see apply_config()
+LEVEL = INFO
+MODULES = {}             # module name -> level overriding LEVEL
+CONSOLE = True           # print entries (USB serial on the Pico)
+RATE_BURST = 5           # repeats of one message allowed per window, 0 = no limit
+RATE_WINDOW_MS = 10000
+PERSIST_LEVEL = 0        # entries at or above this go to flash, 0 = off
+LOG_FILE = "events.log"  # rotated to events.log.1 ... events.log.<files-1>
+FILE_SIZE = 8192
+FILES = 2
+
+# Ring of recent entries; the text of each is cut to ENTRY_SIZE bytes
+RING_SIZE = 64
+ENTRY_SIZE = 96
+_time = array("i", [0] * RING_SIZE)
+_level = bytearray(RING_SIZE)
+_module = [""] * RING_SIZE
+_len = bytearray(RING_SIZE)
+_text = bytearray(RING_SIZE * ENTRY_SIZE)
+seq = 0                  # entries recorded so far; entry n is in slot n % RING_SIZE
+
+# Unformatted message -> [window start ms, count, dropped], see _allow()
+_rate = {}
+RATE_KEYS = 32
+
+_loggers = {}
+_file_bytes = -1
+dropped = 0              # entries suppressed by the rate limit
+persist_errors = 0
+
+
+def _parse(name, default):
+    return LEVELS.get(str(name).lower(), default)
+
+
+def apply_config(cfg):
+    global LEVEL, MODULES, CONSOLE, RATE_BURST, RATE_WINDOW_MS, PERSIST_LEVEL, FILE_SIZE, FILES
+    c = cfg.get("log", {})
+    LEVEL = _parse(c.get("level", "info"), INFO)
+    MODULES = {}
+    for name, level in c.get("modules", {}).items():
+        MODULES[name] = _parse(level, LEVEL)
+    CONSOLE = c.get("console", True)
+    RATE_BURST = c.get("rate_burst", 5)
+    RATE_WINDOW_MS = int(c.get("rate_window_s", 10) * 1000)
+    persist = c.get("persist_level")
+    PERSIST_LEVEL = _parse(persist, 0) if persist else 0
+    FILE_SIZE = c.get("file_size", 8192)
+    FILES = max(c.get("files", 2), 1)
+    for lg in _loggers.values():
+        lg.level = MODULES.get(lg.name, LEVEL)
+
+
+def init():
+    """Apply the "log" config section and follow changes to it.
+
+    Not done at import: config.py logs through this module.
+    """
+    import config
+    apply_config(config.load_config())
+    config.subscribe(apply_config, "log")
+
+
+class Logger:
+    """Named logger; calling it logs at info level."""
+
+    __slots__ = ("name", "level")
+
+    def __init__(self, name):
+        self.name = name
+        self.level = MODULES.get(name, LEVEL)
+
+    def __call__(self, msg, *args):
+        if self.level <= INFO:
+            _emit(self.name, INFO, msg, args)
+
+    def debug(self, msg, *args):
+        if self.level <= DEBUG:
+            _emit(self.name, DEBUG, msg, args)
+
+    def info(self, msg, *args):
+        if self.level <= INFO:
+            _emit(self.name, INFO, msg, args)
+
+    def warn(self, msg, *args):
+        if self.level <= WARN:
+            _emit(self.name, WARN, msg, args)
+
+    def error(self, msg, *args):
+        if self.level <= ERROR:
+            _emit(self.name, ERROR, msg, args)
+
+
+def logger(name):
+    """The Logger for module name, shared by every caller."""
+    lg = _loggers.get(name)
+    if lg is None:
+        lg = _loggers[name] = Logger(name)
+    return lg
+
+
+def _allow(msg):
+    """Rate limit by unformatted message. Returns None to drop, else a suffix."""
+    global dropped
+    now = time.ticks_ms()
+    st = _rate.get(msg)
+    if st is None:
+        if len(_rate) >= RATE_KEYS:
+            _rate.clear()
+        _rate[msg] = [now, 1, 0]
+        return ""
+    suffix = ""
+    if time.ticks_diff(now, st[0]) >= RATE_WINDOW_MS:
+        if st[2]:
+            suffix = " ({} repeats dropped)".format(st[2])
+        st[0] = now
+        st[1] = 0
+        st[2] = 0
+    if st[1] >= RATE_BURST:
+        st[2] += 1
+        dropped += 1
+        return None
+    st[1] += 1
+    return suffix
+
+
+def _emit(name, level, msg, args):
+    suffix = _allow(msg) if RATE_BURST else ""
+    if suffix is None:
+        return
+    try:
+        text = msg.format(*args) if args else msg
+    except Exception:
+        text = "{} {}".format(msg, args)
+    if suffix:
+        text += suffix
+    if CONSOLE:
+        print("[" + NAMES[level] + "]", name + ":", text)
+    t = int(time.time())
+    _record(t, level, name, text)
+    if PERSIST_LEVEL and level >= PERSIST_LEVEL:
+        _persist(t, level, name, text)
+
+
+# --------------------------
+# Ring of recent entries
+# --------------------------
+def _record(t, level, name, text):
+    global seq
+    i = seq % RING_SIZE
+    b = text.encode()
+    n = len(b)
+    if n > ENTRY_SIZE:
+        n = ENTRY_SIZE
+        # Don't cut a UTF-8 sequence in half
+        while n and b[n] & 0xC0 == 0x80:
+            n -= 1
+    off = i * ENTRY_SIZE
+    _text[off:off + n] = b[:n]
+    _len[i] = n
+    _time[i] = t
+    _level[i] = level
+    _module[i] = name
+    seq += 1
+
+
+def entries(after=-1, level=0, module=None):
+    """Yield (seq, time, level, module, text) of buffered entries newer than after."""
+    first = max(seq - RING_SIZE, after + 1, 0)
+    for n in range(first, seq):
+        i = n % RING_SIZE
+        if _level[i] < level or (module and _module[i] != module):
+            continue
+        off = i * ENTRY_SIZE
+        yield n, _time[i], _level[i], _module[i], bytes(_text[off:off + _len[i]]).decode()
+
+
+# --------------------------
+# Rotated files on flash
+# --------------------------
+def _rotate():
+    for n in range(FILES - 1, 0, -1):
+        src = LOG_FILE if n == 1 else "{}.{}".format(LOG_FILE, n - 1)
+        dst = "{}.{}".format(LOG_FILE, n)
+        try:
+            os.remove(dst)
+        except OSError:
+            pass
+        try:
+            os.rename(src, dst)
+        except OSError:
+            pass
+    if FILES == 1:
+        try:
+            os.remove(LOG_FILE)
+        except OSError:
+            pass
+
+
+def _persist(t, level, name, text):
+    global _file_bytes, persist_errors
+    line = "{} {} {}: {}\n".format(t, NAMES[level], name, text)
+    try:
+        if _file_bytes < 0:
+            try:
+                _file_bytes = os.stat(LOG_FILE)[6]
+            except OSError:
+                _file_bytes = 0
+        if _file_bytes + len(line) > FILE_SIZE:
+            _rotate()
+            _file_bytes = 0
+        with open(LOG_FILE, "a") as f:
+            f.write(line)
+        _file_bytes += len(line)
+    except Exception:
+        # Logging about a failing log file would only recurse
+        persist_errors += 1
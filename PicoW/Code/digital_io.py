@@ -1,6 +1,13 @@
 from machine import Pin
+from array import array
+import time
+import micropython
+import config
 from config import load_config
-from debug import log
+import metrics
+from debug import logger, DEBUG
+
+log = logger("dio")
 
 cfg = load_config()
 
@@ -16,21 +23,278 @@ digital_outputs = [dout0, dout1]
 
 log("Applying default digital output states...")
 for i, val in enumerate(cfg["digital"]["output_default"]):
-    log(f"Setting DOUT{i} = {val}")
+    log("Setting DOUT{} = {}", i, val)
     digital_outputs[i].value(val)
 
-def read_digital_inputs():
-    vals = [pin.value() for pin in digital_inputs]
-    log("Digital inputs read: " + str(vals))
-    return vals
+inputs = array("B", [0] * len(digital_inputs))
+
+# --------------------------
+# Input capture
+# --------------------------
+# With digital.capture on, every input edge raises a hard IRQ. The handler
+# only stores (ticks_us, input, level) in a preallocated queue and
+# schedules _drain(), which debounces, counts and records events outside
+# interrupt context. Per input (digital.inputs[n]):
+#   debounce_ms  edges closer than this to the last accepted one are bounces
+#   count        "rising", "falling" or "both": edges that count as pulses,
+#                "none" for a plain contact
+#   events       record state changes in the event ring; on by default for
+#                contacts, off for counters, where every pulse would become
+#                a log record and an MQTT message
+N_IN = len(digital_inputs)
+QUEUE = 32               # raw edges between two drains
+EVENTS = 32              # state changes kept for the web, MQTT and logger
+
+CAPTURE = True
+RATE_WINDOW_MS = 10000   # window of the edges-per-second rate
+MAX_PERIOD_US = 60000000 # slowest pulse train measured, well inside the ticks_us wrap
+_debounce_us = array("i", [20000] * N_IN)
+_count_mask = bytearray(N_IN)      # bit 0: count falling, bit 1: rising
+_events_on = bytearray(N_IN)
+
+# Written by the IRQ handler, read by _drain(); _wr and _rd are only ever
+# advanced by their own side.
+_q_t = array("I", [0] * QUEUE)
+_q_ch = bytearray(QUEUE)
+_q_lv = bytearray(QUEUE)
+_wr = 0
+_rd = 0
+_scheduled = False       # a _drain() is pending; set by the IRQ side, cleared by the drain
+_draining = False        # the queue is being read, see _drain()
+overflows = 0            # edges lost to a full queue
+
+# Debounced state and counters, per input
+state = array("B", [0] * N_IN)
+counts = array("I", [0] * N_IN)
+bounces = array("I", [0] * N_IN)
+_last_us = array("I", [0] * N_IN)       # last accepted edge
+_pulse_us = array("I", [0] * N_IN)      # last counted edge
+_period_us = array("I", [0] * N_IN)     # between the last two counted edges
+rates = array("f", [0.0] * N_IN)        # counted edges per second, last window
+_rate_count = array("I", [0] * N_IN)
+_rate_ms = time.ticks_ms()
+
+# Event ring; entry n is in slot n % EVENTS
+event_seq = 0
+_ev_time = array("i", [0] * EVENTS)
+_ev_ch = bytearray(EVENTS)
+_ev_level = bytearray(EVENTS)
+_ev_bits = bytearray(EVENTS)            # all input levels after the change
+_ev_count = array("I", [0] * EVENTS)
+
+_attached = False
+_ready = False           # init_digital() ran; IRQs are attached from then on
+_COUNT = {"none": 0, "falling": 1, "rising": 2, "both": 3}
+
+
+def apply_config(cfg):
+    global CAPTURE, RATE_WINDOW_MS
+    d = cfg.get("digital", {})
+    CAPTURE = d.get("capture", True)
+    RATE_WINDOW_MS = int(d.get("rate_window_s", 10) * 1000)
+    settings = d.get("inputs", [])
+    for i in range(N_IN):
+        s = settings[i] if i < len(settings) else {}
+        _debounce_us[i] = int(s.get("debounce_ms", 20) * 1000)
+        _count_mask[i] = _COUNT.get(s.get("count", "rising"), 2)
+        _events_on[i] = 1 if s.get("events", _count_mask[i] == 0) else 0
+    if _attached != CAPTURE and _ready:
+        _attach(CAPTURE)
+
+
+apply_config(cfg)
+config.subscribe(apply_config, "digital")
+
+
+def _make_isr(i):
+    # Hard IRQ context: no allocation, so only small ints into preallocated
+    # arrays and a schedule() of an existing function.
+    def isr(pin):
+        global _wr, _scheduled, overflows
+        j = _wr
+        nxt = (j + 1) % QUEUE
+        if nxt == _rd:
+            overflows += 1
+            return
+        _q_t[j] = time.ticks_us()
+        _q_ch[j] = i
+        _q_lv[j] = pin.value()
+        _wr = nxt
+        if not _scheduled:
+            _scheduled = True
+            try:
+                micropython.schedule(_drain, 0)
+            except Exception:
+                # Schedule queue full (a MemoryError here, since raising
+                # the RuntimeError would allocate). _scheduled stays set so
+                # no edge tries again; _poll() drains and clears it.
+                pass
+    return isr
+
+
+_isrs = [_make_isr(i) for i in range(N_IN)]
+
+
+def _attach(on):
+    global _attached
+    for i in range(N_IN):
+        if on:
+            state[i] = digital_inputs[i].value()
+            _last_us[i] = time.ticks_add(time.ticks_us(), -_debounce_us[i])
+            digital_inputs[i].irq(handler=_isrs[i], trigger=Pin.IRQ_RISING | Pin.IRQ_FALLING, hard=True)
+        else:
+            digital_inputs[i].irq(handler=None)
+    _attached = on
+
+
+def _drain(_):
+    global _rd, _scheduled, _draining
+    _scheduled = False
+    # Scheduled callbacks run between the bytecodes of the main context,
+    # so one can land while _poll() reads the queue. Two readers of _rd
+    # would handle an edge twice; the one already reading finishes it.
+    if _draining:
+        return
+    _draining = True
+    try:
+        while _rd != _wr:
+            j = _rd
+            _edge(_q_ch[j], _q_lv[j], _q_t[j])
+            _rd = (j + 1) % QUEUE
+    finally:
+        _draining = False
+
+
+def _edge(i, level, t):
+    if level == state[i]:
+        return
+    # _poll() keeps _last_us recent, so an edge from before it (negative)
+    # is a stale one the level check already took, not ticks_us wrapping
+    if time.ticks_diff(t, _last_us[i]) < _debounce_us[i]:
+        bounces[i] += 1
+        return
+    state[i] = level
+    _last_us[i] = t
+    if _count_mask[i] & (2 if level else 1):
+        counts[i] += 1
+        if _pulse_us[i]:
+            _period_us[i] = time.ticks_diff(t, _pulse_us[i])
+        _pulse_us[i] = t or 1
+    if _events_on[i]:
+        _event(i, level)
+
+
+def _event(i, level):
+    global event_seq
+    j = event_seq % EVENTS
+    _ev_time[j] = int(time.time())
+    _ev_ch[j] = i
+    _ev_level[j] = level
+    _ev_count[j] = counts[i]
+    b = 0
+    for k in range(N_IN):
+        if state[k]:
+            b |= 1 << k
+    _ev_bits[j] = b
+    event_seq += 1
+
+
+def events(after=-1):
+    """Yield (seq, time, input, level, count, bits) of buffered events newer than after."""
+    for n in range(max(event_seq - EVENTS, after + 1, 0), event_seq):
+        j = n % EVENTS
+        yield n, _ev_time[j], _ev_ch[j], _ev_level[j], _ev_count[j], _ev_bits[j]
+
+
+def frequency(i):
+    """Pulse frequency in Hz from the last period, 0 once pulses stop."""
+    period = _period_us[i]
+    return 1000000 / period if period else 0.0
+
+
+def _poll():
+    """Catch up with the IRQ side; called once per sample."""
+    global _rate_ms, _draining
+    # Also retries a drain the IRQ side could not schedule
+    _drain(0)
+    # Keep scheduled drains out while levels are compared with state
+    _draining = True
+    now = time.ticks_us()
+    for i in range(N_IN):
+        since = time.ticks_diff(now, _last_us[i])
+        if since < 0 or since > MAX_PERIOD_US:
+            # Quiet input: move the last edge up before ticks_us wraps
+            _last_us[i] = time.ticks_add(now, -_debounce_us[i])
+            since = _debounce_us[i]
+        # An edge lost to debounce or a full queue: take the level as it is
+        level = digital_inputs[i].value()
+        if level != state[i] and since >= _debounce_us[i]:
+            _edge(i, level, now)
+        # Pulses stopped: no frequency after two missed periods (at least
+        # a second), and forget the last pulse before ticks_us wraps
+        if _pulse_us[i]:
+            limit = 2 * _period_us[i] if _period_us[i] else MAX_PERIOD_US
+            if time.ticks_diff(now, _pulse_us[i]) > max(limit, 1000000):
+                _pulse_us[i] = 0
+                _period_us[i] = 0
+    _draining = False
+    if _wr != _rd:
+        _drain(0)
+    ms = time.ticks_ms()
+    dt = time.ticks_diff(ms, _rate_ms)
+    if dt >= RATE_WINDOW_MS:
+        for i in range(N_IN):
+            rates[i] = (counts[i] - _rate_count[i]) * 1000 / dt
+            _rate_count[i] = counts[i]
+        _rate_ms = ms
+
+
+def read_digital_inputs(out=inputs):
+    """Fill out in place with the (debounced) input levels and return it."""
+    if _attached:
+        _poll()
+        for i in range(N_IN):
+            out[i] = state[i]
+    else:
+        for i in range(N_IN):
+            out[i] = digital_inputs[i].value()
+    if log.level <= DEBUG:
+        # Hot path: skip building the argument list unless it is wanted
+        log.debug("Digital inputs read: {}", list(out))
+    return out
+
+def read_counters(count_out, freq_out):
+    """Fill count_out with the pulse counts and freq_out with frequencies (Hz)."""
+    for i in range(N_IN):
+        count_out[i] = counts[i]
+        freq_out[i] = frequency(i)
 
 def set_digital_output(index, value):
-    log(f"Setting digital output {index} to {value}")
+    log("Setting digital output {} to {}", index, value)
     if 0 <= index < len(digital_outputs):
         digital_outputs[index].value(value)
     else:
-        log("Invalid digital output index!")
+        log.warn("Invalid digital output index {}", index)
 
-def init_digital():
-    log("Digital I/O initialized")
+@metrics.collector
+def _metrics(out):
+    for name, kind, text, values in (
+        ("din_pulses_total", "counter", "Counted input edges", counts),
+        ("din_bounces_total", "counter", "Input edges rejected by debounce", bounces),
+        ("din_rate_hz", "gauge", "Counted edges per second over the rate window", rates),
+    ):
+        metrics.header(out, name, kind, text)
+        for i in range(N_IN):
+            metrics.value(out, name, values[i], 'input="{}"'.format(i))
+    metrics.header(out, "din_frequency_hz", "gauge", "Pulse frequency from the last period")
+    for i in range(N_IN):
+        metrics.value(out, "din_frequency_hz", frequency(i), 'input="{}"'.format(i))
+    metrics.counter(out, "din_events_total", event_seq, "Input state changes recorded")
+    metrics.counter(out, "din_overflows_total", overflows, "Input edges lost to a full queue")
 
+def init_digital():
+    global _ready
+    _ready = True
+    if CAPTURE:
+        _attach(True)
+    log("Digital I/O initialized (capture {})", "on" if CAPTURE else "off")
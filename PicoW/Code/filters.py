@@ -0,0 +1,105 @@
+from array import array
+
+# Fixed-point fraction bits used for the EMA state, so the filter runs on
+# small ints only and never allocates a float on the hot path.
+EMA_FRAC = 4
+
+
+class ChannelFilter:
+    """
+    Per-channel ADC filter pipeline:
+
+        oversample (mean of N reads) -> median of M -> EMA -> boxcar of D
+
+    Every stage is integer-only and works on buffers allocated here, so
+    update() does not allocate once the filter has been built.
+    """
+
+    __slots__ = ("oversample", "median", "ema_shift", "decimate",
+                 "_ring", "_scratch", "_pos", "_ema", "_acc", "_count",
+                 "_out", "_primed")
+
+    def __init__(self, oversample=1, median=1, ema_shift=0, decimate=1):
+        self.oversample = max(1, int(oversample))
+        self.median = max(1, int(median)) | 1   # odd sizes have a true middle
+        self.ema_shift = max(0, int(ema_shift))
+        self.decimate = max(1, int(decimate))
+        self._ring = array("H", [0] * self.median)
+        self._scratch = array("H", [0] * self.median)
+        self._pos = 0
+        self._ema = 0
+        self._acc = 0
+        self._count = 0
+        self._out = 0
+        self._primed = False
+
+    def _median(self, value):
+        ring = self._ring
+        ring[self._pos] = value
+        self._pos = (self._pos + 1) % self.median
+        if self.median == 1:
+            return value
+        s = self._scratch
+        n = self.median
+        for i in range(n):
+            s[i] = ring[i]
+        # Insertion sort: M is small (3..9) and this keeps everything in place.
+        for i in range(1, n):
+            v = s[i]
+            j = i - 1
+            while j >= 0 and s[j] > v:
+                s[j + 1] = s[j]
+                j -= 1
+            s[j + 1] = v
+        return s[n >> 1]
+
+    def update(self, adc):
+        """Read adc through the pipeline and return the filtered 16-bit code."""
+        n = self.oversample
+        total = 0
+        for _ in range(n):
+            total += adc.read_u16()
+        value = total // n
+
+        if not self._primed:
+            for i in range(self.median):
+                self._ring[i] = value
+            self._ema = value << EMA_FRAC
+            self._out = value
+            self._primed = True
+
+        value = self._median(value)
+
+        if self.ema_shift:
+            self._ema += ((value << EMA_FRAC) - self._ema) >> self.ema_shift
+            value = self._ema >> EMA_FRAC
+
+        if self.decimate == 1:
+            self._out = value
+            return value
+        self._acc += value
+        self._count += 1
+        if self._count >= self.decimate:
+            self._out = self._acc // self.decimate
+            self._acc = 0
+            self._count = 0
+        return self._out
+
+    def reset(self):
+        self._primed = False
+        self._acc = 0
+        self._count = 0
+
+
+def build_filters(specs, count):
+    """Build `count` ChannelFilters from a config list (missing entries pass through)."""
+    out = []
+    for i in range(count):
+        spec = specs[i] if specs and i < len(specs) else {}
+        out.append(ChannelFilter(
+            spec.get("oversample", 1),
+            spec.get("median", 1),
+            spec.get("ema_shift", 0),
+            spec.get("decimate", 1),
+        ))
+    return out
@@ -0,0 +1,328 @@
+from array import array
+
+# Limits; anything larger is refused with the matching status code
+MAX_HEADER = 2048    # request line + headers, also the per-connection buffer
+MAX_HEADERS = 24     # header lines
+MAX_BODY = 4096      # Content-Length
+
+REASONS = {
+    400: "Bad Request",
+    411: "Length Required",
+    413: "Payload Too Large",
+    414: "URI Too Long",
+    431: "Request Header Fields Too Large",
+    501: "Not Implemented",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+        self.reason = REASONS.get(status, "Error")
+
+
+def unquote(s, plus=False):
+    """Decode %XX escapes (UTF-8 aware) and, for form data, '+' as space."""
+    if plus and "+" in s:
+        s = s.replace("+", " ")
+    if "%" not in s:
+        return s
+    parts = s.split("%")
+    out = bytearray(parts[0].encode())
+    for p in parts[1:]:
+        try:
+            if len(p) < 2:
+                raise ValueError
+            out.append(int(p[:2], 16))
+            out.extend(p[2:].encode())
+        except ValueError:
+            # Not an escape, keep it as written
+            out.extend(b"%")
+            out.extend(p.encode())
+    try:
+        return bytes(out).decode()
+    except UnicodeError:
+        return s
+
+
+def parse_qs(qs):
+    """Parse a query string or urlencoded form body into a dict."""
+    out = {}
+    if not qs:
+        return out
+    for pair in qs.split("&"):
+        if "=" in pair:
+            k, v = pair.split("=", 1)
+            out[unquote(k, True)] = unquote(v, True)
+        elif pair:
+            out[unquote(pair, True)] = ""
+    return out
+
+
+def response_head(req, status, ctype=None):
+    """Status line plus Connection (and Content-Type) headers for req."""
+    req.started = True
+    head = ("HTTP/1.1 " if req.version == "HTTP/1.1" else "HTTP/1.0 ") + status + "\r\n"
+    if ctype:
+        head += "Content-Type: " + ctype + "\r\n"
+    return head + ("Connection: keep-alive\r\n" if req.keep_alive else "Connection: close\r\n")
+
+
+async def send(cl, data):
+    if isinstance(data, str):
+        data = data.encode()
+    cl.write(data)
+    await cl.drain()
+
+
+async def respond(cl, req, status, body="", ctype=None, extra=""):
+    """Send a complete response with Content-Length, so the connection can be reused."""
+    if isinstance(body, str):
+        body = body.encode()
+    head = response_head(req, status, ctype) + extra + "Content-Length: {}\r\n\r\n".format(len(body))
+    cl.write(head.encode())
+    if body and req.method != "HEAD":
+        cl.write(body)
+    await cl.drain()
+
+
+async def redirect(cl, req, location, extra=""):
+    await respond(cl, req, "302 Found", extra=extra + "Location: " + location + "\r\n")
+
+
+def chunked_head(req, status, ctype, extra=""):
+    """Head of a response of unknown length: chunked on HTTP/1.1, close-delimited on 1.0."""
+    req.chunked = req.version == "HTTP/1.1"
+    if not req.chunked:
+        req.keep_alive = False
+    head = response_head(req, status, ctype) + extra
+    if req.chunked:
+        head += "Transfer-Encoding: chunked\r\n"
+    return head + "\r\n"
+
+
+async def start_chunked(cl, req, status, ctype, extra=""):
+    await send(cl, chunked_head(req, status, ctype, extra))
+
+
+def write_chunk(cl, req, data):
+    """Queue one chunk without draining; data must not be empty."""
+    if req.method == "HEAD":
+        return
+    if req.chunked:
+        cl.write("{:x}\r\n".format(len(data)).encode())
+        cl.write(data)
+        cl.write(b"\r\n")
+    else:
+        cl.write(data)
+
+
+async def send_chunk(cl, req, data):
+    if isinstance(data, str):
+        data = data.encode()
+    if not data:
+        return
+    write_chunk(cl, req, data)
+    await cl.drain()
+
+
+async def end_chunked(cl, req):
+    if req.chunked and req.method != "HEAD":
+        await send(cl, b"0\r\n\r\n")
+
+
+async def _readinto(reader, mv):
+    # MicroPython streams read straight into the buffer; CPython's
+    # StreamReader has no readinto, so copy what read() returns.
+    if hasattr(reader, "readinto"):
+        return await reader.readinto(mv)
+    data = await reader.read(len(mv))
+    mv[:len(data)] = data
+    return len(data)
+
+
+class Request:
+    """One parsed request. Reused: read() refills it from the same buffer.
+
+    Bytes received after the end of a request (pipelining) stay in the
+    buffer and are parsed by the next read().
+    """
+
+    __slots__ = ("buf", "mv", "method", "path", "query_string", "version",
+                 "headers", "body", "keep_alive", "chunked", "started", "_lines", "_query",
+                 "_cookies", "_carry")
+
+    def __init__(self, size=MAX_HEADER):
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.headers = {}
+        # Start offset of each line in buf, filled while scanning
+        self._lines = array("H", [0] * (MAX_HEADERS + 2))
+        self._carry = array("H", [0, 0])   # unparsed bytes after the last request
+        self._reset()
+
+    def _reset(self):
+        self.method = ""
+        self.path = ""
+        self.query_string = ""
+        self.version = ""
+        self.headers.clear()
+        self.body = b""
+        # Decided from the request; the server may still turn it off
+        self.keep_alive = False
+        # Set by the server while sending a chunked response
+        self.chunked = False
+        # Set once any of the response has been written
+        self.started = False
+        self._query = None
+        self._cookies = None
+
+    def header(self, name, default=None):
+        """Header value by lower-case name."""
+        return self.headers.get(name, default)
+
+    def query(self):
+        """Query string parameters, parsed on first use."""
+        if self._query is None:
+            self._query = parse_qs(self.query_string)
+        return self._query
+
+    def form(self):
+        """Urlencoded body parameters."""
+        return parse_qs(self.text())
+
+    def text(self):
+        return bytes(self.body).decode()
+
+    def cookie(self, name):
+        """Cookie value by name; the Cookie header is parsed on first use."""
+        if self._cookies is None:
+            self._cookies = {}
+            c = self.headers.get("cookie")
+            if c:
+                for part in c.split(";"):
+                    k, _, v = part.strip().partition("=")
+                    if k not in self._cookies:
+                        self._cookies[k] = v
+        return self._cookies.get(name)
+
+    async def read(self, reader):
+        """Read and parse one request. Returns False if the peer closed first."""
+        self._reset()
+        buf = self.buf
+        lines = self._lines
+        size = len(buf)
+        n = 0
+        carry = self._carry
+        if carry[1] > carry[0]:
+            n = carry[1] - carry[0]
+            buf[:n] = bytes(self.mv[carry[0]:carry[1]])
+        carry[0] = carry[1] = 0
+        i = 0
+        nlines = 0
+        lines[0] = 0
+        end = 0
+        # Scan only the newly received bytes for line ends, recording line
+        # starts, until the blank line that ends the headers. Bare LF line
+        # ends are accepted.
+        while True:
+            if i < n:
+                chunk = bytes(self.mv[i:n])   # bytearray has no find() on MicroPython
+                j = chunk.find(b"\n")
+                while j >= 0:
+                    eol = i + j
+                    start = lines[nlines]
+                    if eol == start or (eol - 1 == start and buf[start] == 13):
+                        end = eol + 1
+                        break
+                    nlines += 1
+                    if nlines > MAX_HEADERS:
+                        raise HTTPError(431)
+                    lines[nlines] = eol + 1
+                    j = chunk.find(b"\n", j + 1)
+                i = n
+                if end:
+                    break
+            if n == size:
+                raise HTTPError(431 if nlines else 414)
+            got = await _readinto(reader, self.mv[n:])
+            if not got:
+                if n == 0:
+                    return False
+                raise HTTPError(400)
+            n += got
+        if nlines == 0:
+            raise HTTPError(400)
+
+        try:
+            self._parse_head(nlines)
+        except (ValueError, UnicodeError, IndexError):
+            raise HTTPError(400)
+        await self._read_body(reader, end, n)
+        return True
+
+    def _line(self, k):
+        return bytes(self.mv[self._lines[k]:self._lines[k + 1]]).decode().strip()
+
+    def _parse_head(self, nlines):
+        parts = self._line(0).split(" ")
+        if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+            raise ValueError
+        self.method, target, self.version = parts
+        if "?" in target:
+            target, self.query_string = target.split("?", 1)
+        self.path = unquote(target)
+        headers = self.headers
+        for k in range(1, nlines):
+            line = self._line(k)
+            name, sep, value = line.partition(":")
+            if not sep:
+                raise ValueError
+            name = name.strip().lower()
+            value = value.strip()
+            if name in headers:
+                value = headers[name] + ("; " if name == "cookie" else ", ") + value
+            headers[name] = value
+        conn = headers.get("connection", "").lower()
+        if self.version == "HTTP/1.1":
+            self.keep_alive = "close" not in conn
+        else:
+            self.keep_alive = "keep-alive" in conn
+
+    async def _read_body(self, reader, end, n):
+        if "transfer-encoding" in self.headers:
+            # Chunked uploads are not needed by anything we serve
+            raise HTTPError(411 if self.method in ("POST", "PUT") else 501)
+        cl = self.headers.get("content-length")
+        if cl is None:
+            self._keep(end, n)
+            return
+        try:
+            length = int(cl)
+        except ValueError:
+            raise HTTPError(400)
+        if length < 0:
+            raise HTTPError(400)
+        if length > MAX_BODY:
+            raise HTTPError(413)
+        have = n - end
+        if end + length <= len(self.buf):
+            # Body fits behind the headers: read it into the same buffer
+            body = self.mv[end:end + length]
+        else:
+            body = memoryview(bytearray(length))
+            body[:min(have, length)] = self.mv[end:end + min(have, length)]
+        while have < length:
+            got = await _readinto(reader, body[have:])
+            if not got:
+                raise HTTPError(400)
+            have += got
+        self.body = body
+        if end + length <= len(self.buf):
+            self._keep(end + length, n)
+
+    def _keep(self, start, n):
+        if n > start:
+            self._carry[0] = start
+            self._carry[1] = n
@@ -0,0 +1,156 @@
+import json
+from httpreq import response_head, chunked_head, write_chunk
+
+BUF_SIZE = 768     # a full /api/v1/batch fits, so it goes out with Content-Length
+CTYPE = "application/json"
+
+
+def _plain(s):
+    """True if s can go out between quotes as it is: no quote, backslash
+    or control character, all of which JSON requires to be escaped."""
+    for ch in s:
+        if ch < " " or ch == '"' or ch == "\\":
+            return False
+    return True
+
+
+class JsonWriter:
+    """Serialise a JSON response straight into a reusable buffer.
+
+    Commas are inserted automatically. A document that fits the buffer is
+    sent with Content-Length in one write; a larger one switches to a
+    chunked (HTTP/1.0: close-delimited) response and the buffer is written
+    out each time it fills up.
+
+        w.begin(cl, req)
+        w.open()
+        w.item("s1", 1.23)
+        w.key("o")
+        w.value([0, 1])
+        w.close()
+        await w.end()
+    """
+
+    __slots__ = ("buf", "mv", "n", "cl", "req", "status", "spilled", "_comma")
+
+    def __init__(self, size=BUF_SIZE):
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.begin(None, None)
+
+    def begin(self, cl, req, status="200 OK"):
+        self.cl = cl
+        self.req = req
+        self.status = status
+        self.n = 0
+        self.spilled = False
+        self._comma = False
+
+    def _spill(self):
+        req = self.req
+        if not self.spilled:
+            self.spilled = True
+            self.cl.write(chunked_head(req, self.status, CTYPE).encode())
+        if self.n and req.method != "HEAD":
+            write_chunk(self.cl, req, self.mv[:self.n])
+        self.n = 0
+
+    def raw(self, data):
+        """Append bytes or an already-encoded JSON fragment."""
+        if isinstance(data, str):
+            data = data.encode()
+        size = len(data)
+        if self.n + size > len(self.buf):
+            self._spill()
+            if size > len(self.buf):
+                if self.req.method != "HEAD":
+                    write_chunk(self.cl, self.req, data)
+                return
+        self.buf[self.n:self.n + size] = data
+        self.n += size
+
+    def _sep(self):
+        if self._comma:
+            self.raw(b",")
+
+    def open(self, bracket=b"{"):
+        self._sep()
+        self.raw(bracket)
+        self._comma = False
+
+    def close(self, bracket=b"}"):
+        self.raw(bracket)
+        self._comma = True
+
+    def key(self, name):
+        self._sep()
+        if _plain(name):
+            self.raw(b'"')
+            self.raw(name)
+            self.raw(b'":')
+        else:
+            self.raw(json.dumps(name))
+            self.raw(b":")
+        self._comma = False
+
+    def value(self, v):
+        self._sep()
+        if v is None or v is True or v is False:
+            self.raw(b"null" if v is None else b"true" if v else b"false")
+        elif isinstance(v, int):
+            self.raw(str(v))
+        elif isinstance(v, float):
+            # NaN and infinity are not valid JSON
+            self.raw(str(v) if v == v and v - v == 0 else b"null")
+        elif isinstance(v, str):
+            if _plain(v):
+                self.raw(b'"')
+                self.raw(v)
+                self.raw(b'"')
+            else:
+                self.raw(json.dumps(v))
+        elif isinstance(v, dict):
+            self.open()
+            for k in v:
+                self.item(k, v[k])
+            self.close()
+            return
+        else:
+            self.open(b"[")
+            for x in v:
+                self.value(x)
+            self.close(b"]")
+            return
+        self._comma = True
+
+    def item(self, name, v):
+        self.key(name)
+        self.value(v)
+
+    async def end(self):
+        """Send what is left and drain the socket."""
+        cl, req = self.cl, self.req
+        if self.spilled:
+            self._spill()
+            if req.chunked and req.method != "HEAD":
+                cl.write(b"0\r\n\r\n")
+        else:
+            head = response_head(req, self.status, CTYPE)
+            cl.write((head + "Content-Length: {}\r\n\r\n".format(self.n)).encode())
+            if self.n and req.method != "HEAD":
+                cl.write(self.mv[:self.n])
+        await cl.drain()
+        self.cl = self.req = None
+
+
+# Free writers; one is taken per response in progress
+_free = []
+
+
+def writer():
+    return _free.pop() if _free else JsonWriter()
+
+
+def release(w):
+    w.cl = w.req = None
+    _free.append(w)
@@ -1,30 +1,360 @@
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+import struct
 import time
+from array import array
+import config
+from config import load_config
+import metrics
+from debug import logger
 
-LOG_FILE = "log.csv"
-LOG_INTERVAL = 10  # seconds
+log = logger("datalog")
+
+# log.bin is preallocated at SEGMENTS * SEGMENT_SIZE bytes and used as a ring.
+# Each segment starts with a header; the segment with the highest sequence
+# number is the one being written, the one after it is the oldest.
+#
+#   header: magic, segment sequence, record size, records per segment
+#   record: time, s1, s2, s3 (float32), input bits, output bits, checksum
+#
+# Unwritten space is 0xFF, so a record whose timestamp is 0xFFFFFFFF marks
+# the end of a segment and a bad checksum marks a torn write.
+LOG_FILE = "log.bin"
+MAGIC = b"PSLG"
+HEADER = "<4sIHH"
+HEADER_SIZE = 12
+RECORD = "<IfffBBB"
+RECORD_SIZE = 19
+EMPTY = 0xFFFFFFFF
+
+cfg = load_config().get("logging", {})
+LOG_INTERVAL = cfg.get("interval_s", 10)     # seconds between records
+FLUSH_INTERVAL = cfg.get("flush_s", 60)      # seconds between flash writes
+# The buffer and file geometry below are fixed until the next boot
+BATCH = cfg.get("batch", 16)                 # records held in RAM before a forced flush
+SEGMENTS = cfg.get("segments", 16)
+SEGMENT_SIZE = cfg.get("segment_size", 4096)
+PER_SEGMENT = (SEGMENT_SIZE - HEADER_SIZE) // RECORD_SIZE
+
+_batch = bytearray(BATCH * RECORD_SIZE)
+_pending = 0
+_seg = 0      # segment being written
+_seq = 0      # its sequence number
+_count = 0    # records already in it
 _last_log = 0
+_ready = False
+errors = 0
+
+# Seek index: sequence number and first timestamp of every segment, so a
+# time range query only opens the segments that overlap it.
+_seqs = array("I", [0] * SEGMENTS)
+_first = array("I", [EMPTY] * SEGMENTS)
+_last_ts = 0
+# Added to time.time() when the clock restarted behind the log (no RTC)
+_clock_offset = 0
+
+
+def apply_config(cfg):
+    global LOG_INTERVAL, FLUSH_INTERVAL
+    s = cfg.get("logging", {})
+    LOG_INTERVAL = s.get("interval_s", 10)
+    FLUSH_INTERVAL = s.get("flush_s", 60)
+
+
+config.subscribe(apply_config, "logging")
+
+
+def _checksum(buf, off):
+    c = 0
+    for i in range(off, off + RECORD_SIZE - 1):
+        c += buf[i]
+    return c & 0xFF
+
+
+def _bits(values):
+    b = 0
+    for i in range(len(values)):
+        if values[i]:
+            b |= 1 << i
+    return b
+
+
+def _valid(buf, off=0):
+    ts = struct.unpack_from("<I", buf, off)[0]
+    return ts != EMPTY and buf[off + RECORD_SIZE - 1] == _checksum(buf, off)
+
+
+def _error(msg, e):
+    global errors
+    errors += 1
+    log.error("Logger {} failed: {}", msg, e)
+
+
+def _create():
+    log("Creating {} ({} segments of {} bytes)", LOG_FILE, SEGMENTS, SEGMENT_SIZE)
+    blank = b"\xff" * 256
+    left = SEGMENTS * SEGMENT_SIZE
+    with open(LOG_FILE, "wb") as f:
+        # segment_size need not be a multiple of the block written
+        while left > 0:
+            n = min(left, 256)
+            f.write(blank[:n])
+            left -= n
+
+
+def _start_segment(f, seg, seq):
+    """Erase a segment and stamp its header before any records go in.
+
+    The header goes last: a reset mid-erase must leave the segment under
+    its old sequence number, not old records under the newest one.
+    """
+    global _seg, _seq, _count
+    _seqs[seg] = seq
+    _first[seg] = EMPTY
+    blank = b"\xff" * 256
+    f.seek(seg * SEGMENT_SIZE + HEADER_SIZE)
+    left = SEGMENT_SIZE - HEADER_SIZE
+    while left > 0:
+        n = min(left, 256)
+        f.write(blank[:n])
+        left -= n
+    f.flush()
+    f.seek(seg * SEGMENT_SIZE)
+    f.write(struct.pack(HEADER, MAGIC, seq, RECORD_SIZE, PER_SEGMENT))
+    _seg, _seq, _count = seg, seq, 0
+
+
+def _headers(f):
+    """Yield (segment, sequence) for every segment with a valid header."""
+    hdr = bytearray(HEADER_SIZE)
+    for seg in range(SEGMENTS):
+        f.seek(seg * SEGMENT_SIZE)
+        if f.readinto(hdr) != HEADER_SIZE:
+            return
+        magic, seq, rsize, per = struct.unpack(HEADER, hdr)
+        if magic == MAGIC and rsize == RECORD_SIZE and per == PER_SEGMENT:
+            yield seg, seq
+
+
+def _record_ts(f, seg, idx):
+    f.seek(seg * SEGMENT_SIZE + HEADER_SIZE + idx * RECORD_SIZE)
+    b = f.read(4)
+    return struct.unpack("<I", b)[0] if len(b) == 4 else EMPTY
+
+
+def _recover():
+    """Find the write position left by the previous boot and rebuild the index."""
+    global _seg, _seq, _count, _last_ts
+    for i in range(SEGMENTS):
+        _seqs[i] = 0
+        _first[i] = EMPTY
+    try:
+        with open(LOG_FILE, "rb") as f:
+            f.seek(0, 2)
+            if f.tell() != SEGMENTS * SEGMENT_SIZE:
+                raise OSError("size mismatch")
+            best = None
+            for seg, seq in _headers(f):
+                _seqs[seg] = seq
+                _first[seg] = _record_ts(f, seg, 0)
+                if best is None or seq > best[1]:
+                    best = (seg, seq)
+            if best is None:
+                raise OSError("no segments")
+            _seg, _seq = best
+            rec = bytearray(RECORD_SIZE)
+            _count = 0
+            f.seek(_seg * SEGMENT_SIZE + HEADER_SIZE)
+            while _count < PER_SEGMENT and f.readinto(rec) == RECORD_SIZE and _valid(rec):
+                _last_ts = struct.unpack_from("<I", rec)[0]
+                _count += 1
+            if not _count:
+                _first[_seg] = EMPTY
+                for i in range(SEGMENTS):
+                    if _first[i] != EMPTY and _first[i] > _last_ts:
+                        _last_ts = _first[i]
+        log("Log resumed at segment {} seq {} ({} records)", _seg, _seq, _count)
+    except OSError as e:
+        log.warn("Log reset: {}", e)
+        _create()
+        with open(LOG_FILE, "r+b") as f:
+            _start_segment(f, 0, 1)
+
+
+def init_logger():
+    global _ready, _clock_offset
+    try:
+        _recover()
+        _ready = True
+    except Exception as e:
+        _error("init", e)
+    # Without an RTC the clock restarts on every boot. Keep logged time
+    # moving forward so the log stays sorted for range queries.
+    t = int(time.time())
+    if t < _last_ts:
+        _clock_offset = _last_ts - t + LOG_INTERVAL
+        log.warn("Clock behind log by {} s, offsetting timestamps", _clock_offset)
+
+
+def now():
+    """Current time on the log's timeline."""
+    return int(time.time()) + _clock_offset
+
 
-def log_data(data):
+def _append(ts, snap, din_bits):
+    global _pending
+    off = _pending * RECORD_SIZE
+    v = snap.voltage
+    struct.pack_into(RECORD, _batch, off, int(ts), v[0], v[1], v[2],
+                     din_bits, _bits(snap.dout), 0)
+    _batch[off + RECORD_SIZE - 1] = _checksum(_batch, off)
+    _pending += 1
+    if _pending >= BATCH:
+        flush()
+
+
+def log_data(snap):
     global _last_log
-    now = time.time()
+    ts = now()
 
-    if now - _last_log < LOG_INTERVAL:
+    if ts - _last_log < LOG_INTERVAL:
         return
 
-    _last_log = now
+    _last_log = ts
+    _append(ts, snap, _bits(snap.din))
+
+
+def log_event(snap, din_bits):
+    """Record an input state change now, outside the logging interval."""
+    _append(now(), snap, din_bits)
 
+
+def flush():
+    """Write batched records to flash, rolling into the next segment when full."""
+    global _pending, _count
+    if not _pending or not _ready:
+        return
+    mv = memoryview(_batch)
+    done = 0
+    timed = metrics.ENABLED
+    if timed:
+        t0 = time.ticks_us()
     try:
-        with open(LOG_FILE, "a") as f:
-            line = "{},{},{},{},{},{},{}\n".format(
-                now,
-                data["s1"],
-                data["s2"],
-                data["s3"],
-                data["i0"],
-                data["i1"],
-                data["o0"],
-                data["o1"]
-            )
-            f.write(line)
-    except:
-        pass
+        with open(LOG_FILE, "r+b") as f:
+            while done < _pending:
+                if _count >= PER_SEGMENT:
+                    _start_segment(f, (_seg + 1) % SEGMENTS, _seq + 1)
+                n = min(_pending - done, PER_SEGMENT - _count)
+                if not _count:
+                    _first[_seg] = struct.unpack_from("<I", _batch, done * RECORD_SIZE)[0]
+                f.seek(_seg * SEGMENT_SIZE + HEADER_SIZE + _count * RECORD_SIZE)
+                f.write(mv[done * RECORD_SIZE:(done + n) * RECORD_SIZE])
+                _count += n
+                done += n
+    except Exception as e:
+        _error("flush", e)
+    finally:
+        # Whatever was written is on flash; drop the rest rather than
+        # retrying a failing write forever.
+        _pending = 0
+        if timed:
+            metrics.log_flush_us.observe(time.ticks_diff(time.ticks_us(), t0))
+
+
+async def flush_task():
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        flush()
+
+
+def _order():
+    """Segments holding records, oldest first."""
+    segs = [i for i in range(SEGMENTS) if _seqs[i] and _first[i] != EMPTY]
+    segs.sort(key=lambda i: _seqs[i])
+    return segs
+
+
+def _seek(f, seg, t):
+    """Index of the first record in seg with timestamp >= t (binary search)."""
+    lo, hi = 0, PER_SEGMENT
+    while lo < hi:
+        mid = (lo + hi) >> 1
+        if _record_ts(f, seg, mid) < t:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def iter_records(t_from=0, t_to=EMPTY):
+    """Yield (time, s1, s2, s3, inputs, outputs) with t_from <= time <= t_to, oldest first."""
+    flush()
+    rec = bytearray(RECORD_SIZE)
+    segs = _order()
+    with open(LOG_FILE, "rb") as f:
+        for n, seg in enumerate(segs):
+            if _first[seg] > t_to:
+                return
+            # Whole segment is older than the range if the next one starts before it
+            if n + 1 < len(segs) and _first[segs[n + 1]] <= t_from:
+                continue
+            idx = _seek(f, seg, t_from) if _first[seg] < t_from else 0
+            f.seek(seg * SEGMENT_SIZE + HEADER_SIZE + idx * RECORD_SIZE)
+            for _ in range(idx, PER_SEGMENT):
+                if f.readinto(rec) != RECORD_SIZE or not _valid(rec):
+                    break
+                r = struct.unpack_from(RECORD, rec)
+                if r[0] > t_to:
+                    return
+                yield r[:6]
+
+
+def history(t_from, t_to, points):
+    """
+    Downsample [t_from, t_to] into `points` equal time buckets. Yields
+    (bucket_start, count, min1, mean1, max1, min2, mean2, max2, min3, mean3, max3)
+    for every bucket that holds records.
+    """
+    step = max(1, (t_to - t_from + points) // points)
+    bucket = None
+    n = 0
+    lo = [0.0] * 3
+    hi = [0.0] * 3
+    total = [0.0] * 3
+    for r in iter_records(t_from, t_to):
+        b = t_from + (r[0] - t_from) // step * step
+        if b != bucket:
+            if n:
+                yield _bucket(bucket, n, lo, total, hi)
+            bucket = b
+            n = 0
+        for c in range(3):
+            v = r[c + 1]
+            if not n:
+                lo[c] = hi[c] = total[c] = v
+            else:
+                if v < lo[c]:
+                    lo[c] = v
+                if v > hi[c]:
+                    hi[c] = v
+                total[c] += v
+        n += 1
+    if n:
+        yield _bucket(bucket, n, lo, total, hi)
+
+
+def _bucket(t, n, lo, total, hi):
+    return (t, n,
+            lo[0], total[0] / n, hi[0],
+            lo[1], total[1] / n, hi[1],
+            lo[2], total[2] / n, hi[2])
+
+
+def csv_lines():
+    """Yield the log as CSV text lines (the format log.csv used to have)."""
+    yield "time,s1,s2,s3,i0,i1,o0,o1\n"
+    for ts, s1, s2, s3, din, dout in iter_records():
+        yield "{},{},{},{},{},{},{},{}\n".format(
+            ts, s1, s2, s3, din & 1, din >> 1 & 1, dout & 1, dout >> 1 & 1)
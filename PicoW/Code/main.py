@@ -1,10 +1,24 @@
 import time
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
 from network_ap import start_ap
 from sensors import init_sensors
+from alarms import init_alarms
 from digital_io import init_digital
 from webserver import serve
-from mqtt_client import mqtt_connect
-from debug import log
+from sampler import sample_task
+from stream import stream_task
+from logger import init_logger, flush_task
+from mqtt_client import mqtt_task
+from commands import command_task
+from metrics import gc_collect, metrics_task
+import debug
+from debug import logger
+
+log = logger("main")
+debug.init()
 
 AP = True
 SENS = True
@@ -38,6 +52,7 @@ if AP:
 if SENS:
     log("Starting sensors...")
     init_sensors()
+    init_alarms()
     time.sleep(0.25)
     
 if DIGI:
@@ -45,12 +60,35 @@ if DIGI:
     init_digital()
     time.sleep(0.25)
 
-if WEB:
-    log("Starting webserver...")
-    serve()
-    time.sleep(0.25)
-    
-if MQTT:
-    mqtt_connect()
-    log("mqtt_connect")
-    time.sleep(0.25)
+GC_INTERVAL = 5  # seconds between background collections
+
+
+async def housekeeping():
+    while True:
+        gc_collect()
+        await asyncio.sleep(GC_INTERVAL)
+
+
+async def run():
+    if MQTT:
+        log("Starting MQTT...")
+        asyncio.create_task(mqtt_task())
+        asyncio.create_task(command_task())
+        asyncio.create_task(metrics_task())
+
+    if SENS or DIGI:
+        log("Starting logger...")
+        init_logger()
+        asyncio.create_task(flush_task())
+        log("Starting sampler...")
+        asyncio.create_task(sample_task())
+
+    if WEB:
+        log("Starting webserver...")
+        await serve()
+        asyncio.create_task(stream_task())
+
+    await housekeeping()
+
+
+asyncio.run(run())
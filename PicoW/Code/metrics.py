@@ -0,0 +1,228 @@
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+from array import array
+import gc
+import json
+import time
+import config
+from config import load_config
+import mqtt_client
+import debug
+from mqtt_client import mqtt_publish
+from debug import logger
+
+log = logger("metrics")
+
+# From the "metrics" config section, see apply_config(). When disabled the
+# instrumented code skips its ticks_us() calls and nothing is recorded.
+ENABLED = True
+PUBLIC = False            # /metrics without login, for a Prometheus scraper (read at boot)
+MQTT_INTERVAL_S = 0       # publish a summary to <topic>/metrics, 0 = off
+
+
+def apply_config(cfg):
+    global ENABLED, PUBLIC, MQTT_INTERVAL_S
+    m = cfg.get("metrics", {})
+    ENABLED = m.get("enabled", True)
+    PUBLIC = m.get("public", False)
+    MQTT_INTERVAL_S = m.get("mqtt_interval_s", 0)
+
+
+apply_config(load_config())
+config.subscribe(apply_config, "metrics")
+
+# Histogram bucket upper bounds, microseconds
+HTTP_BUCKETS = (1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 500000, 1000000)
+FAST_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 100000)
+
+
+class Histogram:
+    """Counts of observed durations (µs) per bucket, plus their sum and max."""
+
+    __slots__ = ("bounds", "counts", "sum", "max")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = array("I", [0] * (len(bounds) + 1))   # last one is +Inf
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, us):
+        bounds = self.bounds
+        i = 0
+        n = len(bounds)
+        while i < n and us > bounds[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += us
+        if us > self.max:
+            self.max = us
+
+    def count(self):
+        return sum(self.counts)
+
+
+# --------------------------
+# Instruments
+# --------------------------
+sample_us = Histogram(FAST_BUCKETS)       # one sampling period's work: acquire, log, publish
+sample_late_us = Histogram(FAST_BUCKETS)  # wake-up after the sampling deadline
+sample_overruns = 0
+log_flush_us = Histogram(FAST_BUCKETS)    # one batched write to flash
+gc_runs = 0
+gc_us = 0
+gc_max_us = 0
+heap_min_free = -1
+
+# fn(out) callables adding lines to the exposition, see collector()
+_collectors = []
+
+
+def collector(fn):
+    """Register fn(out) to add its metrics to /metrics; out(line) takes one line."""
+    _collectors.append(fn)
+    return fn
+
+
+def gc_collect():
+    """gc.collect(), timed when enabled."""
+    global gc_runs, gc_us, gc_max_us
+    uptime()
+    if not ENABLED:
+        gc.collect()
+        return
+    t0 = time.ticks_us()
+    gc.collect()
+    dt = time.ticks_diff(time.ticks_us(), t0)
+    gc_runs += 1
+    gc_us += dt
+    if dt > gc_max_us:
+        gc_max_us = dt
+    _heap_low()
+
+
+def _heap_low():
+    global heap_min_free
+    if hasattr(gc, "mem_free"):
+        free = gc.mem_free()
+        if heap_min_free < 0 or free < heap_min_free:
+            heap_min_free = free
+
+
+# --------------------------
+# Prometheus text format
+# --------------------------
+def header(out, name, kind, text):
+    out("# HELP picosens_{} {}\n# TYPE picosens_{} {}\n".format(name, text, name, kind))
+
+
+def value(out, name, v, labels=""):
+    out("picosens_{}{} {}\n".format(name, "{" + labels + "}" if labels else "", v))
+
+
+def histogram(out, name, h, labels=""):
+    """Bucket, sum and count lines of h, in seconds."""
+    sep = labels + "," if labels else ""
+    total = 0
+    for i in range(len(h.bounds)):
+        total += h.counts[i]
+        out('picosens_{}_bucket{{{}le="{}"}} {}\n'.format(name, sep, h.bounds[i] / 1000000, total))
+    total += h.counts[-1]
+    out('picosens_{}_bucket{{{}le="+Inf"}} {}\n'.format(name, sep, total))
+    lab = "{" + labels + "}" if labels else ""
+    out("picosens_{}_sum{} {}\n".format(name, lab, h.sum / 1000000))
+    out("picosens_{}_count{} {}\n".format(name, lab, total))
+
+
+def gauge(out, name, v, text):
+    header(out, name, "gauge", text)
+    value(out, name, v)
+
+
+def counter(out, name, v, text):
+    header(out, name, "counter", text)
+    value(out, name, v)
+
+
+# Uptime: ticks_ms differences added up, since ticks_ms itself wraps after
+# 12 days and time.time() jumps when NTP sets the clock
+_up_ms = 0
+_up_last = time.ticks_ms()
+
+
+def uptime():
+    """Seconds since boot. gc_collect() calls it every few seconds, so no
+    two readings are more than half a ticks_ms period apart."""
+    global _up_ms, _up_last
+    now = time.ticks_ms()
+    _up_ms += time.ticks_diff(now, _up_last)
+    _up_last = now
+    return _up_ms // 1000
+
+
+@collector
+def _system(out):
+    _heap_low()
+    gauge(out, "uptime_seconds", uptime(), "Seconds since boot")
+    if hasattr(gc, "mem_free"):
+        gauge(out, "heap_free_bytes", gc.mem_free(), "Free heap")
+        gauge(out, "heap_alloc_bytes", gc.mem_alloc(), "Allocated heap")
+        gauge(out, "heap_min_free_bytes", heap_min_free, "Lowest free heap seen")
+    counter(out, "gc_runs_total", gc_runs, "Background collections")
+    counter(out, "gc_seconds_total", gc_us / 1000000, "Time spent in background collections")
+    gauge(out, "gc_max_seconds", gc_max_us / 1000000, "Longest background collection")
+    header(out, "sample_duration_seconds", "histogram", "Work per sampling period (acquire, log, publish)")
+    histogram(out, "sample_duration_seconds", sample_us)
+    header(out, "sample_lateness_seconds", "histogram", "Sampling wake-up after its deadline")
+    histogram(out, "sample_lateness_seconds", sample_late_us)
+    counter(out, "sample_overruns_total", sample_overruns, "Sampling periods missed")
+    header(out, "log_flush_seconds", "histogram", "Batched log write to flash")
+    histogram(out, "log_flush_seconds", log_flush_us)
+    counter(out, "log_messages_total", debug.seq, "Log messages recorded")
+    counter(out, "log_dropped_total", debug.dropped, "Repeated log messages dropped by the rate limit")
+
+
+@collector
+def _mqtt(out):
+    gauge(out, "mqtt_connected", 1 if mqtt_client.connected else 0, "Broker connection up")
+    gauge(out, "mqtt_queue_depth", mqtt_client.queue_depth(), "Messages waiting to be sent")
+    gauge(out, "mqtt_inflight", mqtt_client.inflight_depth(), "QoS 1/2 messages awaiting acknowledgement")
+    counter(out, "mqtt_reconnects_total", mqtt_client.reconnects, "Broker reconnections")
+    counter(out, "mqtt_dropped_total", mqtt_client.dropped, "Messages dropped with a full queue")
+    counter(out, "mqtt_spooled_total", mqtt_client.spooled, "Messages spooled to flash while offline")
+
+
+def render(out):
+    """Write the whole exposition through out(line)."""
+    for fn in _collectors:
+        try:
+            fn(out)
+        except Exception as e:
+            log.error("Metrics collector failed: {}", e)
+
+
+def summary():
+    """Small dict for the MQTT summary."""
+    return {
+        "uptime_s": uptime(),
+        "heap_free": gc.mem_free() if hasattr(gc, "mem_free") else -1,
+        "heap_min_free": heap_min_free,
+        "gc_runs": gc_runs,
+        "gc_max_ms": gc_max_us // 1000,
+        "samples": sample_us.count(),
+        "sample_max_ms": sample_us.max // 1000,
+        "sample_late_max_ms": sample_late_us.max // 1000,
+        "sample_overruns": sample_overruns,
+        "log_flush_max_ms": log_flush_us.max // 1000,
+    }
+
+
+async def metrics_task():
+    while True:
+        if ENABLED and MQTT_INTERVAL_S > 0:
+            await asyncio.sleep(MQTT_INTERVAL_S)
+            mqtt_publish(json.dumps(summary()), config.get("mqtt", "topic") + "/metrics")
+        else:
+            await asyncio.sleep(5)
@@ -1,32 +1,315 @@
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+import os
+import struct
+import time
 from umqtt.simple import MQTTClient
+import config
 from config import load_config
+from debug import logger
 
-_client = None
+log = logger("mqtt")
 
-def mqtt_connect():
-    global _client
-    cfg = load_config()
+SPOOL_FILE = "mqtt_spool.bin"
+
+_client = None        # kept across reconnects so its in-flight window survives
+_topic = None
+_settings = {}
+_queue = []           # (topic, payload) waiting to be sent, oldest first
+_reconnect = False    # set by config changes to force a fresh session
+_resubscribe = False  # set when the command topic changed
+_subscribed = None    # command topic filter subscribed in this session
+_spool_pos = -1       # read offset while the spool is being replayed, else -1
+_inbox = []           # (topic, payload) received on <topic>/cmd/#, oldest first
+INBOX_MAX = 16
+
+# Set when a command arrives; commands.command_task() waits on it
+received = asyncio.Event()
+
+# Counters, read by the web/metrics side
+connected = False
+reconnects = 0
+dropped = 0
+spooled = 0
+
+
+# Settings the connection is made with; changing any needs a new session
+CONNECT_KEYS = ("broker", "port", "user", "password", "client_id", "keepalive",
+                "clean_session", "max_inflight")
+
+
+def apply_config(cfg):
+    global _topic, _settings, _reconnect, _resubscribe
+    m = cfg["mqtt"]
+    old, old_topic = _settings, _topic
+    _topic = m["topic"]
+    _settings = {
+        "enabled": m.get("enabled", False),
+        "client_id": m["client_id"],
+        "broker": m["broker"],
+        "port": m.get("port", 1883),
+        "user": m.get("user"),
+        "password": m.get("password"),
+        "keepalive": m.get("keepalive", 60),
+        "qos": m.get("qos", 0),
+        "max_inflight": m.get("max_inflight", 8),
+        # A persistent session lets unacknowledged QoS 1/2 messages be
+        # retransmitted after a reconnect.
+        "clean_session": m.get("clean_session", not m.get("qos", 0)),
+        "timeout": m.get("timeout", 2),
+        "queue": m.get("queue", 64),
+        "batch": m.get("batch", 8),
+        "backoff_max": m.get("backoff_max", 60),
+        "spill": m.get("spill", False),
+        "spill_max": m.get("spill_max", 32768),
+        "commands": m.get("commands", False),
+    }
+    # Anything else (topic, queue sizes, publish settings) applies to the
+    # running session, which keeps its in-flight window
+    for k in CONNECT_KEYS:
+        if old.get(k) != _settings[k]:
+            _reconnect = True
+    if old_topic != _topic or old.get("commands") != _settings["commands"]:
+        _resubscribe = True
+
+
+apply_config(load_config())
+config.subscribe(apply_config, "mqtt")
 
-    if not cfg["mqtt"]["enabled"]:
-        return
 
+# --------------------------
+# Outbound queue
+# --------------------------
+def _spill(topic, payload):
+    global spooled
     try:
-        _client = MQTTClient(
-            cfg["mqtt"]["client_id"],
-            cfg["mqtt"]["broker"],
-            port=cfg["mqtt"]["port"]
-        )
-        _client.connect()
-    except:
-        _client = None
+        try:
+            size = os.stat(SPOOL_FILE)[6]
+        except OSError:
+            size = 0
+        if size + 4 + len(topic) + len(payload) > _settings["spill_max"]:
+            return False
+        with open(SPOOL_FILE, "ab") as f:
+            f.write(struct.pack("<HH", len(topic), len(payload)))
+            f.write(topic)
+            f.write(payload)
+        spooled += 1
+        return True
+    except Exception as e:
+        log.warn("MQTT spool write failed: {}", e)
+        return False
 
-def mqtt_publish(payload):
-    global _client
-    if not _client:
+
+def mqtt_publish(payload, topic=None):
+    """Queue a message. Never blocks; the oldest message is dropped (or spilled) when full."""
+    global dropped
+    if not _settings["enabled"]:
         return
+    if isinstance(payload, str):
+        payload = payload.encode()
+    t = topic or _topic
+    if isinstance(t, str):
+        t = t.encode()
+    if len(_queue) >= _settings["queue"]:
+        old = _queue.pop(0)
+        if not (_settings["spill"] and _spill(*old)):
+            dropped += 1
+    _queue.append((t, payload))
+
+
+def _on_message(topic, payload):
+    global dropped
+    # Called from inside check_msg(); just queue it for command_task()
+    if len(_inbox) >= INBOX_MAX:
+        _inbox.pop(0)
+        dropped += 1
+    _inbox.append((topic, payload))
+    received.set()
+
+
+def next_command():
+    """Oldest received (topic, payload), or None."""
+    return _inbox.pop(0) if _inbox else None
+
+
+def queue_depth():
+    return len(_queue)
+
+
+def inflight_depth():
+    return len(_client.inflight) if _client else 0
 
+
+# --------------------------
+# Connection handling
+# --------------------------
+def _connect():
+    global _client
+    s = _settings
+    log("MQTT connecting to {}:{}", s["broker"], s["port"])
+    if _client is None:
+        _client = MQTTClient(s["client_id"], s["broker"], port=s["port"],
+                             user=s["user"], password=s["password"],
+                             keepalive=s["keepalive"], max_inflight=s["max_inflight"])
+        _client.set_callback(_on_message)
+    # umqtt is blocking; the socket timeout bounds how long a dead broker
+    # can hold up the event loop. With a persistent session connect()
+    # also resends whatever was still in flight, flagged DUP.
+    _client.connect(clean_session=s["clean_session"], timeout=s["timeout"])
+    _subscribe(None)
+
+
+def _subscribe(current):
+    """Subscribe to the command topic, replacing the filter current if it differs."""
+    global _subscribed, _resubscribe
+    _resubscribe = False
+    want = _topic + "/cmd/#" if _settings["commands"] else None
+    if current and current != want:
+        _client.unsubscribe(current)
+    if want and want != current:
+        _client.subscribe(want, qos=1)
+    _subscribed = want
+
+
+def _close(forget=False):
+    """Drop the connection; forget=True also discards the session state."""
+    global _client, connected
+    if _client and _client.sock:
+        try:
+            _client.sock.close()
+        except Exception:
+            pass
+    if forget:
+        _client = None
+    connected = False
+
+
+def _service():
+    """Process everything the broker sent (acks, PINGRESP) without blocking."""
+    for _ in range(_settings["max_inflight"] * 2 + 4):
+        if _client.check_msg() is None:
+            break
+
+
+def _send_batch():
+    """Publish up to `batch` queued messages.
+
+    QoS 0 messages leave the queue once written, so a failed write is
+    retried. QoS 1/2 messages leave it before publish(): the client's
+    in-flight window owns them from then on and resends them after a
+    reconnect, so keeping them queued as well would send them twice.
+    """
+    n = 0
+    qos = _settings["qos"]
+    while _queue and n < _settings["batch"]:
+        if qos and len(_client.inflight) >= _client.max_inflight:
+            # Window full: wait for acks rather than block in publish()
+            break
+        if qos:
+            topic, payload = _queue.pop(0)
+            _client.publish(topic, payload, qos=qos)
+        else:
+            topic, payload = _queue[0]
+            _client.publish(topic, payload)
+            _queue.pop(0)
+        n += 1
+    return n
+
+
+def _replay_spool():
+    """Send up to `batch` messages spilled to flash while offline.
+
+    Called once per loop pass until the spool is empty, then removes it.
+    The position survives reconnects and moves past a message the same
+    way _send_batch() pops it: after the write for QoS 0, before it for
+    QoS 1/2.
+    """
+    global _spool_pos, spooled
+    n = 0
+    qos = _settings["qos"]
     try:
-        topic = load_config()["mqtt"]["topic"]
-        _client.publish(topic, payload)
-    except:
-        pass
+        f = open(SPOOL_FILE, "rb")
+    except OSError:
+        _spool_pos = -1
+        return 0
+    done = False
+    with f:
+        f.seek(_spool_pos)
+        while n < _settings["batch"]:
+            if qos and len(_client.inflight) >= _client.max_inflight:
+                break
+            hdr = f.read(4)
+            if len(hdr) < 4:
+                done = True
+                break
+            tl, pl = struct.unpack("<HH", hdr)
+            topic, payload = f.read(tl), f.read(pl)
+            pos = f.tell()
+            if qos:
+                _spool_pos = pos
+            _client.publish(topic, payload, qos=qos)
+            _spool_pos = pos
+            n += 1
+    if done:
+        os.remove(SPOOL_FILE)
+        _spool_pos = -1
+        spooled = 0
+    return n
+
+
+async def mqtt_task():
+    global connected, reconnects, _reconnect, _spool_pos
+    backoff = 1
+    last_tx = time.ticks_ms()
+    while True:
+        if not _settings["enabled"]:
+            _close(forget=True)
+            await asyncio.sleep(5)
+            continue
+
+        if _reconnect:
+            _reconnect = False
+            _close(forget=True)
+
+        if not connected:
+            try:
+                _connect()
+                connected = True
+                backoff = 1
+                last_tx = time.ticks_ms()
+                log("MQTT connected")
+                if _settings["spill"] and _spool_pos < 0:
+                    _spool_pos = 0
+            except Exception as e:
+                _close()
+                reconnects += 1
+                log.warn("MQTT connect failed ({}), retry in {} s", e, backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, _settings["backoff_max"])
+                continue
+
+        try:
+            _service()
+            if _resubscribe:
+                _subscribe(_subscribed)
+            # Spooled messages are older than the queue: send them first
+            if _replay_spool() if _spool_pos >= 0 else _send_batch():
+                last_tx = time.ticks_ms()
+            elif time.ticks_diff(time.ticks_ms(), last_tx) > _settings["keepalive"] * 500:
+                # Nothing published for half the keepalive period
+                _client.ping()
+                last_tx = time.ticks_ms()
+        except Exception as e:
+            log.warn("MQTT connection lost: {}", e)
+            _close()
+            reconnects += 1
+            continue
+
+        # Yield only while there is something sendable; an empty queue or a
+        # full QoS window both wait for the next tick
+        busy = _queue or _spool_pos >= 0
+        if busy and _settings["qos"]:
+            busy = len(_client.inflight) < _client.max_inflight
+        await asyncio.sleep(0 if busy else 0.1)
@@ -2,7 +2,9 @@ import network
 import time
 from machine import Pin
 from config import load_config
-from debug import log
+from debug import logger
+
+log = logger("wifi")
 
 led = Pin("LED", Pin.OUT)
 
@@ -0,0 +1,166 @@
+import struct
+import time
+from array import array
+import config
+from config import load_config
+from mqtt_client import mqtt_publish
+
+# mqtt.publish.mode:
+#   "snapshot" - one message per sample on <topic> (the original behaviour)
+#   "channels" - one message per changed value on <topic>/<key>
+# mqtt.publish.format:
+#   "json"     - snapshot as JSON, channel values as plain text
+#   "binary"   - struct-packed, see the layouts below
+#
+# Report by exception: analog channels are only sent when they move more
+# than their deadband (engineering units), digital ones when they change,
+# and everything is re-sent after max_interval_s regardless.
+
+# Binary snapshot: version, time, e1..e3 (milli-units), fault bits (2 per
+# channel), input bits, output bits. 20 bytes against ~180 for the JSON.
+SNAPSHOT_FMT = "<BIiiiBBB"
+SNAPSHOT_VERSION = 1
+# Binary channel value: time, milli-units (analog) or 0/1 (digital)
+CHANNEL_FMT = "<Ii"
+# Input state change on <topic>/event/i<n> (digital_io events):
+#   {"seq": 12, "t": 1700000000, "v": 1, "count": 40}  or binary
+# Binary event: sequence, time, level, pulse count
+EVENT_FMT = "<IIBI"
+
+ANALOG = ("s1", "s2", "s3")
+DIGITAL = ("i0", "i1", "o0", "o1")
+
+_mode = "snapshot"
+_binary = False
+_deadband = array("i", [0] * len(ANALOG))     # milli-units
+_max_interval_ms = 60000
+_topics = []                                  # per-channel topic bytes
+_event_topics = []
+
+# Last published state, for report by exception
+_last_eng = array("i", [0] * len(ANALOG))
+_last_dig = array("h", [-1] * len(DIGITAL))
+_last_ms = array("i", [0] * (len(ANALOG) + len(DIGITAL)))
+_forced = True
+
+# Counters for benchmarks and metrics
+published = 0
+suppressed = 0
+
+
+def apply_config(cfg):
+    global _mode, _binary, _max_interval_ms, _topics, _event_topics, _forced
+    m = cfg["mqtt"]
+    p = m.get("publish", {})
+    _mode = p.get("mode", "snapshot")
+    _binary = p.get("format", "json") == "binary"
+    db = p.get("deadband", [0] * len(ANALOG))
+    for i in range(len(ANALOG)):
+        _deadband[i] = int((db[i] if i < len(db) else 0) * 1000)
+    _max_interval_ms = int(p.get("max_interval_s", 60) * 1000)
+    base = m["topic"]
+    _topics = [(base + "/" + k).encode() for k in ANALOG + DIGITAL]
+    _event_topics = [(base + "/event/" + k).encode() for k in DIGITAL if k[0] == "i"]
+    _forced = True
+
+
+apply_config(load_config())
+config.subscribe(apply_config, "mqtt")
+
+
+def _bits(values):
+    b = 0
+    for i in range(len(values)):
+        if values[i]:
+            b |= 1 << i
+    return b
+
+
+def _fault_bits(faults):
+    b = 0
+    for i in range(len(faults)):
+        b |= (faults[i] & 3) << (2 * i)
+    return b
+
+
+def encode_snapshot(snap, ts):
+    if _binary:
+        e = snap.eng
+        return struct.pack(SNAPSHOT_FMT, SNAPSHOT_VERSION, ts, e[0], e[1], e[2],
+                           _fault_bits(snap.fault), _bits(snap.din), _bits(snap.dout))
+    return snap.json()
+
+
+def _encode_value(ts, value, analog):
+    if _binary:
+        return struct.pack(CHANNEL_FMT, ts, value)
+    if analog:
+        v = -value if value < 0 else value
+        return "{}{}.{:03d}".format("-" if value < 0 else "", v // 1000, v % 1000)
+    return "1" if value else "0"
+
+
+def _due(i, now):
+    return _forced or time.ticks_diff(now, _last_ms[i]) >= _max_interval_ms
+
+
+def _analog_changed(snap, i):
+    d = snap.eng[i] - _last_eng[i]
+    return d > _deadband[i] or -d > _deadband[i]
+
+
+def publish_snapshot(snap):
+    """Publish snap according to mqtt.publish; returns the number of messages queued."""
+    global _forced, published, suppressed
+    now = time.ticks_ms()
+    ts = int(snap.ts)
+    sent = 0
+    n_a = len(ANALOG)
+
+    if _mode == "channels":
+        for i in range(n_a):
+            if _analog_changed(snap, i) or _due(i, now):
+                mqtt_publish(_encode_value(ts, snap.eng[i], True), _topics[i])
+                _last_eng[i] = snap.eng[i]
+                _last_ms[i] = now
+                sent += 1
+        dig = (snap.din[0], snap.din[1], snap.dout[0], snap.dout[1])
+        for j in range(len(DIGITAL)):
+            if dig[j] != _last_dig[j] or _due(n_a + j, now):
+                mqtt_publish(_encode_value(ts, dig[j], False), _topics[n_a + j])
+                _last_dig[j] = dig[j]
+                _last_ms[n_a + j] = now
+                sent += 1
+    else:
+        changed = _due(0, now)
+        for i in range(n_a):
+            if _analog_changed(snap, i):
+                changed = True
+        dig = _bits(snap.din) | _bits(snap.dout) << 4
+        if dig != _last_dig[0]:
+            changed = True
+        if changed:
+            mqtt_publish(encode_snapshot(snap, ts))
+            for i in range(n_a):
+                _last_eng[i] = snap.eng[i]
+            _last_dig[0] = dig
+            _last_ms[0] = now
+            sent = 1
+
+    _forced = False
+    if sent:
+        published += sent
+    else:
+        suppressed += 1
+    return sent
+
+
+def publish_event(seq, t, i, level, count):
+    """Publish one input state change from digital_io's event ring."""
+    global published
+    if _binary:
+        payload = struct.pack(EVENT_FMT, seq, t, level, count)
+    else:
+        payload = '{{"seq":{},"t":{},"v":{},"count":{}}}'.format(seq, t, level, count)
+    mqtt_publish(payload, _event_topics[i])
+    published += 1
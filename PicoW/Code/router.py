@@ -0,0 +1,193 @@
+import time
+from httpreq import respond, redirect
+import metrics
+from debug import logger
+
+log = logger("web")
+
+# Route auth levels
+PUBLIC = None
+PAGE = "page"    # unauthenticated browsers are redirected to /login
+API = "api"      # unauthenticated clients get 401 JSON
+
+
+class Route:
+    __slots__ = ("path", "handler", "methods", "auth", "count", "total_us", "max_us", "hist")
+
+    def __init__(self, path, handler, methods, auth):
+        self.path = path
+        self.handler = handler
+        self.methods = methods
+        self.auth = auth
+        # Filled by the timing middleware
+        self.count = 0
+        self.total_us = 0
+        self.max_us = 0
+        self.hist = None    # metrics.Histogram, created while metrics are enabled
+
+
+class Router:
+    """Route table built once at import: exact paths in a dict, prefixes in a trie.
+
+    Handlers are `async def handler(cl, req)` and return True only when
+    they keep the connection for themselves (SSE). Middleware are
+    `async def mw(cl, req, route, nxt)` and call `await nxt(cl, req, route)`
+    to continue; route is None when nothing matched.
+    """
+
+    def __init__(self):
+        self.exact = {}
+        self.trie = {}
+        self.routes = []
+        self.middleware = []
+        self._chain = self._call
+
+    def route(self, path, methods=("GET",), auth=PAGE, prefix=False):
+        """Decorator registering a handler. HEAD is accepted wherever GET is."""
+        if "GET" in methods and "HEAD" not in methods:
+            methods = tuple(methods) + ("HEAD",)
+
+        def register(handler):
+            r = Route(path, handler, methods, auth)
+            self.routes.append(r)
+            if prefix:
+                node = self.trie
+                for seg in path.strip("/").split("/"):
+                    node = node.setdefault(seg, {})
+                node[None] = r
+            else:
+                self.exact[path] = r
+            return handler
+        return register
+
+    def use(self, mw):
+        """Append a middleware; the first one added runs outermost."""
+        self.middleware.append(mw)
+        call = self._call
+        for m in reversed(self.middleware):
+            call = _link(m, call)
+        self._chain = call
+
+    def match(self, path):
+        r = self.exact.get(path)
+        if r is not None:
+            return r
+        # Longest registered prefix, one path segment at a time
+        node = self.trie
+        found = node.get(None)
+        for seg in path.strip("/").split("/"):
+            node = node.get(seg)
+            if node is None:
+                break
+            found = node.get(None, found)
+        return found
+
+    async def dispatch(self, cl, req):
+        return await self._chain(cl, req, self.match(req.path))
+
+    async def _call(self, cl, req, route):
+        if route is None:
+            await respond(cl, req, "404 Not Found")
+            log.debug("404 Not Found: {}", req.path)
+            return
+        if req.method not in route.methods:
+            await respond(cl, req, "405 Method Not Allowed", extra="Allow: " + ", ".join(route.methods) + "\r\n")
+            return
+        return await route.handler(cl, req)
+
+
+def _link(mw, nxt):
+    async def call(cl, req, route):
+        return await mw(cl, req, route, nxt)
+    return call
+
+
+# --------------------------
+# Middleware
+# --------------------------
+def errors():
+    """Answer 500 instead of dropping the connection when a handler raises.
+
+    If the response had already started, a 500 would land inside it; the
+    connection is closed instead, which tells the client it was cut short.
+    """
+    async def mw(cl, req, route, nxt):
+        try:
+            return await nxt(cl, req, route)
+        except Exception as e:
+            log.error("Handler error on {}: {}", req.path, e)
+            req.keep_alive = False
+            if req.started:
+                return
+            try:
+                await respond(cl, req, "500 Internal Server Error", '{"error":"internal"}', "application/json")
+            except Exception:
+                pass
+    return mw
+
+
+def timing(slow_ms=200):
+    """Per-route request count and latency; logs requests slower than slow_ms."""
+    async def mw(cl, req, route, nxt):
+        t0 = time.ticks_us()
+        try:
+            return await nxt(cl, req, route)
+        finally:
+            if route is not None:
+                dt = time.ticks_diff(time.ticks_us(), t0)
+                route.count += 1
+                route.total_us += dt
+                if dt > route.max_us:
+                    route.max_us = dt
+                if metrics.ENABLED:
+                    if route.hist is None:
+                        route.hist = metrics.Histogram(metrics.HTTP_BUCKETS)
+                    route.hist.observe(dt)
+                if dt > slow_ms * 1000:
+                    log.warn("Slow request {} {}: {} ms", req.method, req.path, dt // 1000)
+    return mw
+
+
+def auth(check):
+    """Enforce route.auth using check(req) -> bool."""
+    async def mw(cl, req, route, nxt):
+        if route is not None and route.auth is not PUBLIC and not check(req):
+            if route.auth == API:
+                await respond(cl, req, "401 Unauthorized", '{"error":"auth"}', "application/json")
+            else:
+                await redirect(cl, req, "/login")
+            return
+        return await nxt(cl, req, route)
+    return mw
+
+
+def _peer(cl):
+    try:
+        p = cl.get_extra_info("peername")
+        return p[0] if isinstance(p, tuple) else p
+    except Exception:
+        return None
+
+
+def rate_limit(settings, max_clients=16):
+    """Token bucket per client address. settings() returns (requests/s, burst); 0 disables."""
+    buckets = {}   # peer -> [tokens, last ticks_ms]
+
+    async def mw(cl, req, route, nxt):
+        rate, burst = settings()
+        if rate:
+            peer = _peer(cl)
+            now = time.ticks_ms()
+            b = buckets.get(peer)
+            if b is None:
+                if len(buckets) >= max_clients:
+                    buckets.clear()
+                b = buckets[peer] = [burst, now]
+            b[0] = min(burst, b[0] + time.ticks_diff(now, b[1]) * rate / 1000)
+            b[1] = now
+            if b[0] < 1:
+                await respond(cl, req, "429 Too Many Requests", extra="Retry-After: 1\r\n")
+                return
+            b[0] -= 1
+        return await nxt(cl, req, route)
+    return mw
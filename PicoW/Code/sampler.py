@@ -0,0 +1,164 @@
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+from array import array
+import gc
+import time
+from sensors import sensors, read_sensors
+import alarms
+from scaling import ENG_SCALE
+from digital_io import digital_inputs, digital_outputs, read_digital_inputs, read_counters
+import digital_io
+import config
+from config import load_config
+from logger import log_data, log_event
+from publisher import publish_snapshot, publish_event
+import metrics
+from debug import logger
+
+log = logger("sampler")
+
+SAMPLE_INTERVAL_MS = 1000
+# Report heap bytes allocated by each acquisition cycle (needs gc.mem_alloc)
+MEASURE_ALLOC = False
+
+
+def apply_config(cfg):
+    global SAMPLE_INTERVAL_MS, MEASURE_ALLOC
+    s = cfg.get("sampling", {})
+    SAMPLE_INTERVAL_MS = s.get("interval_ms", 1000)
+    MEASURE_ALLOC = s.get("measure_alloc", False) and hasattr(gc, "mem_alloc")
+
+
+apply_config(load_config())
+config.subscribe(apply_config, "sampling")
+
+_JSON = ('{{"s1":{},"s2":{},"s3":{},"e1":{},"e2":{},"e3":{},'
+         '"f1":{},"f2":{},"f3":{},"i0":{},"i1":{},"o0":{},"o1":{},'
+         '"n0":{},"n1":{},"hz0":{},"hz1":{},"ev":{}}}')
+
+
+class Snapshot:
+    """Latest acquired values, shared by /data, MQTT and the logger."""
+
+    __slots__ = ("seq", "ts", "voltage", "raw", "eng", "fault", "din", "dout", "count", "freq", "events")
+
+    def __init__(self, n_sensors, n_inputs, n_outputs):
+        self.seq = 0
+        self.ts = 0
+        self.voltage = array("f", [0.0] * n_sensors)
+        self.raw = array("H", [0] * n_sensors)
+        self.eng = array("i", [0] * n_sensors)     # milli-units, see scaling.py
+        self.fault = array("B", [0] * n_sensors)
+        self.din = array("B", [0] * n_inputs)
+        self.dout = array("B", [0] * n_outputs)
+        self.count = array("I", [0] * n_inputs)    # input pulses, see digital_io.py
+        self.freq = array("f", [0.0] * n_inputs)   # Hz
+        self.events = 0                            # digital_io.event_seq, changes with each input event
+
+    def as_dict(self):
+        return {
+            "s1": self.voltage[0],
+            "s2": self.voltage[1],
+            "s3": self.voltage[2],
+            "e1": self.eng[0] / ENG_SCALE,
+            "e2": self.eng[1] / ENG_SCALE,
+            "e3": self.eng[2] / ENG_SCALE,
+            "f1": self.fault[0],
+            "f2": self.fault[1],
+            "f3": self.fault[2],
+            "i0": self.din[0],
+            "i1": self.din[1],
+            "o0": self.dout[0],
+            "o1": self.dout[1],
+            "n0": self.count[0],
+            "n1": self.count[1],
+            "hz0": self.freq[0],
+            "hz1": self.freq[1],
+            "ev": self.events
+        }
+
+    def json(self):
+        return _JSON.format(self.voltage[0], self.voltage[1], self.voltage[2],
+                            self.eng[0] / ENG_SCALE, self.eng[1] / ENG_SCALE, self.eng[2] / ENG_SCALE,
+                            self.fault[0], self.fault[1], self.fault[2],
+                            self.din[0], self.din[1], self.dout[0], self.dout[1],
+                            self.count[0], self.count[1], self.freq[0], self.freq[1], self.events)
+
+
+snapshot = Snapshot(len(sensors), len(digital_inputs), len(digital_outputs))
+# Set after every acquisition so streaming clients can wake up
+sampled = asyncio.Event()
+
+# Allocation stats, only updated when MEASURE_ALLOC is on
+alloc_last = 0
+alloc_max = 0
+
+
+def sample():
+    read_sensors(snapshot.raw, snapshot.voltage, snapshot.eng, snapshot.fault)
+    read_digital_inputs(snapshot.din)
+    read_counters(snapshot.count, snapshot.freq)
+    snapshot.events = digital_io.event_seq
+    for i in range(len(digital_outputs)):
+        snapshot.dout[i] = digital_outputs[i].value()
+    snapshot.ts = time.time()
+    snapshot.seq += 1
+    alarms.evaluate(snapshot.voltage)
+
+
+_event_seen = -1    # last digital_io event passed on
+
+
+def dispatch_events():
+    """Hand input state changes since the last call to the logger and MQTT."""
+    global _event_seen
+    for seq, t, i, level, count, bits in digital_io.events(_event_seen):
+        log_event(snapshot, bits)
+        publish_event(seq, t, i, level, count)
+        _event_seen = seq
+
+
+def measured_sample():
+    global alloc_last, alloc_max
+    before = gc.mem_alloc()
+    sample()
+    used = gc.mem_alloc() - before
+    if used >= 0:  # negative means a collection ran mid-cycle
+        alloc_last = used
+        if used > alloc_max:
+            alloc_max = used
+        log("Acquisition allocated {} bytes (max {})", used, alloc_max)
+
+
+async def sample_task():
+    log("Sampling every {} ms", SAMPLE_INTERVAL_MS)
+    deadline = time.ticks_ms()
+    while True:
+        timed = metrics.ENABLED
+        if timed:
+            t0 = time.ticks_us()
+            late = time.ticks_diff(time.ticks_ms(), deadline)
+            metrics.sample_late_us.observe(late * 1000 if late > 0 else 0)
+        if MEASURE_ALLOC:
+            measured_sample()
+        else:
+            sample()
+        sampled.set()
+        log_data(snapshot)
+        publish_snapshot(snapshot)
+        dispatch_events()
+        if timed:
+            metrics.sample_us.observe(time.ticks_diff(time.ticks_us(), t0))
+
+        # Schedule against a fixed deadline so the period doesn't drift by
+        # however long the sample itself took.
+        deadline = time.ticks_add(deadline, SAMPLE_INTERVAL_MS)
+        delay = time.ticks_diff(deadline, time.ticks_ms())
+        if delay < 0:
+            log.warn("Sampling overrun by {} ms", -delay)
+            metrics.sample_overruns += 1
+            deadline = time.ticks_ms()
+            delay = 0
+        await asyncio.sleep(delay / 1000)
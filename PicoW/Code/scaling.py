@@ -0,0 +1,133 @@
+from array import array
+
+# Engineering values are stored as fixed-point ints in milli-units, so the
+# per-read conversion is two table reads and an integer interpolation.
+ENG_SCALE = 1000
+
+# The 16-bit ADC code is split into a table index (top 8 bits) and an
+# interpolation fraction (low 8 bits); the table has one extra end point.
+LUT_BITS = 8
+LUT_SIZE = (1 << LUT_BITS) + 1
+FRAC_BITS = 16 - LUT_BITS
+FRAC_MASK = (1 << FRAC_BITS) - 1
+
+FAULT_NONE = 0
+FAULT_LOW = 1    # under-range / open loop
+FAULT_HIGH = 2   # over-range / short
+
+ADC_VREF = 3.3
+
+
+def _interp(points, x):
+    """Piecewise linear y(x) over points sorted by x, clamped at the ends."""
+    if x <= points[0][0]:
+        return points[0][1]
+    for i in range(1, len(points)):
+        x1, y1 = points[i]
+        if x <= x1:
+            x0, y0 = points[i - 1]
+            return y0 + (y1 - y0) * (x - x0) / (x1 - x0) if x1 != x0 else y1
+    return points[-1][1]
+
+
+def _input_fn(profile, calib):
+    """Return a function mapping raw ADC code to the profile's input quantity."""
+    scale = calib.get("scale", 1.0)
+    offset = calib.get("offset", 0.0)
+
+    def volts(code):
+        return code * ADC_VREF / 65535 * scale + offset
+
+    kind = profile.get("type", "volts")
+    if kind == "4-20mA" or profile.get("input") == "mA":
+        shunt = profile.get("shunt", 165)
+        return lambda code: volts(code) / shunt * 1000
+    if kind == "0-10V":
+        ratio = profile.get("ratio", 10 / ADC_VREF)
+        return lambda code: volts(code) * ratio
+    return volts
+
+
+def _curve(profile):
+    """Return a function mapping the input quantity to engineering units."""
+    kind = profile.get("type", "volts")
+    lo = profile.get("lo", 0.0)
+    hi = profile.get("hi", 100.0)
+    if kind == "4-20mA":
+        return lambda ma: lo + (ma - 4.0) * (hi - lo) / 16.0
+    if kind == "0-10V":
+        return lambda v: lo + v * (hi - lo) / 10.0
+    if kind == "piecewise":
+        points = sorted(profile["points"])
+        return lambda x: _interp(points, x)
+    if kind == "table":
+        x0 = profile.get("x0", 4.0)
+        x1 = profile.get("x1", 20.0)
+        values = profile["values"]
+        step = (x1 - x0) / (len(values) - 1)
+        points = [(x0 + i * step, v) for i, v in enumerate(values)]
+        return lambda x: _interp(points, x)
+    if kind == "volts":
+        return lambda v: v
+    raise ValueError("unknown scaling type: " + kind)
+
+
+class Scaler:
+    """Raw ADC code -> engineering milli-units and fault code, via a LUT."""
+
+    __slots__ = ("name", "unit", "lut", "fault_low", "fault_high")
+
+    def __init__(self, profile=None, calib=None):
+        profile = profile or {}
+        calib = calib or {}
+        to_input = _input_fn(profile, calib)
+        to_eng = _curve(profile)
+        self.name = profile.get("name", "")
+        self.unit = profile.get("unit", "V")
+        self.lut = array("i", [0] * LUT_SIZE)
+        for i in range(LUT_SIZE):
+            code = min(i << FRAC_BITS, 65535)
+            self.lut[i] = int(round(to_eng(to_input(code)) * ENG_SCALE))
+
+        # Fault limits as raw codes, found by searching the input curve so
+        # any calibration is accounted for. 4-20 mA loops default to the
+        # NAMUR NE43 limits; other profiles only fault when configured.
+        is_loop = profile.get("type") == "4-20mA" or profile.get("input") == "mA"
+        lo = profile.get("fault_low", 3.8 if is_loop else None)
+        hi = profile.get("fault_high", 20.5 if is_loop else None)
+        self.fault_low = self._code_for(to_input, lo) if lo is not None else -1
+        self.fault_high = self._code_for(to_input, hi) if hi is not None else 65536
+
+    @staticmethod
+    def _code_for(to_input, x):
+        """Smallest raw code whose input quantity is >= x."""
+        lo, hi = 0, 65536
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            if to_input(mid) < x:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def convert(self, code):
+        lut = self.lut
+        i = code >> FRAC_BITS
+        a = lut[i]
+        return a + (((lut[i + 1] - a) * (code & FRAC_MASK)) >> FRAC_BITS)
+
+    def fault(self, code):
+        if code < self.fault_low:
+            return FAULT_LOW
+        if code >= self.fault_high:
+            return FAULT_HIGH
+        return FAULT_NONE
+
+
+def build_scalers(profiles, calibration, count):
+    out = []
+    for i in range(count):
+        profile = profiles[i] if profiles and i < len(profiles) else None
+        calib = calibration[i] if calibration and i < len(calibration) else None
+        out.append(Scaler(profile, calib))
+    return out
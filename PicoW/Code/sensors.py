@@ -1,7 +1,11 @@
-from machine import ADC, Pin
-import time
+from machine import ADC
+import config
 from config import load_config
-from debug import log
+from filters import build_filters
+from scaling import build_scalers
+from debug import logger, DEBUG
+
+log = logger("sensors")
 
 cfg = load_config()
 
@@ -12,39 +16,47 @@ adc1 = ADC(27)
 adc2 = ADC(28)
 sensors = [adc0, adc1, adc2]
 
-calibration = cfg["sensors"]["calibration"]
-threshold_high = cfg["sensors"]["threshold_high"]
-threshold_low  = cfg["sensors"]["threshold_low"]
-
-led = Pin("LED", Pin.OUT)
-
-def blink_led(duration=0.1):
-    log(f"Blink LED for {duration}s")
-    led.on()
-    time.sleep(duration)
-    led.off()
-
-def read_sensors():
-    log("Reading sensors...")
-    data = []
-    for i, adc in enumerate(sensors):
-        raw = adc.read_u16()
-        voltage = (raw / 65535) * 3.3
-        voltage = voltage * calibration[i]["scale"] + calibration[i]["offset"]
-        log(f"Sensor {i}: raw={raw}, voltage={voltage}")
-        data.append({"raw":raw,"voltage":voltage})
-    return data
-
-def check_thresholds(data):
-    log("Checking thresholds...")
-    for i, s in enumerate(data):
-        if s["voltage"] > threshold_high[i]:
-            log(f"Sensor {i} HIGH threshold exceeded")
-            blink_led(0.1)
-        elif s["voltage"] < threshold_low[i]:
-            log(f"Sensor {i} LOW threshold exceeded")
-            blink_led(0.05)
+# Derived from the "sensors" config section by apply_config(). The lists
+# are refilled in place so modules that imported them see the new values.
+calibration = []
+threshold_high = []
+threshold_low = []
+filters = []
+scalers = []
+# Calibration folded into one gain/offset per channel
+_gain = []
+_offset = []
+
+def apply_config(cfg):
+    s = cfg["sensors"]
+    n = len(sensors)
+    calibration[:] = s["calibration"]
+    threshold_high[:] = s["threshold_high"]
+    threshold_low[:] = s["threshold_low"]
+    filters[:] = build_filters(s.get("filter"), n)
+    scalers[:] = build_scalers(s.get("scaling"), calibration, n)
+    _gain[:] = [3.3 / 65535 * c["scale"] for c in calibration]
+    _offset[:] = [c["offset"] for c in calibration]
+    log("Sensor settings applied")
+
+apply_config(cfg)
+config.subscribe(apply_config, "sensors")
+
+def read_sensors(raw_out, voltage_out, eng_out, fault_out):
+    """Fill the caller's buffers in place and return voltage_out.
+
+    eng_out is in milli-units, fault_out holds scaling.FAULT_* codes.
+    """
+    for i in range(len(sensors)):
+        code = filters[i].update(sensors[i])
+        raw_out[i] = code
+        voltage_out[i] = code * _gain[i] + _offset[i]
+        eng_out[i] = scalers[i].convert(code)
+        fault_out[i] = scalers[i].fault(code)
+        if log.level <= DEBUG:
+            log.debug("Sensor {}: raw={}, voltage={}, eng={}, fault={}",
+                i, code, voltage_out[i], eng_out[i], fault_out[i])
+    return voltage_out
 
 def init_sensors():
     log("Sensors initialized")
-
@@ -0,0 +1,113 @@
+import os
+import time
+import config
+from config import load_config
+from debug import logger
+
+log = logger("sessions")
+
+try:
+    from ubinascii import hexlify
+except ImportError:
+    from binascii import hexlify
+
+COOKIE = "session"
+TOKEN_BYTES = 16             # 128-bit tokens from the hardware RNG
+# From the "web" config section, see apply_config()
+MAX_SESSIONS = 8             # oldest-used session is dropped to make room
+IDLE_S = 1800                # logged out after this long without a request
+TTL_S = 43200                # logged out this long after login regardless
+
+# token -> [login time, last request time], seconds from time.time()
+_sessions = {}
+
+# Counters, read by the web/metrics side
+created = 0
+evicted = 0
+expired = 0
+
+
+def apply_config(cfg):
+    global MAX_SESSIONS, IDLE_S, TTL_S
+    w = cfg.get("web", {})
+    MAX_SESSIONS = max(1, w.get("max_sessions", 8))
+    IDLE_S = w.get("session_idle_s", 1800)
+    TTL_S = w.get("session_ttl_s", 43200)
+    while len(_sessions) > MAX_SESSIONS:
+        _evict()
+
+
+apply_config(load_config())
+config.subscribe(apply_config, "web")
+
+
+def _expired(s, now):
+    # A clock set backwards (NTP after boot) also ends the session
+    return now < s[0] or now - s[0] >= TTL_S or now - s[1] >= IDLE_S
+
+
+def _evict():
+    global evicted
+    lru = None
+    for token in _sessions:
+        if lru is None or _sessions[token][1] < _sessions[lru][1]:
+            lru = token
+    del _sessions[lru]
+    evicted += 1
+
+
+def sweep():
+    """Drop expired sessions."""
+    global expired
+    now = int(time.time())
+    for token in [t for t in _sessions if _expired(_sessions[t], now)]:
+        del _sessions[token]
+        expired += 1
+
+
+def new():
+    """Start a session and return its token."""
+    global created
+    sweep()
+    if len(_sessions) >= MAX_SESSIONS:
+        _evict()
+        log.warn("Session table full, dropped least recently used")
+    token = hexlify(os.urandom(TOKEN_BYTES)).decode()
+    now = int(time.time())
+    _sessions[token] = [now, now]
+    created += 1
+    return token
+
+
+def check(token):
+    """True if token is a live session; refreshes its idle timer."""
+    global expired
+    s = _sessions.get(token) if token else None
+    if s is None:
+        return False
+    now = int(time.time())
+    if _expired(s, now):
+        del _sessions[token]
+        expired += 1
+        return False
+    s[1] = now
+    return True
+
+
+def end(token):
+    """Invalidate a session, e.g. on logout."""
+    if token:
+        _sessions.pop(token, None)
+
+
+def count():
+    return len(_sessions)
+
+
+def set_cookie(token):
+    return "Set-Cookie: {}={}; Path=/; HttpOnly; SameSite=Strict; Max-Age={}\r\n".format(
+        COOKIE, token, TTL_S)
+
+
+def clear_cookie():
+    return "Set-Cookie: {}=; Path=/; HttpOnly; SameSite=Strict; Max-Age=0\r\n".format(COOKIE)
@@ -0,0 +1,134 @@
+import os
+from httpreq import response_head
+from debug import logger
+
+log = logger("static")
+
+# Pages are served from html/. If Host/build_html.py has been run, each
+# page also has a minified <name>.gz next to it, which is sent as-is to
+# clients that accept gzip.
+ROOT = "html/"
+CHUNK = 1024                 # flash read / socket write size
+CACHE_FILE_MAX = 2048        # files up to this size may be kept in RAM
+CACHE_BUDGET = 8192          # total bytes kept in RAM
+CACHE_CONTROL = "private, no-cache"   # always revalidate: pages sit behind login
+
+TYPES = {
+    "html": "text/html",
+    "css": "text/css",
+    "js": "application/javascript",
+    "json": "application/json",
+    "svg": "image/svg+xml",
+    "ico": "image/x-icon",
+    "png": "image/png",
+}
+
+# name -> (flash path, size, etag, gzipped) for each variant, from os.stat
+_meta = {}
+# flash path -> bytes, filled until CACHE_BUDGET is used up
+_ram = {}
+_ram_used = 0
+# Free read buffers; one is taken per transfer in progress
+_bufs = []
+
+# Counters, read by the web/metrics side
+served = 0        # 200 responses, from RAM or flash
+cache_hits = 0    # ... of which sent from the RAM cache
+not_modified = 0
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    size = st[6]
+    # Size and mtime change whenever the file is rewritten
+    mtime = int(st[8]) if len(st) > 8 else 0
+    return path, size, '"{:x}-{:x}"'.format(size, mtime)
+
+
+def _lookup(name, gzip):
+    key = (name, gzip)
+    if key not in _meta:
+        found = None
+        if gzip:
+            found = _stat(ROOT + name + ".gz")
+        if found is None:
+            found = _stat(ROOT + name)
+            gzip = False
+        _meta[key] = found + (gzip,) if found else None
+    return _meta[key]
+
+
+def clear_cache():
+    """Forget file metadata and cached contents, e.g. after uploading pages."""
+    global _ram_used
+    _meta.clear()
+    _ram.clear()
+    _ram_used = 0
+
+
+def _cached(path, size):
+    global _ram_used, cache_hits
+    data = _ram.get(path)
+    if data is not None:
+        cache_hits += 1
+    elif size <= CACHE_FILE_MAX and _ram_used + size <= CACHE_BUDGET:
+        with open(path, "rb") as f:
+            data = f.read()
+        _ram[path] = data
+        _ram_used += size
+    return data
+
+
+async def send_file(cl, req, name, status="200 OK"):
+    """Send html/<name> with validators. Returns False if there is no such file."""
+    global served, not_modified
+    accept = req.header("accept-encoding", "")
+    meta = _lookup(name, "gzip" in accept)
+    if meta is None:
+        return False
+    path, size, etag, gzip = meta
+
+    validators = "ETag: {}\r\nCache-Control: {}\r\nVary: Accept-Encoding\r\n".format(
+        etag, CACHE_CONTROL)
+    inm = req.header("if-none-match")
+    if inm and etag in inm:
+        not_modified += 1
+        cl.write((response_head(req, "304 Not Modified") + validators + "\r\n").encode())
+        await cl.drain()
+        return True
+
+    served += 1
+    ext = name.rsplit(".", 1)[-1]
+    head = response_head(req, status) + validators
+    head += "Content-Type: {}\r\nContent-Length: {}\r\n".format(TYPES.get(ext, "application/octet-stream"), size)
+    if gzip:
+        head += "Content-Encoding: gzip\r\n"
+    cl.write((head + "\r\n").encode())
+    if req.method == "HEAD":
+        await cl.drain()
+        return True
+
+    data = _cached(path, size)
+    if data is not None:
+        cl.write(data)
+        await cl.drain()
+        return True
+
+    buf = _bufs.pop() if _bufs else bytearray(CHUNK)
+    mv = memoryview(buf)
+    try:
+        with open(path, "rb") as f:
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                cl.write(mv[:n])
+                await cl.drain()
+    except OSError as e:
+        log.error("Static read failed {}: {}", path, e)
+    finally:
+        _bufs.append(buf)
+    return True
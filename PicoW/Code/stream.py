@@ -0,0 +1,77 @@
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+import time
+from sampler import snapshot, sampled
+import config
+from config import load_config
+from debug import logger
+
+log = logger("stream")
+
+MAX_CLIENTS = 4
+# Minimum time between pushes, so a fast sampler doesn't flood the clients
+MIN_INTERVAL_MS = 500
+WRITE_TIMEOUT = 2  # seconds before a stalled client is dropped
+
+HEADERS = b"HTTP/1.0 200 OK\r\nContent-Type:text/event-stream\r\nCache-Control:no-cache\r\n\r\n"
+
+_clients = []
+
+
+def apply_config(cfg):
+    global MAX_CLIENTS, MIN_INTERVAL_MS
+    s = cfg.get("stream", {})
+    MAX_CLIENTS = s.get("max_clients", 4)
+    MIN_INTERVAL_MS = s.get("min_interval_ms", 500)
+
+
+apply_config(load_config())
+config.subscribe(apply_config, "stream")
+
+
+def add_client(cl):
+    """Subscribe an open connection to snapshot pushes. False if full."""
+    if len(_clients) >= MAX_CLIENTS:
+        return False
+    _clients.append(cl)
+    log("Stream client added ({} open)", len(_clients))
+    return True
+
+
+def client_count():
+    return len(_clients)
+
+
+async def _drop(cl):
+    if cl in _clients:
+        _clients.remove(cl)
+    try:
+        cl.close()
+        await cl.wait_closed()
+    except Exception:
+        pass
+    log("Stream client dropped ({} open)", len(_clients))
+
+
+async def stream_task():
+    last = time.ticks_ms()
+    while True:
+        await sampled.wait()
+        sampled.clear()
+        if not _clients:
+            continue
+        now = time.ticks_ms()
+        if time.ticks_diff(now, last) < MIN_INTERVAL_MS:
+            continue
+        last = now
+
+        # One message per sample, shared by every subscriber
+        msg = ("data: " + snapshot.json() + "\n\n").encode()
+        for cl in _clients[:]:
+            try:
+                cl.write(msg)
+                await asyncio.wait_for(cl.drain(), WRITE_TIMEOUT)
+            except Exception:
+                await _drop(cl)
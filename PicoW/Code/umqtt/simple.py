@@ -18,6 +18,8 @@ class MQTTClient:
         keepalive=0,
         ssl=None,
         ssl_params={},
+        max_inflight=8,
+        buf_size=512,
     ):
         if port == 0:
             port = 8883 if ssl else 1883
@@ -36,6 +38,38 @@ class MQTTClient:
         self.lw_msg = None
         self.lw_qos = 0
         self.lw_retain = False
+        self.timeout = None
+        # QoS 1/2 publishes waiting for PUBACK / PUBREC / PUBCOMP:
+        # pid -> [topic, msg, retain, qos, state]
+        self.max_inflight = max_inflight
+        self.inflight = {}
+        # Incoming QoS 2 packet ids delivered but not yet released
+        self.rcv_qos2 = set()
+        # Outgoing packets are assembled here and sent with one write;
+        # payloads that do not fit go out as a second write, uncopied.
+        self._buf = bytearray(buf_size)
+        self._ack = bytearray(4)
+
+    def _put_len(self, sz):
+        buf = self._buf
+        i = 1
+        while sz > 0x7F:
+            buf[i] = (sz & 0x7F) | 0x80
+            sz >>= 7
+            i += 1
+        buf[i] = sz
+        return i + 1
+
+    def _put_str(self, i, s):
+        if isinstance(s, str):
+            s = s.encode()
+        n = len(s)
+        assert i + 2 + n <= len(self._buf)
+        buf = self._buf
+        buf[i] = n >> 8
+        buf[i + 1] = n & 0xFF
+        buf[i + 2 : i + 2 + n] = s
+        return i + 2 + n
 
     def _send_str(self, s):
         self.sock.write(struct.pack("!H", len(s)))
@@ -63,6 +97,7 @@ class MQTTClient:
         self.lw_retain = retain
 
     def connect(self, clean_session=True, timeout=None):
+        self.timeout = timeout
         self.sock = socket.socket()
         self.sock.settimeout(timeout)
         addr = socket.getaddrinfo(self.server, self.port)[0][-1]
@@ -112,8 +147,38 @@ class MQTTClient:
         assert resp[0] == 0x20 and resp[1] == 0x02
         if resp[3] != 0:
             raise MQTTException(resp[3])
+        if clean_session:
+            self.inflight = {}
+            self.rcv_qos2 = set()
+        else:
+            self._resend_inflight()
         return resp[2] & 1
 
+    # Retransmit unacknowledged QoS 1/2 flows after reconnecting with a
+    # persistent session: PUBLISH again with DUP set, or PUBREL if the
+    # PUBREC already arrived.
+    def _resend_inflight(self):
+        for pid in sorted(self.inflight):
+            topic, msg, retain, qos, state = self.inflight[pid]
+            if state == 0x70:
+                self._send_ack(0x62, pid)
+            else:
+                self._send_publish(topic, msg, retain, qos, pid, True)
+
+    def _next_pid(self):
+        while 1:
+            self.pid = self.pid % 65535 + 1
+            if self.pid not in self.inflight:
+                return self.pid
+
+    def _send_ack(self, op, pid):
+        pkt = self._ack
+        pkt[0] = op
+        pkt[1] = 2
+        pkt[2] = pid >> 8
+        pkt[3] = pid & 0xFF
+        self.sock.write(pkt)
+
     def disconnect(self):
         self.sock.write(b"\xe0\0")
         self.sock.close()
@@ -121,71 +186,86 @@ class MQTTClient:
     def ping(self):
         self.sock.write(b"\xc0\0")
 
+    # QoS 1 and 2 publishes return the packet id as soon as the packet is
+    # written; acknowledgements are processed by wait_msg()/check_msg().
+    # Only when max_inflight flows are outstanding does publish() block,
+    # reading broker replies until a slot frees up.
     def publish(self, topic, msg, retain=False, qos=0):
-        pkt = bytearray(b"\x30\0\0\0")
-        pkt[0] |= qos << 1 | retain
+        assert 0 <= qos <= 2
+        pid = 0
+        if qos > 0:
+            while len(self.inflight) >= self.max_inflight:
+                self.wait_msg()
+            pid = self._next_pid()
+            self.inflight[pid] = [topic, msg, retain, qos, 0x40 if qos == 1 else 0x50]
+        self._send_publish(topic, msg, retain, qos, pid, False)
+        return pid
+
+    def _send_publish(self, topic, msg, retain, qos, pid, dup):
+        if isinstance(msg, str):
+            msg = msg.encode()
+        buf = self._buf
+        buf[0] = 0x30 | qos << 1 | retain | dup << 3
         sz = 2 + len(topic) + len(msg)
         if qos > 0:
             sz += 2
         assert sz < 2097152
-        i = 1
-        while sz > 0x7F:
-            pkt[i] = (sz & 0x7F) | 0x80
-            sz >>= 7
-            i += 1
-        pkt[i] = sz
-        # print(hex(len(pkt)), hexlify(pkt, ":"))
-        self.sock.write(pkt, i + 1)
-        self._send_str(topic)
+        i = self._put_str(self._put_len(sz), topic)
         if qos > 0:
-            self.pid += 1
-            pid = self.pid
-            struct.pack_into("!H", pkt, 0, pid)
-            self.sock.write(pkt, 2)
-        self.sock.write(msg)
-        if qos == 1:
-            while 1:
-                op = self.wait_msg()
-                if op == 0x40:
-                    sz = self.sock.read(1)
-                    assert sz == b"\x02"
-                    rcv_pid = self.sock.read(2)
-                    rcv_pid = rcv_pid[0] << 8 | rcv_pid[1]
-                    if pid == rcv_pid:
-                        return
-        elif qos == 2:
-            assert 0
+            buf[i] = pid >> 8
+            buf[i + 1] = pid & 0xFF
+            i += 2
+        n = len(msg)
+        # print(hex(i + n), hexlify(buf[:i], ":"))
+        if i + n <= len(buf):
+            buf[i : i + n] = msg
+            self.sock.write(buf, i + n)
+        else:
+            # writev-style: header from the buffer, payload from the caller
+            self.sock.write(buf, i)
+            self.sock.write(msg)
+
+    # Block until every outstanding QoS 1/2 publish has been acknowledged.
+    def wait_inflight(self):
+        while self.inflight:
+            self.wait_msg()
 
     def subscribe(self, topic, qos=0):
         assert self.cb is not None, "Subscribe callback is not set"
-        pkt = bytearray(b"\x82\0\0\0")
-        self.pid += 1
-        struct.pack_into("!BH", pkt, 1, 2 + 2 + len(topic) + 1, self.pid)
-        # print(hex(len(pkt)), hexlify(pkt, ":"))
-        self.sock.write(pkt)
-        self._send_str(topic)
-        self.sock.write(qos.to_bytes(1, "little"))
+        pid = self._next_pid()
+        buf = self._buf
+        buf[0] = 0x82
+        i = self._put_len(2 + 2 + len(topic) + 1)
+        buf[i] = pid >> 8
+        buf[i + 1] = pid & 0xFF
+        i = self._put_str(i + 2, topic)
+        buf[i] = qos
+        # print(hex(i + 1), hexlify(buf[: i + 1], ":"))
+        self.sock.write(buf, i + 1)
         while 1:
             op = self.wait_msg()
             if op == 0x90:
                 resp = self.sock.read(4)
                 # print(resp)
-                assert resp[1] == pkt[2] and resp[2] == pkt[3]
+                assert resp[1] << 8 | resp[2] == pid
                 if resp[3] == 0x80:
                     raise MQTTException(resp[3])
                 return
 
     def unsubscribe(self, topic):
-        pkt = bytearray(b"\xa2\0\0\0")
-        self.pid += 1
-        struct.pack_into("!BH", pkt, 1, 2 + 2 + len(topic), self.pid)
-        self.sock.write(pkt)
-        self._send_str(topic)
+        pid = self._next_pid()
+        buf = self._buf
+        buf[0] = 0xA2
+        i = self._put_len(2 + 2 + len(topic))
+        buf[i] = pid >> 8
+        buf[i + 1] = pid & 0xFF
+        i = self._put_str(i + 2, topic)
+        self.sock.write(buf, i)
         while 1:
             op = self.wait_msg()
             if op == 0xB0:
                 resp = self.sock.read(3)
-                assert resp[1] == pkt[2] and resp[2] == pkt[3]
+                assert resp[1] << 8 | resp[2] == pid
                 return
 
     # Wait for a single incoming MQTT message and process it.
@@ -194,7 +274,7 @@ class MQTTClient:
     # messages processed internally.
     def wait_msg(self):
         res = self.sock.read(1)
-        self.sock.setblocking(True)
+        self.sock.settimeout(self.timeout)
         if res is None:
             return None
         if res == b"":
@@ -204,6 +284,9 @@ class MQTTClient:
             assert sz == 0
             return None
         op = res[0]
+        if op in (0x40, 0x50, 0x62, 0x70):  # PUBACK, PUBREC, PUBREL, PUBCOMP
+            self._handle_ack(op)
+            return op
         if op & 0xF0 != 0x30:
             return op
         sz = self._recv_len()
@@ -216,15 +299,37 @@ class MQTTClient:
             pid = pid[0] << 8 | pid[1]
             sz -= 2
         msg = self.sock.read(sz)
+        if op & 6 == 4:
+            # QoS 2: deliver once, even if the broker resends with DUP
+            if pid not in self.rcv_qos2:
+                self.rcv_qos2.add(pid)
+                self.cb(topic, msg)
+            self._send_ack(0x50, pid)
+            return op
         self.cb(topic, msg)
         if op & 6 == 2:
-            pkt = bytearray(b"\x40\x02\0\0")
-            struct.pack_into("!H", pkt, 2, pid)
-            self.sock.write(pkt)
-        elif op & 6 == 4:
-            assert 0
+            self._send_ack(0x40, pid)
         return op
 
+    def _handle_ack(self, op):
+        sz = self.sock.read(1)
+        assert sz == b"\x02"
+        pid = self.sock.read(2)
+        pid = pid[0] << 8 | pid[1]
+        if op == 0x62:  # PUBREL for an incoming QoS 2 message
+            self.rcv_qos2.discard(pid)
+            self._send_ack(0x70, pid)
+            return
+        entry = self.inflight.get(pid)
+        if entry is None:
+            return
+        if op == 0x50 and entry[3] == 2:
+            # PUBREC (possibly repeated): release it and wait for PUBCOMP
+            entry[4] = 0x70
+            self._send_ack(0x62, pid)
+        elif op == entry[4]:
+            del self.inflight[pid]
+
     # Checks whether a pending message from server is available.
     # If not, returns immediately with None. Otherwise, does
     # the same processing as wait_msg.
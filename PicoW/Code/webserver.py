@@ -1,234 +1,743 @@
-import socket
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
 import json
-import time
-import urandom
 import gc
+import time
 from machine import Pin, reset
-from sensors import read_sensors, check_thresholds
-from digital_io import read_digital_inputs, digital_outputs, set_digital_output
-from config import load_config, save_config
-from logger import log_data
-from mqtt_client import mqtt_publish
+import sampler
+from sampler import snapshot
+import stream
+import logger as datalog
+from sensors import scalers, threshold_low, threshold_high
+import alarms
+from scaling import ENG_SCALE
+import digital_io
+from digital_io import digital_outputs, set_digital_output
+import config
+import static
+import sessions
+import jsonw
+import mqtt_client
+import metrics
+import debug
+from router import Router, PUBLIC, API, rate_limit, errors, timing, auth
+from httpreq import (Request, HTTPError, send, respond, redirect, write_chunk,
+                     start_chunked, send_chunk, end_chunked)
+from debug import logger
+
+log = logger("web")
+
+HISTORY_POINTS = 200     # default buckets per /history response
+HISTORY_MAX_POINTS = 500
+HISTORY_FLUSH = 512      # bytes of rows collected before each write
+METRICS_FLUSH = 512      # bytes of exposition text collected before each write
+
+READ_TIMEOUT = 5         # seconds to wait for a request before dropping
+# From the "web" config section, see apply_config()
+PORT = 80
+BACKLOG = 4
+MAX_CONNECTIONS = 4      # concurrent clients, extra ones get a 503
+IDLE_TIMEOUT = 5         # seconds a kept-alive connection may sit idle
+MAX_REQUESTS = 100       # requests served on one connection before closing it
+RATE_LIMIT = 20          # requests/s per client address, 0 = unlimited
+RATE_BURST = 40
+
+JSON = "application/json"
 
 led = Pin("LED", Pin.OUT)
-sessions = {}
+_active = 0
+rejected = 0
+# Kept-alive connections waiting for their next request, oldest first.
+# When all slots are taken, the oldest idle one is closed to make room.
+_idle = []
+# Set whenever a connection handler exits and gives back its slot
+_freed = asyncio.Event()
+
+
+def apply_config(cfg):
+    global PORT, BACKLOG, MAX_CONNECTIONS, IDLE_TIMEOUT, MAX_REQUESTS, RATE_LIMIT, RATE_BURST
+    w = cfg.get("web", {})
+    PORT = w.get("port", 80)                 # port and backlog apply on the next serve()
+    BACKLOG = w.get("backlog", 4)
+    MAX_CONNECTIONS = w.get("max_connections", 4)
+    IDLE_TIMEOUT = w.get("idle_timeout_s", 5)
+    MAX_REQUESTS = w.get("max_requests", 100)
+    RATE_LIMIT = w.get("rate_limit", 20)
+    RATE_BURST = w.get("rate_burst", 40)
+
+
+apply_config(config.load_config())
+config.subscribe(apply_config, "web")
+
+# One request buffer per connection slot, reused between requests
+_requests = [Request() for _ in range(MAX_CONNECTIONS)]
 
 # --------------------------
 # Utility functions
 # --------------------------
-def blink():
+async def _blink():
     led.on()
-    time.sleep(0.02)
+    await asyncio.sleep(0.02)
     led.off()
 
-def generate_token():
-    return str(urandom.getrandbits(32))
-
-def parse_query(path):
-    if "?" not in path:
-        return {}
-    qs = path.split("?", 1)[1]
-    out = {}
-    for pair in qs.split("&"):
-        if "=" in pair:
-            k, v = pair.split("=", 1)
-            out[k] = v.replace("%20", " ").replace("+", " ")
-    return out
+def blink():
+    asyncio.create_task(_blink())
 
 def is_authenticated(req):
-    if "Cookie:" not in req:
-        return False
-    for line in req.split("\r\n"):
-        if line.startswith("Cookie:") and "session=" in line:
-            token = line.split("session=")[1].strip()
-            return token in sessions
-    return False
-
-def load_html(filename):
-    path = "html/" + filename
+    return sessions.check(req.cookie(sessions.COOKIE))
+
+def _int_arg(q, key, default):
+    try:
+        return int(q[key])
+    except (KeyError, ValueError):
+        return default
+
+async def send_history(cl, req):
+    q = req.query()
+    # from/to are epoch seconds; zero or negative values count back from now
+    now = datalog.now()
+    t_to = _int_arg(q, "to", 0)
+    t_from = _int_arg(q, "from", -86400)
+    if t_to <= 0:
+        t_to += now
+    if t_from <= 0:
+        t_from += now
+    points = min(max(_int_arg(q, "points", HISTORY_POINTS), 1), HISTORY_MAX_POINTS)
+    if t_from > t_to:
+        await respond(cl, req, "400 Bad Request", '{"error":"range"}', JSON)
+        return
+
+    await start_chunked(cl, req, "200 OK", JSON)
+    out = ('{{"from":{},"to":{},"cols":["t","n","s1min","s1","s1max",'
+           '"s2min","s2","s2max","s3min","s3","s3max"],"rows":['.format(t_from, t_to))
+    sep = ""
+    for row in datalog.history(t_from, t_to, points):
+        out += sep + "[{},{},{},{},{},{},{},{},{},{},{}]".format(*row)
+        sep = ","
+        if len(out) >= HISTORY_FLUSH:
+            await send_chunk(cl, req, out)
+            out = ""
+    await send_chunk(cl, req, out + "]}")
+    await end_chunked(cl, req)
+
+async def send_page(cl, req, filename):
+    if not await static.send_file(cl, req, filename):
+        log.error("Cannot load HTML: {}", filename)
+        await respond(cl, req, "404 Not Found", "<h1>Error loading " + filename + "</h1>", "text/html")
+
+async def close(cl):
+    try:
+        cl.close()
+        await cl.wait_closed()
+    except Exception:
+        pass
+
+# --------------------------
+# Routes
+# --------------------------
+app = Router()
+
+
+def _rate_settings():
+    return RATE_LIMIT, RATE_BURST
+
+
+# Outermost first: rate limit, error handling, timing, then auth
+app.use(rate_limit(_rate_settings))
+app.use(errors())
+app.use(timing())
+app.use(auth(is_authenticated))
+
+# --------------------------
+# LOGIN / LOGOUT
+# --------------------------
+@app.route("/login", auth=PUBLIC)
+async def login_page(cl, req):
+    await send_page(cl, req, "login.html")
+
+@app.route("/dologin", methods=("GET", "POST"), auth=PUBLIC)
+async def dologin(cl, req):
+    q = req.form() if req.method == "POST" else req.query()
+    auth_cfg = config.get("auth")
+    if q.get("u") == auth_cfg["username"] and q.get("p") == auth_cfg["password"]:
+        await redirect(cl, req, "/", sessions.set_cookie(sessions.new()))
+        log("Login successful")
+    else:
+        await redirect(cl, req, "/login")
+        log.warn("Login failed")
+
+@app.route("/logout")
+async def logout(cl, req):
+    sessions.end(req.cookie(sessions.COOKIE))
+    await redirect(cl, req, "/login", sessions.clear_cookie())
+    log("Logout")
+
+# --------------------------
+# SYSTEM REBOOT
+# --------------------------
+@app.route("/reboot", methods=("GET", "POST"), auth=API)
+async def reboot(cl, req):
     try:
-        with open(path, "r") as f:
-            content = f.read()
-            print("[DEBUG] Loaded HTML:", path)
-            return content
+        req.keep_alive = False
+        await respond(cl, req, "200 OK", "Rebooting Pico...\r\n", "text/plain")
+        await close(cl)
+        await asyncio.sleep(0.3)
+        log("Rebooting system now")
+        reset()
     except Exception as e:
-        print("[ERROR] Cannot load HTML:", path, e)
-        return f"<h1>Error loading {filename}</h1>"
+        log.error("Reboot failed: {}", e)
 
-def send_html(cl, html):
-    chunk_size = 256
-    for i in range(0, len(html), chunk_size):
-        cl.send(html[i:i+chunk_size])
+# --------------------------
+# DATA ENDPOINT
+# --------------------------
+@app.route("/data", auth=API)
+async def data(cl, req):
+    await respond(cl, req, "200 OK", snapshot.json(), JSON)
 
 # --------------------------
-# HTTP Server
+# LIVE STREAM (Server-Sent Events)
+# --------------------------
+@app.route("/stream", auth=API)
+async def live_stream(cl, req):
+    if req.method == "HEAD":
+        # Headers only; the event stream itself is close-delimited
+        req.keep_alive = False
+        await send(cl, stream.HEADERS)
+        return
+    if not stream.add_client(cl):
+        await respond(cl, req, "503 Service Unavailable", extra="Retry-After: 5\r\n")
+        return
+    req.started = True
+    await send(cl, stream.HEADERS)
+    await send(cl, "data: " + snapshot.json() + "\n\n")
+    return True
+
+# --------------------------
+# CONFIGURATION
 # --------------------------
-def serve():
-    addr = socket.getaddrinfo("0.0.0.0", 80)[0][-1]
-    s = socket.socket()
-    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    s.bind(addr)
-    s.listen(2)
-    print("[INFO] Webserver running on 0.0.0.0:80")
-
-    while True:
-        gc.collect()
-        cl, addr = s.accept()
+@app.route("/getwifi")
+async def getwifi(cl, req):
+    await respond(cl, req, "200 OK", json.dumps(config.get("wifi")), JSON)
+
+@app.route("/setwifi")
+async def setwifi(cl, req):
+    q = req.query()
+    ok = "ssid" in q and config.update_section("wifi", {"ssid": q["ssid"], "password": q.get("pass", "")})
+    await respond(cl, req, "200 OK", '{"ok":true}' if ok else '{"ok":false}', JSON)
+
+@app.route("/config", methods=("GET", "POST"))
+async def config_json(cl, req):
+    if req.method == "POST":
+        # Body is {"section": {...}, ...}; every section is checked before
+        # any is saved, then each is merged and saved
         try:
-            req = cl.recv(2048).decode()
-            if not req:
-                cl.close()
-                continue
-
-            blink()
-            line = req.split("\n")[0]
-            parts = line.split()
-            if len(parts) < 2:
-                cl.close()
-                continue
-            method, path = parts[0], parts[1]
-            print("[DEBUG] Request:", method, path)
-
-            # --------------------------
-            # LOGIN PAGE
-            # --------------------------
-            if path.startswith("/login"):
-                cl.send("HTTP/1.0 200 OK\r\nContent-Type:text/html\r\n\r\n")
-                send_html(cl, load_html("login.html"))
-                cl.close()
-                continue
-
-            # --------------------------
-            # DO LOGIN
-            # --------------------------
-            if path.startswith("/dologin"):
-                if method == "GET":
-                    q = parse_query(path)
-                elif method == "POST":
-                    try:
-                        body = req.split("\r\n\r\n")[1]
-                        q = parse_query("?" + body)
-                    except:
-                        q = {}
-                cfg = load_config()
-                if q.get("u") == cfg["auth"]["username"] and q.get("p") == cfg["auth"]["password"]:
-                    token = generate_token()
-                    sessions[token] = True
-                    cl.send("HTTP/1.0 302 Found\r\nSet-Cookie: session="+token+"\r\nLocation:/\r\n\r\n")
-                    print("[INFO] Login successful")
-                else:
-                    cl.send("HTTP/1.0 302 Found\r\nLocation:/login\r\n\r\n")
-                    print("[WARN] Login failed")
-                cl.close()
-                continue
-
-            # --------------------------
-            # LOGOUT
-            # --------------------------
-            if path.startswith("/logout"):
-                cl.send("HTTP/1.0 302 Found\r\nLocation:/login\r\n\r\n")
-                cl.close()
-                print("[INFO] Logout")
-                continue
-
-            # --------------------------
-            # SYSTEM REBOOT
-            # --------------------------
-            if path.startswith("/reboot"):
-                try:
-                    cl.send("HTTP/1.0 200 OK\r\nContent-Type:text/plain\r\n\r\nRebooting Pico...\r\n")
-                    cl.close()
-                    time.sleep(0.3)
-                    print("[INFO] Rebooting system now")
-                    reset()
-                except Exception as e:
-                    print("[ERROR] Reboot failed:", e)
-                continue
-
-            # --------------------------
-            # AUTHENTICATION CHECK
-            # --------------------------
-            if not is_authenticated(req):
-                if path.startswith("/data") or path.startswith("/digital"):
-                    cl.send("HTTP/1.0 401 Unauthorized\r\nContent-Type: application/json\r\n\r\n")
-                    cl.send('{"error":"auth"}')
-                else:
-                    cl.send("HTTP/1.0 302 Found\r\nLocation:/login\r\n\r\n")
-                cl.close()
-                continue
-
-            # --------------------------
-            # DATA ENDPOINT
-            # --------------------------
-            if path.startswith("/data"):
-                sens = read_sensors()
-                dins = read_digital_inputs()
-                check_thresholds(sens)
-                data = {
-                    "s1": sens[0]["voltage"],
-                    "s2": sens[1]["voltage"],
-                    "s3": sens[2]["voltage"],
-                    "i0": dins[0],
-                    "i1": dins[1],
-                    "o0": digital_outputs[0].value(),
-                    "o1": digital_outputs[1].value()
-                }
-                log_data(data)
-                mqtt_publish(json.dumps(data))
-                cl.send("HTTP/1.0 200 OK\r\nContent-Type:application/json\r\n\r\n")
-                cl.send(json.dumps(data))
-                cl.close()
-                continue
-
-            # --------------------------
-            # DIGITAL OUTPUT CONTROL
-            # --------------------------
-            if path.startswith("/digital"):
-                q = parse_query(path)
-                for k in q:
-                    if k.startswith("out"):
-                        try:
-                            idx = int(k[3:])
-                            val = int(q[k])
-                            set_digital_output(idx, val)
-                        except:
-                            pass
-                payload = json.dumps({
-                    "o0": digital_outputs[0].value(),
-                    "o1": digital_outputs[1].value()
-                })
-                cl.send("HTTP/1.0 200 OK\r\nContent-Type:application/json\r\n\r\n")
-                cl.send(payload)
-                cl.close()
-                continue
-
-            # --------------------------
-            # ROUTING FOR HTML PAGES
-            # --------------------------
-            page_map = {
-                "/": "dashboard.html",
-                "/sensors": "sensors.html",
-                "/digital": "digital.html",
-                "/wifi": "wifi.html",
-                "/system": "system.html",
-                "/graph": "graph.html"
-            }
-            if path in page_map:
-                cl.send("HTTP/1.0 200 OK\r\nContent-Type:text/html\r\n\r\n")
-                send_html(cl, load_html(page_map[path]))
-                cl.close()
-                continue
-
-            # --------------------------
-            # NOT FOUND
-            # --------------------------
-            cl.send("HTTP/1.0 404 Not Found\r\n\r\n")
-            cl.close()
-            print("[WARN] 404 Not Found:", path)
-
-        except Exception as e:
-            print("[ERROR] Exception:", e)
+            changes = json.loads(req.text())
+            if not isinstance(changes, dict):
+                raise ValueError("expected a JSON object")
+            for k in changes:
+                config.check_section(k, changes[k])
+        except ValueError as e:
+            log.warn("Bad config update: {}", e)
+            await respond(cl, req, "400 Bad Request", json.dumps({"ok": False, "error": str(e)}), JSON)
+            return
+        ok = all(config.update_section(k, changes[k]) for k in changes)
+        await respond(cl, req, "200 OK" if ok else "500 Internal Server Error",
+                      '{"ok":true}' if ok else '{"ok":false}', JSON)
+        return
+    cfg = json.loads(json.dumps(config.load_config()))
+    cfg["auth"]["password"] = ""
+    await respond(cl, req, "200 OK", json.dumps(cfg), JSON)
+
+# --------------------------
+# CHANNEL NAMES AND UNITS
+# --------------------------
+@app.route("/channels")
+async def channels(cl, req):
+    payload = json.dumps([{"name": sc.name, "unit": sc.unit} for sc in scalers])
+    await respond(cl, req, "200 OK", payload, JSON)
+
+# --------------------------
+# HISTORY (downsampled log)
+# --------------------------
+@app.route("/history")
+async def history(cl, req):
+    await send_history(cl, req)
+
+# --------------------------
+# LOG EXPORT (CSV)
+# --------------------------
+@app.route("/log.csv")
+async def log_csv(cl, req):
+    await start_chunked(cl, req, "200 OK", "text/csv",
+                        "Content-Disposition: attachment; filename=log.csv\r\n")
+    for line in datalog.csv_lines():
+        await send_chunk(cl, req, line)
+    await end_chunked(cl, req)
+
+# --------------------------
+# DIGITAL OUTPUT CONTROL
+# --------------------------
+@app.route("/digital", auth=API)
+async def digital(cl, req):
+    # Browser navigation gets the page; fetch() calls get the JSON state
+    if not req.query_string and "text/html" in req.header("accept", ""):
+        await send_page(cl, req, "digital.html")
+        return
+    q = req.query()
+    for k in q:
+        if k.startswith("out"):
             try:
-                cl.close()
+                idx = int(k[3:])
+                val = int(q[k])
+                set_digital_output(idx, val)
             except:
                 pass
+    payload = json.dumps({
+        "o0": digital_outputs[0].value(),
+        "o1": digital_outputs[1].value()
+    })
+    await respond(cl, req, "200 OK", payload, JSON)
+
+# --------------------------
+# API v1 (field selection, batched state)
+# --------------------------
+# Field name -> (Snapshot attribute, index or None, divisor or 0)
+STATE_FIELDS = {}
+STATE_ORDER = []    # same order as /data, then seq and ts
+
+def _state_field(name, attr, idx, div=0):
+    STATE_FIELDS[name] = (attr, idx, div)
+    STATE_ORDER.append(name)
+
+for _p, _attr, _div in (("s", "voltage", 0), ("e", "eng", ENG_SCALE), ("f", "fault", 0)):
+    for _i in range(len(snapshot.voltage)):
+        _state_field(_p + str(_i + 1), _attr, _i, _div)
+for _p, _attr in (("i", "din"), ("o", "dout"), ("n", "count"), ("hz", "freq")):
+    for _i in range(len(getattr(snapshot, _attr))):
+        _state_field(_p + str(_i), _attr, _i)
+_state_field("ev", "events", None)
+_state_field("seq", "seq", None)
+_state_field("ts", "ts", None)
+
+def _field(name):
+    attr, idx, div = STATE_FIELDS[name]
+    v = getattr(snapshot, attr)
+    if idx is not None:
+        v = v[idx]
+    return v / div if div else v
+
+async def _unknown(cl, req, what, name):
+    await respond(cl, req, "400 Bad Request",
+                  '{{"error":"{}","name":{}}}'.format(what, json.dumps(name)), JSON)
+
+@app.route("/api/v1/state", auth=API)
+async def api_state(cl, req):
+    fields = req.query().get("fields")
+    names = fields.split(",") if fields else STATE_ORDER
+    for name in names:
+        if name not in STATE_FIELDS:
+            await _unknown(cl, req, "field", name)
+            return
+    w = jsonw.writer()
+    try:
+        w.begin(cl, req)
+        w.open()
+        for name in names:
+            w.item(name, _field(name))
+        w.close()
+        await w.end()
+    finally:
+        jsonw.release(w)
+
+def _batch_sensors(w):
+    w.open(b"[")
+    for i in range(len(scalers)):
+        w.open()
+        w.item("name", scalers[i].name)
+        w.item("unit", scalers[i].unit)
+        w.item("v", snapshot.voltage[i])
+        w.item("e", snapshot.eng[i] / ENG_SCALE)
+        w.item("fault", snapshot.fault[i])
+        w.close()
+    w.close(b"]")
+
+def _batch_digital(w):
+    w.open()
+    w.item("in", snapshot.din)
+    w.item("out", snapshot.dout)
+    w.item("count", snapshot.count)
+    w.item("freq", snapshot.freq)
+    w.item("rate", digital_io.rates)
+    w.close()
+
+def _batch_alarms(w):
+    w.open(b"[")
+    for al in alarms.find():
+        if al.state != alarms.NORMAL:
+            w.open()
+            w.item("ch", al.ch + 1)
+            w.item("kind", alarms.KINDS[al.kind])
+            w.item("state", alarms.STATES[al.state])
+            w.close()
+    w.close(b"]")
+
+def _batch_system(w):
+    w.open()
+    w.item("seq", snapshot.seq)
+    w.item("ts", snapshot.ts)
+    w.item("uptime_s", metrics.uptime())
+    if hasattr(gc, "mem_free"):
+        w.item("mem_free", gc.mem_free())
+    w.item("web_clients", _active)
+    w.item("stream_clients", stream.client_count())
+    w.item("sessions", sessions.count())
+    w.key("mqtt")
+    w.open()
+    w.item("connected", mqtt_client.connected)
+    w.item("queue", mqtt_client.queue_depth())
+    w.item("inflight", mqtt_client.inflight_depth())
+    w.item("dropped", mqtt_client.dropped)
+    w.close()
+    w.close()
+
+def _batch_config(w):
+    w.open()
+    w.item("interval_ms", sampler.SAMPLE_INTERVAL_MS)
+    w.item("threshold_low", threshold_low)
+    w.item("threshold_high", threshold_high)
+    w.close()
+
+BATCH_SECTIONS = {
+    "sensors": _batch_sensors,
+    "digital": _batch_digital,
+    "alarms": _batch_alarms,
+    "system": _batch_system,
+    "config": _batch_config,
+}
+BATCH_ORDER = ("sensors", "digital", "alarms", "system", "config")
+
+@app.route("/api/v1/batch", auth=API)
+async def api_batch(cl, req):
+    include = req.query().get("include")
+    names = include.split(",") if include else BATCH_ORDER
+    for name in names:
+        if name not in BATCH_SECTIONS:
+            await _unknown(cl, req, "section", name)
+            return
+    w = jsonw.writer()
+    try:
+        w.begin(cl, req)
+        w.open()
+        for name in names:
+            w.key(name)
+            BATCH_SECTIONS[name](w)
+        w.close()
+        await w.end()
+    finally:
+        jsonw.release(w)
+
+# --------------------------
+# ALARMS
+# --------------------------
+def _alarm_filter(q):
+    """(ch, kind) from ?ch=<1..n>&kind=<name>; raises ValueError naming the bad parameter."""
+    ch = q.get("ch")
+    kind = q.get("kind")
+    if ch is not None:
+        try:
+            ch = int(ch) - 1
+        except ValueError:
+            raise ValueError("ch")
+        if not 0 <= ch < alarms.N_CH:
+            raise ValueError("ch")
+    if kind is not None and kind not in alarms.KINDS:
+        raise ValueError("kind")
+    return ch, kind
+
+# Every alarm with a limit and its state; ?ch and ?kind filter
+@app.route("/alarms", auth=API)
+async def alarm_list(cl, req):
+    try:
+        ch, kind = _alarm_filter(req.query())
+    except ValueError as e:
+        await _unknown(cl, req, str(e), req.query().get(str(e)))
+        return
+    active, unack = alarms.counts()
+    w = jsonw.writer()
+    try:
+        w.begin(cl, req)
+        w.open()
+        w.item("active", active)
+        w.item("unack", unack)
+        w.item("seq", alarms.event_seq)
+        w.key("alarms")
+        w.open(b"[")
+        for al in alarms.find(ch, kind):
+            w.open()
+            w.item("ch", al.ch + 1)
+            w.item("kind", alarms.KINDS[al.kind])
+            w.item("state", alarms.STATES[al.state])
+            w.item("limit", al.limit)
+            w.item("cond", al.cond)
+            w.item("since", al.since)
+            w.item("value", al.value)
+            w.close()
+        w.close(b"]")
+        w.close()
+        await w.end()
+    finally:
+        jsonw.release(w)
+
+# Acknowledge alarms: all of them, or those matching ?ch and ?kind
+@app.route("/alarms/ack", methods=("GET", "POST"), auth=API)
+async def alarm_ack(cl, req):
+    try:
+        ch, kind = _alarm_filter(req.query())
+    except ValueError as e:
+        await _unknown(cl, req, str(e), req.query().get(str(e)))
+        return
+    await respond(cl, req, "200 OK", '{{"acked":{}}}'.format(alarms.ack(ch, kind)), JSON)
+
+# Alarm state changes, oldest first; poll with ?after=<seq>
+@app.route("/alarms/events", auth=API)
+async def alarm_events(cl, req):
+    after = _int_arg(req.query(), "after", -1)
+    w = jsonw.writer()
+    try:
+        w.begin(cl, req)
+        w.open()
+        w.item("seq", alarms.event_seq)
+        w.key("events")
+        w.open(b"[")
+        for n, t, ch, kind, event, state, value in alarms.events(after):
+            w.open()
+            w.item("seq", n)
+            w.item("t", t)
+            w.item("ch", ch + 1)
+            w.item("kind", alarms.KINDS[kind])
+            w.item("event", alarms.EVENT_NAMES[event])
+            w.item("state", alarms.STATES[state])
+            w.item("value", value)
+            w.close()
+        w.close(b"]")
+        w.close()
+        await w.end()
+    finally:
+        jsonw.release(w)
+
+# Input state changes from digital_io's event ring, oldest first. Poll
+# with ?after=<seq of the last event seen>.
+@app.route("/api/v1/events", auth=API)
+async def api_events(cl, req):
+    after = _int_arg(req.query(), "after", -1)
+    w = jsonw.writer()
+    try:
+        w.begin(cl, req)
+        w.open()
+        w.item("seq", digital_io.event_seq)
+        w.key("events")
+        w.open(b"[")
+        for n, t, i, level, count, bits in digital_io.events(after):
+            w.open()
+            w.item("seq", n)
+            w.item("t", t)
+            w.item("in", i)
+            w.item("v", level)
+            w.item("count", count)
+            w.close()
+        w.close(b"]")
+        w.close()
+        await w.end()
+    finally:
+        jsonw.release(w)
+
+# Recent log entries from debug's ring, oldest first. Poll with
+# ?after=<seq of the last entry seen>; level and module filter.
+@app.route("/api/v1/logs", auth=API)
+async def api_logs(cl, req):
+    q = req.query()
+    after = _int_arg(q, "after", -1)
+    level = debug.LEVELS.get(q.get("level", "debug"))
+    if level is None:
+        await _unknown(cl, req, "level", q.get("level"))
+        return
+    w = jsonw.writer()
+    try:
+        w.begin(cl, req)
+        w.open()
+        w.item("seq", debug.seq)
+        w.item("dropped", debug.dropped)
+        w.key("entries")
+        w.open(b"[")
+        for n, t, lv, mod, text in debug.entries(after, level, q.get("module")):
+            w.open(b"[")
+            w.value(n)
+            w.value(t)
+            w.value(debug.NAMES[lv])
+            w.value(mod)
+            w.value(text)
+            w.close(b"]")
+        w.close(b"]")
+        w.close()
+        await w.end()
+    finally:
+        jsonw.release(w)
+
+# --------------------------
+# METRICS (Prometheus text format)
+# --------------------------
+@metrics.collector
+def _web_metrics(out):
+    metrics.gauge(out, "http_connections", _active, "Open HTTP connections")
+    metrics.gauge(out, "http_idle_connections", len(_idle), "Kept-alive connections waiting for a request")
+    metrics.counter(out, "http_rejected_total", rejected, "Connections refused at the connection limit")
+    metrics.header(out, "http_requests_total", "counter", "Requests answered, by route")
+    for r in app.routes:
+        if r.count:
+            metrics.value(out, "http_requests_total", r.count, 'route="{}"'.format(r.path))
+    metrics.header(out, "http_request_duration_seconds", "histogram", "Request handling time, by route")
+    for r in app.routes:
+        if r.hist is not None:
+            metrics.histogram(out, "http_request_duration_seconds", r.hist, 'route="{}"'.format(r.path))
+    metrics.gauge(out, "sessions", sessions.count(), "Logged-in sessions")
+    metrics.counter(out, "static_served_total", static.served, "Static files sent in full")
+    metrics.counter(out, "static_cache_hits_total", static.cache_hits, "Static files sent from the RAM cache")
+    metrics.counter(out, "static_not_modified_total", static.not_modified, "Static files answered with 304")
+    metrics.gauge(out, "stream_clients", stream.client_count(), "Live stream subscribers")
+
+@app.route("/metrics", auth=PUBLIC if metrics.PUBLIC else API)
+async def metrics_page(cl, req):
+    if not metrics.ENABLED:
+        await respond(cl, req, "404 Not Found", "metrics disabled", "text/plain")
+        return
+    await start_chunked(cl, req, "200 OK", "text/plain; version=0.0.4")
+    # Collectors write line by line; batch the lines into chunks and let
+    # one drain at the end push them out.
+    pending = []
+    size = [0]
+    def out(line):
+        pending.append(line)
+        size[0] += len(line)
+        if size[0] >= METRICS_FLUSH:
+            write_chunk(cl, req, "".join(pending).encode())
+            pending.clear()
+            size[0] = 0
+    metrics.render(out)
+    await send_chunk(cl, req, "".join(pending))
+    await end_chunked(cl, req)
+
+# --------------------------
+# HTML PAGES
+# --------------------------
+def _page(path, filename):
+    async def handler(cl, req):
+        await send_page(cl, req, filename)
+    app.route(path)(handler)
+
+for _path, _file in (
+    ("/", "dashboard.html"),
+    ("/sensors", "sensors.html"),
+    ("/wifi", "wifi.html"),
+    ("/system", "system.html"),
+    ("/graph", "graph.html"),
+    ("/logs", "logs.html"),
+):
+    _page(_path, _file)
+
+# Other assets in html/ (stylesheets, scripts, icons) under /static/
+@app.route("/static", auth=PUBLIC, prefix=True)
+async def static_asset(cl, req):
+    name = req.path[len("/static/"):]
+    # Pages are served by their own authenticated routes, also as <page>.html.gz
+    page = name[:-3] if name.endswith(".gz") else name
+    if not name or "/" in name or name.startswith(".") or page.endswith(".html"):
+        await respond(cl, req, "404 Not Found")
+        return
+    if not await static.send_file(cl, req, name):
+        await respond(cl, req, "404 Not Found")
+
+# --------------------------
+# Request handling
+# --------------------------
+async def handle_request(cl, req):
+    """Answer one request. Returns True if the connection must stay open."""
+    blink()
+    log.debug("Request: {} {}", req.method, req.path)
+    return await app.dispatch(cl, req)
+
+# --------------------------
+# HTTP Server
+# --------------------------
+async def handle_client(reader, cl):
+    global _active, rejected
+    if _active >= MAX_CONNECTIONS and _idle:
+        # Reclaim the slot of the longest-idle kept-alive connection. Its
+        # handler sees the close and exits; wait for that, so its slot and
+        # Request are given back before this connection takes them.
+        await close(_idle.pop(0))
+        try:
+            while _active >= MAX_CONNECTIONS:
+                _freed.clear()
+                await asyncio.wait_for(_freed.wait(), READ_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+    if _active >= MAX_CONNECTIONS:
+        try:
+            await send(cl, "HTTP/1.0 503 Service Unavailable\r\nRetry-After: 1\r\n\r\n")
+        except Exception:
+            pass
+        await close(cl)
+        rejected += 1
+        log.warn("Connection limit reached, rejected client")
+        return
+
+    _active += 1
+    req = _requests.pop() if _requests else Request()
+    keep = False
+    served = 0
+    try:
+        # Serve requests until the client or a limit ends the connection.
+        # Pipelined requests are already in req's buffer and parse at once.
+        while True:
+            if served:
+                _idle.append(cl)
+            try:
+                ok = await asyncio.wait_for(req.read(reader), IDLE_TIMEOUT if served else READ_TIMEOUT)
+            finally:
+                if cl in _idle:
+                    _idle.remove(cl)
+            if not ok:
+                break
+            served += 1
+            if served >= MAX_REQUESTS:
+                req.keep_alive = False
+            keep = await handle_request(cl, req)
+            if keep or not req.keep_alive:
+                break
+    except HTTPError as e:
+        log.warn("Bad request: {}", e.status)
+        try:
+            await send(cl, "HTTP/1.0 {} {}\r\nConnection: close\r\nContent-Length: 0\r\n\r\n".format(
+                e.status, e.reason))
+        except Exception:
+            pass
+    except asyncio.TimeoutError:
+        if not served:
+            log.debug("Client read timeout")
+    except Exception as e:
+        log.error("Exception: {}", e)
+    finally:
+        _active -= 1
+        _requests.append(req)
+        _freed.set()
+        if not keep:
+            await close(cl)
+
+async def serve(host="0.0.0.0", port=None):
+    if port is None:
+        port = PORT
+    server = await asyncio.start_server(handle_client, host, port, backlog=BACKLOG)
+    log("Webserver running on {}:{}", host, port)
+    return server
@@ -0,0 +1,204 @@
+"""
+Streaming JSON writer (PicoW/Code/jsonw.py) vs. building a dict and
+calling json.dumps, for a /api/v1/batch sized document.
+
+  * correctness: the writer's output, with buffers from 16 bytes up (so
+    chunked spilling is exercised), must decode to the same document as
+    json.dumps, on HTTP/1.1 and HTTP/1.0. Keys and strings with quotes,
+    backslashes and control characters must come out escaped
+  * allocation: peak bytes allocated per response (tracemalloc), which
+    is what matters on the Pico's fragmented heap
+  * throughput: responses serialised per second. json.dumps is native
+    code (on MicroPython too) while the writer is interpreted, so the
+    writer is slower; it trades CPU time for heap
+
+    python bench_json.py [responses]
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+import tracemalloc
+from array import array
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "Code"))
+
+import jsonw  # noqa: E402
+
+VOLTAGE = array("f", [1.5223, 1.5263, 0.4821])
+DIN = array("B", [0, 1])
+DOUT = array("B", [1, 0])
+NAMES = [("Tank level", "%"), ("Flow", "l/min"), ("Pressure", "bar \"g\"")]
+
+
+class Req:
+    def __init__(self, version="HTTP/1.1"):
+        self.version = version
+        self.method = "GET"
+        self.keep_alive = version == "HTTP/1.1"
+        self.chunked = False
+
+
+class Sink:
+    def __init__(self):
+        self.data = bytearray()
+        self.writes = 0
+
+    def write(self, b):
+        self.data += b
+        self.writes += 1
+
+    async def drain(self):
+        pass
+
+
+def as_dict():
+    return {
+        "sensors": [{"name": n, "unit": u, "v": VOLTAGE[i], "e": i * 12.5, "fault": 0}
+                    for i, (n, u) in enumerate(NAMES)],
+        "digital": {"in": list(DIN), "out": list(DOUT)},
+        "alarms": [{"ch": 3, "kind": "lo", "state": "unack"}],
+        "system": {"seq": 123456, "ts": 1700000000, "uptime_s": 86400, "mem_free": 81234,
+                   "mqtt": {"connected": True, "queue": 0, "inflight": 2, "dropped": 0}},
+        "config": {"interval_ms": 1000, "threshold_low": [0.5, 0.5, 0.5],
+                   "threshold_high": [2.5, 2.5, 2.5]},
+    }
+
+
+def write_doc(w):
+    w.open()
+    w.key("sensors")
+    w.open(b"[")
+    for i in range(len(NAMES)):
+        w.open()
+        w.item("name", NAMES[i][0])
+        w.item("unit", NAMES[i][1])
+        w.item("v", VOLTAGE[i])
+        w.item("e", i * 12.5)
+        w.item("fault", 0)
+        w.close()
+    w.close(b"]")
+    w.key("digital")
+    w.open()
+    w.item("in", DIN)
+    w.item("out", DOUT)
+    w.close()
+    w.key("alarms")
+    w.value([{"ch": 3, "kind": "lo", "state": "unack"}])
+    w.key("system")
+    w.open()
+    for k, v in (("seq", 123456), ("ts", 1700000000), ("uptime_s", 86400), ("mem_free", 81234)):
+        w.item(k, v)
+    w.item("mqtt", {"connected": True, "queue": 0, "inflight": 2, "dropped": 0})
+    w.close()
+    w.key("config")
+    w.open()
+    w.item("interval_ms", 1000)
+    w.item("threshold_low", [0.5, 0.5, 0.5])
+    w.item("threshold_high", [2.5, 2.5, 2.5])
+    w.close()
+    w.close()
+
+
+def body_of(raw):
+    head, _, body = bytes(raw).partition(b"\r\n\r\n")
+    if b"Transfer-Encoding: chunked" not in head:
+        return body
+    out = b""
+    while True:
+        size, _, rest = body.partition(b"\r\n")
+        size = int(size, 16)
+        if not size:
+            return out
+        out += rest[:size]
+        body = rest[size + 2:]
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def check():
+    want = as_dict()
+    sizes = [16, 24, 64, 128, 256, jsonw.BUF_SIZE]
+    for version in ("HTTP/1.1", "HTTP/1.0"):
+        for size in sizes:
+            w = jsonw.JsonWriter(size)
+            sink, req = Sink(), Req(version)
+            w.begin(sink, req)
+            write_doc(w)
+            run(w.end())
+            got = json.loads(body_of(sink.data))
+            assert json.dumps(got, sort_keys=True) == json.dumps(want, sort_keys=True), (version, size)
+            if size == jsonw.BUF_SIZE:
+                assert b"Content-Length" in sink.data and req.keep_alive == (version == "HTTP/1.1")
+    return len(sizes) * 2
+
+
+# Strings JSON needs escaped: quotes, backslashes and every control character
+ESCAPES = ["", "plain", 'say "hi"', "C:\\pico", "tab\there", "a\r\nb", "nul\x00",
+           "bell\x07", "esc\x1b[0m", "\x1f", "del\x7f", "m\u00b3/h"]
+
+
+def check_escapes():
+    for s in ESCAPES:
+        w = jsonw.JsonWriter(16)
+        sink, req = Sink(), Req()
+        w.begin(sink, req)
+        w.open()
+        w.item(s, s)
+        w.close()
+        run(w.end())
+        body = body_of(sink.data)
+        assert not any(b < 0x20 for b in body), repr(s)
+        assert json.loads(body) == {s: s}, repr(s)
+    return len(ESCAPES)
+
+
+async def bench(n, fn):
+    sink, req = Sink(), Req()
+    await fn(sink, req)
+    sink.data = bytearray()
+    tracemalloc.start()
+    await fn(sink, req)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    t0 = time.perf_counter()
+    for _ in range(n):
+        sink.data = bytearray()
+        await fn(sink, req)
+    return n / (time.perf_counter() - t0), peak
+
+
+async def with_dumps(sink, req):
+    body = json.dumps(as_dict()).encode()
+    sink.write(("HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                "Content-Length: {}\r\n\r\n".format(len(body))).encode())
+    sink.write(body)
+    await sink.drain()
+
+
+_w = jsonw.JsonWriter()
+
+
+async def with_writer(sink, req):
+    _w.begin(sink, req)
+    write_doc(_w)
+    await _w.end()
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    print("correctness: {} buffer/version combinations ok".format(check()))
+    print("escaping: {} strings with quotes/control characters ok".format(check_escapes()))
+    print("{:<12} {:>12} {:>16}".format("serialiser", "responses/s", "peak alloc (B)"))
+    for name, fn in (("json.dumps", with_dumps), ("jsonw", with_writer)):
+        rate, peak = run(bench(n, fn))
+        print("{:<12} {:>12.0f} {:>16}".format(name, rate, peak))
+
+
+if __name__ == "__main__":
+    main()
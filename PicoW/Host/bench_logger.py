@@ -0,0 +1,98 @@
+"""
+Write throughput and size comparison: binary ring log vs. per-line CSV.
+
+The CSV path reproduces the old logger.log_data() (open in append mode,
+format one line, close). The binary path drives logger.py with LOG_INTERVAL
+forced to 0, so every call produces a record and flushes happen in batches.
+
+    python bench_logger.py [records]
+
+Runs in a scratch directory; nothing is written next to the firmware.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from array import array
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CODE = os.path.join(HERE, "..", "Code")
+
+
+class Snap:
+    def __init__(self):
+        self.voltage = array("f", [1.23, 2.34, 0.56])
+        self.din = array("B", [1, 0])
+        self.dout = array("B", [0, 1])
+
+
+def bench_csv(n, snap):
+    path = "log.csv"
+    t0 = time.perf_counter()
+    for i in range(n):
+        with open(path, "a") as f:
+            f.write("{},{},{},{},{},{},{},{}\n".format(
+                1700000000 + i, snap.voltage[0], snap.voltage[1], snap.voltage[2],
+                snap.din[0], snap.din[1], snap.dout[0], snap.dout[1]))
+    dt = time.perf_counter() - t0
+    return {"records_per_s": int(n / dt), "bytes_per_record": round(os.path.getsize(path) / n, 1),
+            "file_opens": n}
+
+
+def bench_binary(n, snap):
+    import logger
+    logger.LOG_INTERVAL = 0
+    logger.init_logger()
+    opens = [0]
+    real_flush = logger.flush
+
+    def counted_flush():
+        if logger._pending:
+            opens[0] += 1
+        real_flush()
+    logger.flush = counted_flush
+
+    clock = [1700000000]
+    logger.time.time = lambda: clock[0]
+    t0 = time.perf_counter()
+    for _ in range(n):
+        clock[0] += 1
+        logger.log_data(snap)
+        if logger._pending >= logger.BATCH:
+            counted_flush()
+    counted_flush()
+    dt = time.perf_counter() - t0
+
+    kept = sum(1 for _ in logger.iter_records())
+    return {"records_per_s": int(n / dt), "bytes_per_record": logger.RECORD_SIZE,
+            "file_opens": opens[0], "records_kept": kept,
+            "capacity": logger.SEGMENTS * logger.PER_SEGMENT,
+            "file_size": os.path.getsize(logger.LOG_FILE)}
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    work = tempfile.mkdtemp(prefix="picosens-log-")
+    shutil.copy(os.path.join(CODE, "def_config.json"), work)
+    os.chdir(work)
+    sys.path[:0] = [CODE, os.path.join(HERE, "sim")]
+    import simclock  # noqa: F401  (time.ticks_* for the firmware modules)
+    try:
+        snap = Snap()
+        csv = bench_csv(n, snap)
+        binary = bench_binary(n, snap)
+    finally:
+        os.chdir(HERE)
+        shutil.rmtree(work)
+    print("records: {}".format(n))
+    print("{:<8} {:>12} {:>16} {:>12}".format("logger", "records/s", "bytes/record", "file opens"))
+    for name, r in (("csv", csv), ("binary", binary)):
+        print("{:<8} {:>12} {:>16} {:>12}".format(
+            name, r["records_per_s"], r["bytes_per_record"], r["file_opens"]))
+    print("binary ring: {} of {} records kept, fixed size {} bytes".format(
+        binary["records_kept"], binary["capacity"], binary["file_size"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Bytes on the wire and publish rate for each mqtt.publish setting.
+
+Feeds the same simulated sample stream (three slowly drifting 4-20 mA
+channels with noise, digital inputs toggling occasionally) through
+publisher.publish_snapshot() in each mode and counts MQTT PUBLISH packets
+and their size including fixed header and topic. "legacy" is the original
+behaviour: the whole JSON snapshot on every sample.
+
+    python bench_mqtt_payload.py [samples]
+    python bench_mqtt_payload.py 2000 --broker 127.0.0.1:1883   # also time real sends
+
+With --broker the generated packets are written to a broker (for example
+fake_broker.py) over one TCP connection to measure publishes/second.
+"""
+import argparse
+import os
+import random
+import shutil
+import socket
+import struct
+import sys
+import tempfile
+import time
+from array import array
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CODE = os.path.join(HERE, "..", "Code")
+
+SCENARIOS = [
+    ("legacy json", None),
+    ("snapshot json", {"mode": "snapshot", "format": "json", "deadband": [0.5, 0.5, 0.5]}),
+    ("snapshot binary", {"mode": "snapshot", "format": "binary", "deadband": [0.5, 0.5, 0.5]}),
+    ("channels text", {"mode": "channels", "format": "json", "deadband": [0.5, 0.5, 0.5]}),
+    ("channels binary", {"mode": "channels", "format": "binary", "deadband": [0.5, 0.5, 0.5]}),
+]
+
+_JSON = ('{{"s1":{},"s2":{},"s3":{},"e1":{},"e2":{},"e3":{},'
+         '"f1":{},"f2":{},"f3":{},"i0":{},"i1":{},"o0":{},"o1":{}}}')
+
+
+class Snap:
+    def __init__(self):
+        self.ts = 1700000000
+        self.voltage = array("f", [0.0] * 3)
+        self.eng = array("i", [0] * 3)
+        self.fault = array("B", [0] * 3)
+        self.din = array("B", [0, 0])
+        self.dout = array("B", [0, 0])
+
+    def json(self):
+        return _JSON.format(self.voltage[0], self.voltage[1], self.voltage[2],
+                            self.eng[0] / 1000, self.eng[1] / 1000, self.eng[2] / 1000,
+                            self.fault[0], self.fault[1], self.fault[2],
+                            self.din[0], self.din[1], self.dout[0], self.dout[1])
+
+
+CLOCK = [1700000000]
+
+
+def samples(n, seed=1):
+    rnd = random.Random(seed)
+    snap = Snap()
+    CLOCK[0] = snap.ts
+    level = [40.0, 55.0, 70.0]
+    for i in range(n):
+        snap.ts += 1
+        CLOCK[0] = snap.ts
+        for c in range(3):
+            level[c] += rnd.uniform(-0.05, 0.05)
+            value = level[c] + rnd.uniform(-0.2, 0.2)
+            snap.eng[c] = int(value * 1000)
+            snap.voltage[c] = (4 + value * 16 / 100) * 0.165
+        if rnd.random() < 0.01:
+            snap.din[0] ^= 1
+        yield snap
+
+
+def wire_size(topic, payload):
+    body = 2 + len(topic) + len(payload)
+    n = 1
+    while body > 0x7F:
+        body >>= 7
+        n += 1
+    return 1 + n + 2 + len(topic) + len(payload)
+
+
+def run(publisher, spec, n, topic):
+    sent = []
+    publisher.mqtt_publish = lambda payload, t=None: sent.append(
+        (t or topic, payload.encode() if isinstance(payload, str) else payload))
+    if spec is not None:
+        cfg = {"topic": topic.decode(), "publish": dict(spec, max_interval_s=60)}
+        publisher.apply_config({"mqtt": cfg})
+    t0 = time.perf_counter()
+    for snap in samples(n):
+        if spec is None:
+            publisher.mqtt_publish(snap.json())
+        else:
+            publisher.publish_snapshot(snap)
+    dt = time.perf_counter() - t0
+    return sent, dt
+
+
+def send_all(addr, messages):
+    host, port = addr.split(":")
+    s = socket.create_connection((host, int(port)))
+    cid = b"bench"
+    var = b"\x00\x04MQTT\x04\x02\x00\x3c" + struct.pack("!H", len(cid)) + cid
+    s.sendall(bytes([0x10, len(var)]) + var)
+    s.recv(4)
+    t0 = time.perf_counter()
+    for topic, payload in messages:
+        body = struct.pack("!H", len(topic)) + topic + payload
+        hdr = bytearray([0x30])
+        n = len(body)
+        while True:
+            b = n & 0x7F
+            n >>= 7
+            hdr.append(b | 0x80 if n else b)
+            if not n:
+                break
+        s.sendall(bytes(hdr) + body)
+    s.sendall(b"\xe0\x00")
+    s.close()
+    return time.perf_counter() - t0
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("samples", type=int, nargs="?", default=3600)
+    ap.add_argument("--broker", help="host:port to send the generated packets to")
+    args = ap.parse_args()
+
+    work = tempfile.mkdtemp(prefix="picosens-mqtt-")
+    shutil.copy(os.path.join(CODE, "def_config.json"), work)
+    os.chdir(work)
+    sys.path.insert(0, CODE)
+    # Simulated clock: one sample per second, so max_interval_s applies
+    time.ticks_ms = lambda: (CLOCK[0] - 1700000000) * 1000
+    time.ticks_diff = lambda a, b: a - b
+    try:
+        import debug
+        debug.CONSOLE = False
+        import publisher
+        topic = b"picosense/data"
+        print("samples: {}".format(args.samples))
+        print("{:<16} {:>9} {:>12} {:>10} {:>14}{}".format(
+            "mode", "messages", "wire bytes", "bytes/msg", "samples/s",
+            "  send msg/s" if args.broker else ""))
+        for name, spec in SCENARIOS:
+            sent, dt = run(publisher, spec, args.samples, topic)
+            total = sum(wire_size(t, p) for t, p in sent)
+            line = "{:<16} {:>9} {:>12} {:>10.1f} {:>14}".format(
+                name, len(sent), total, total / max(1, len(sent)), int(args.samples / dt) if dt else 0)
+            if args.broker:
+                st = send_all(args.broker, sent)
+                line += " {:>12}".format(int(len(sent) / st) if st else 0)
+            print(line)
+    finally:
+        os.chdir(HERE)
+        shutil.rmtree(work)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Socket writes per publish and publish rate: umqtt packet assembly before
+and after the single-buffer change.
+
+"legacy" replays the original MQTTClient.publish() write pattern (fixed
+header, topic length, topic, packet id, payload as separate writes);
+"buffered" is the current client. Both publish to an in-process
+fake_broker.py over TCP. Payload sizes above the client's buffer show the
+two-write path used for large messages.
+
+    python bench_mqtt_writes.py [messages]
+    python bench_mqtt_writes.py 20000 --sizes 20 180 2000 --qos 1
+"""
+import argparse
+import os
+import struct
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "Code"))
+sys.path.insert(0, HERE)
+
+import upy_socket  # noqa: E402
+from bench_mqtt_qos import start_broker  # noqa: E402
+from umqtt import simple  # noqa: E402
+
+simple.socket = upy_socket
+
+
+def legacy_publish(c, topic, msg, qos):
+    """The write sequence of the original publish(), acks handled by the client."""
+    pid = 0
+    if qos:
+        while len(c.inflight) >= c.max_inflight:
+            c.wait_msg()
+        pid = c._next_pid()
+        c.inflight[pid] = [topic, msg, False, qos, 0x40 if qos == 1 else 0x50]
+    pkt = bytearray(b"\x30\0\0\0")
+    pkt[0] |= qos << 1
+    sz = 2 + len(topic) + len(msg) + (2 if qos else 0)
+    i = 1
+    while sz > 0x7F:
+        pkt[i] = (sz & 0x7F) | 0x80
+        sz >>= 7
+        i += 1
+    pkt[i] = sz
+    c.sock.write(pkt, i + 1)
+    c.sock.write(struct.pack("!H", len(topic)))
+    c.sock.write(topic)
+    if qos:
+        struct.pack_into("!H", pkt, 0, pid)
+        c.sock.write(pkt, 2)
+    c.sock.write(msg)
+
+
+def run(port, legacy, n, size, qos):
+    c = simple.MQTTClient("bench-writes", "127.0.0.1", port=port, max_inflight=16)
+    c.connect(timeout=5)
+    topic = b"picosense/data"
+    payload = b"x" * size
+    pub = (lambda: legacy_publish(c, topic, payload, qos)) if legacy else (
+        lambda: c.publish(topic, payload, qos=qos))
+    upy_socket.reset_counters()
+    t0 = time.perf_counter()
+    for _ in range(n):
+        pub()
+        while c.inflight and c.check_msg() is not None:
+            pass
+    c.wait_inflight()
+    dt = time.perf_counter() - t0
+    writes = upy_socket.writes
+    c.disconnect()
+    return writes, dt
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("messages", type=int, nargs="?", default=5000)
+    ap.add_argument("--sizes", type=int, nargs="+", default=[20, 180, 1000])
+    ap.add_argument("--qos", type=int, default=0, choices=(0, 1, 2))
+    args = ap.parse_args()
+
+    _, port = start_broker()
+    print("messages: {}  qos: {}  client buffer: {} bytes".format(
+        args.messages, args.qos, len(simple.MQTTClient("x", "h")._buf)))
+    print("{:>8} {:<9} {:>12} {:>10}".format("payload", "client", "writes/msg", "msg/s"))
+    for size in args.sizes:
+        for name, legacy in (("legacy", True), ("buffered", False)):
+            writes, dt = run(port, legacy, args.messages, size, args.qos)
+            print("{:>8} {:<9} {:>12.2f} {:>10}".format(
+                size, name, writes / args.messages, int(args.messages / dt)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""
+Benchmark suite for the whole firmware, run on the host.
+
+Boots the unmodified firmware with picosim.py (simulated hardware, MQTT
+to an in-process fake broker) and measures:
+
+  * that each endpoint answers 200 with a well-formed body (fails the run)
+  * /data latency from one keep-alive client (p50 / p99)
+  * requests per second from several clients, with and without keep-alive
+  * sampling jitter and time spent per acquisition
+  * firmware MQTT publishes reaching the broker
+  * Python heap peak of the running firmware (second run, tracemalloc)
+  * log write throughput (logger.py, as in bench_logger.py)
+  * umqtt publish rate at QoS 0 and 1 (as in bench_mqtt_qos.py)
+
+and writes a JSON report with the commit it ran on, so two runs can be
+compared:
+
+    python bench_suite.py --out base.json
+    (change something)
+    python bench_suite.py --out new.json --compare base.json
+    python bench_suite.py --quick                  # shorter runs, for CI
+
+Host numbers are not Pico numbers; compare reports from the same machine.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CODE = os.path.join(HERE, "..", "Code")
+sys.path.insert(0, HERE)
+
+import bench_logger  # noqa: E402
+import bench_mqtt_qos  # noqa: E402
+import loadtest  # noqa: E402
+
+# Metrics where a larger value is an improvement; all others are costs
+HIGHER_IS_BETTER = {"http_req_per_s_close", "http_req_per_s_keepalive",
+                    "logger_records_per_s", "mqtt_qos0_msg_per_s", "mqtt_qos1_msg_per_s",
+                    "mqtt_firmware_publishes"}
+
+
+def free_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def wait_listening(port, timeout=15):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        try:
+            socket.create_connection(("127.0.0.1", port), 0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise SystemExit("firmware did not start listening on port {}".format(port))
+
+
+def start_firmware(port, duration, report, broker_port=None, sample_ms=None, trace=False):
+    cmd = [sys.executable, os.path.join(HERE, "picosim.py"), "--port", str(port),
+           "--duration", str(duration), "--report", report, "--rate-limit", "0"]
+    if broker_port:
+        cmd += ["--broker", "127.0.0.1:{}".format(broker_port)]
+    if sample_ms:
+        cmd += ["--sample-ms", str(sample_ms)]
+    if trace:
+        cmd.append("--trace-heap")
+    proc = subprocess.Popen(cmd, stderr=subprocess.DEVNULL)
+    wait_listening(port)
+    return proc
+
+
+# Requested once on one keep-alive connection before the load phases
+ENDPOINTS = ("/data", "/history?from=-3600&points=10", "/log.csv", "/metrics",
+             "/api/v1/batch", "/api/v1/state", "/api/v1/events", "/api/v1/logs", "/alarms")
+# Sent as HEAD pipelined with a GET /data: the HEAD answer must carry no body
+HEAD_PATHS = ("/data", "/history", "/log.csv", "/metrics", "/api/v1/batch", "/sensors")
+
+
+async def check_endpoints(port, paths=ENDPOINTS, timeout=10.0):
+    """Paths that did not answer 200 with a parseable body, with the reason."""
+    token = await loadtest.login("127.0.0.1", port, "admin", "admin123", timeout)
+    failed = []
+    reader = writer = None
+    for path in paths:
+        if writer is None:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write("GET {} HTTP/1.1\r\nHost: bench\r\nCookie: session={}\r\n\r\n".format(
+            path, token).encode())
+        try:
+            status, alive, _ = await loadtest.read_response(reader, timeout)
+        except (ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+            status, alive = "malformed response ({})".format(type(e).__name__), False
+        if status != 200:
+            failed.append("{}: {}".format(path, status))
+        if not alive:
+            writer.close()
+            writer = None
+    for path in HEAD_PATHS:
+        if writer is None:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        raw = "{} {} HTTP/1.1\r\nHost: bench\r\nCookie: session={}\r\n\r\n"
+        writer.write((raw.format("HEAD", path, token) + raw.format("GET", "/data", token)).encode())
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)
+            status, _, _ = await loadtest.read_response(reader, timeout)
+        except (ValueError, IndexError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+            head, status = b"", type(e).__name__
+        if b" 200 " not in head.split(b"\r\n", 1)[0] or status != 200:
+            failed.append("HEAD {}: GET after it {}".format(path, status))
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+    return failed
+
+
+def load(port, clients, duration, keepalive, paths="/data"):
+    args = argparse.Namespace(host="127.0.0.1", port=port, user="admin", password="admin123",
+                              paths=paths, clients=clients, slow=0, duration=duration,
+                              interval=0.0, timeout=10.0, keepalive=keepalive, pipeline=1)
+    return asyncio.run(loadtest.run(args))
+
+
+def firmware_run(args, broker, broker_port):
+    work = tempfile.mkdtemp(prefix="picosens-suite-")
+    report = os.path.join(work, "sim.json")
+    port = free_port()
+    phase = args.phase
+    before = broker.stats["publish"]
+    proc = start_firmware(port, 4 * phase + 3, report, broker_port, args.sample_ms)
+    try:
+        failed = asyncio.run(check_endpoints(port))
+        if failed:
+            raise SystemExit("endpoint check failed: " + ", ".join(failed))
+        latency = load(port, 1, phase, True)
+        keepalive = load(port, args.clients, phase, True, "/data,/api/v1/batch")
+        close = load(port, args.clients, phase, False, "/data,/api/v1/batch")
+        proc.wait(timeout=4 * phase + 30)
+        with open(report) as f:
+            sim = json.load(f)
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        shutil.rmtree(work)
+    return latency, keepalive, close, sim, broker.stats["publish"] - before
+
+
+def heap_run(args):
+    work = tempfile.mkdtemp(prefix="picosens-suite-")
+    report = os.path.join(work, "sim.json")
+    port = free_port()
+    proc = start_firmware(port, args.phase + 3, report, trace=True)
+    try:
+        load(port, 2, args.phase, True, "/data,/api/v1/batch,/history,/sensors")
+        proc.wait(timeout=args.phase + 30)
+        with open(report) as f:
+            return json.load(f)["heap"]
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        shutil.rmtree(work)
+
+
+def logger_run(records):
+    work = tempfile.mkdtemp(prefix="picosens-suite-")
+    shutil.copy(os.path.join(CODE, "def_config.json"), work)
+    cwd = os.getcwd()
+    os.chdir(work)
+    sys.path[:0] = [CODE, os.path.join(HERE, "sim")]
+    import simclock  # noqa: F401  (time.ticks_* for the firmware modules)
+    import debug
+    debug.CONSOLE = False
+    # bench_binary drives the logger with a fake clock on the time module
+    real_time = time.time
+    try:
+        return bench_logger.bench_binary(records, bench_logger.Snap())
+    finally:
+        time.time = real_time
+        os.chdir(cwd)
+        shutil.rmtree(work)
+
+
+def mqtt_run(port, messages):
+    out = {}
+    for qos in (0, 1):
+        dt = bench_mqtt_qos.throughput("127.0.0.1", port, qos, 8, messages, b"x" * 120)
+        out[qos] = messages / dt
+    return out
+
+
+def git_info():
+    def git(*cmd):
+        try:
+            return subprocess.check_output(("git",) + cmd, cwd=HERE, stderr=subprocess.DEVNULL).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    return {"commit": git("rev-parse", "HEAD"),
+            "dirty": bool(git("status", "--porcelain", "--", os.path.join(HERE, ".."))),
+            "subject": git("log", "-1", "--format=%s")}
+
+
+def compare(base, current):
+    print()
+    print("{:<28} {:>12} {:>12} {:>8}".format("metric", "base", "current", "change"))
+    for name in sorted(current):
+        new, old = current[name], base.get(name)
+        if old in (None, 0):
+            print("{:<28} {:>12} {:>12.6g} {:>8}".format(name, "-", new, ""))
+            continue
+        change = (new - old) / abs(old) * 100
+        better = change > 0 if name in HIGHER_IS_BETTER else change < 0
+        mark = "" if abs(change) < 5 else (" +" if better else " -")
+        print("{:<28} {:>12.6g} {:>12.6g} {:>7.1f}%{}".format(name, old, new, change, mark))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--out", help="write the JSON report here (default: stdout)")
+    ap.add_argument("--compare", metavar="REPORT", help="print changes against an earlier report")
+    ap.add_argument("--quick", action="store_true", help="shorter phases and fewer iterations")
+    ap.add_argument("--clients", type=int, default=4)
+    ap.add_argument("--sample-ms", type=int, default=100, help="firmware sampling interval")
+    args = ap.parse_args()
+    args.phase = 2.0 if args.quick else 5.0
+    messages = 500 if args.quick else 3000
+    records = 2000 if args.quick else 10000
+
+    broker, broker_port = bench_mqtt_qos.start_broker()
+    t0 = time.monotonic()
+    print("firmware under load...", file=sys.stderr)
+    latency, keepalive, close, sim, published = firmware_run(args, broker, broker_port)
+    print("heap...", file=sys.stderr)
+    heap = heap_run(args)
+    print("logger, mqtt...", file=sys.stderr)
+    log = logger_run(records)
+    mqtt = mqtt_run(broker_port, messages)
+
+    metrics = {
+        "data_latency_p50_ms": latency["latency_ms"]["p50"],
+        "data_latency_p99_ms": latency["latency_ms"]["p99"],
+        "http_req_per_s_keepalive": keepalive["req_per_s"],
+        "http_req_per_s_close": close["req_per_s"],
+        "http_p99_ms_keepalive": keepalive["latency_ms"]["p99"],
+        "sampling_jitter_mean_ms": sim["sampling"]["jitter_ms"]["mean"],
+        "sampling_jitter_p99_ms": sim["sampling"]["jitter_ms"]["p99"],
+        "sample_mean_us": sim["sampling"]["sample_us"]["mean"],
+        "mqtt_firmware_publishes": published,
+        "heap_traced_peak_bytes": heap.get("traced_peak", 0),
+        "heap_maxrss_kb": sim["heap"].get("maxrss_kb", 0),
+        "logger_records_per_s": log["records_per_s"],
+        "mqtt_qos0_msg_per_s": round(mqtt[0], 1),
+        "mqtt_qos1_msg_per_s": round(mqtt[1], 1),
+    }
+    report = {
+        "meta": dict(git_info(), python=platform.python_version(), platform=platform.platform(),
+                     time=time.strftime("%Y-%m-%dT%H:%M:%S"), quick=args.quick,
+                     elapsed_s=round(time.monotonic() - t0, 1)),
+        "metrics": metrics,
+        "details": {"latency": latency, "keepalive": keepalive, "close": close, "firmware": sim,
+                    "logger": log, "heap": heap},
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f)["metrics"], metrics)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Minify and gzip the web pages for upload to the Pico.
+
+For every file in PicoW/Code/html (or --src) this writes <name>.gz next to
+it (or into --out): whitespace and comments are stripped conservatively
+(line structure is kept, so scripts relying on automatic semicolons still
+work) and the result is gzipped at level 9 with a fixed timestamp, so
+unchanged pages give byte-identical output. static.py serves the .gz to
+browsers that accept gzip and the original file to anything else.
+
+Re-run after editing a page (or use --clean), otherwise the stale .gz is
+what browsers get.
+
+    python build_html.py            # build, print a size table
+    python build_html.py --clean    # remove the .gz files again
+"""
+import argparse
+import gzip
+import io
+import os
+import re
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(HERE, "..", "Code", "html")
+EXTENSIONS = (".html", ".css", ".js", ".svg", ".json")
+
+_KEEP = re.compile(r"(<(pre|textarea)\b.*?</\2>)", re.S | re.I)
+_COMMENT = re.compile(r"<!--(?!\[if).*?-->", re.S)
+_STYLE = re.compile(r"(<style\b[^>]*>)(.*?)(</style>)", re.S | re.I)
+_CSS_COMMENT = re.compile(r"/\*.*?\*/", re.S)
+_CSS_SPACE = re.compile(r"\s*([{};:,>])\s*")
+
+
+def _css(css):
+    css = _CSS_COMMENT.sub("", css)
+    css = _CSS_SPACE.sub(r"\1", " ".join(css.split()))
+    return css.replace(";}", "}")
+
+
+def _lines(text):
+    out = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("//"):
+            continue
+        out.append(line)
+    return "\n".join(out)
+
+
+def minify(text):
+    text = _COMMENT.sub("", text)
+    text = _STYLE.sub(lambda m: m.group(1) + _css(m.group(2)) + m.group(3), text)
+    # Leave <pre> and <textarea> contents untouched
+    parts = _KEEP.split(text)
+    out = []
+    i = 0
+    while i < len(parts):
+        out.append(_lines(parts[i]))
+        if i + 1 < len(parts):
+            out.append(parts[i + 1])
+        i += 3
+    return "".join(out)
+
+
+def compress(data):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb", compresslevel=9, mtime=0) as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--src", default=SRC)
+    ap.add_argument("--out", help="output directory (default: next to the sources)")
+    ap.add_argument("--clean", action="store_true", help="delete generated .gz files")
+    args = ap.parse_args()
+    out_dir = args.out or args.src
+
+    names = sorted(n for n in os.listdir(args.src) if n.endswith(EXTENSIONS))
+    if args.clean:
+        for name in names:
+            path = os.path.join(out_dir, name + ".gz")
+            if os.path.exists(path):
+                os.remove(path)
+                print("removed", path)
+        return
+
+    os.makedirs(out_dir, exist_ok=True)
+    total = [0, 0, 0]
+    print("{:<16} {:>8} {:>9} {:>7} {:>6}".format("file", "source", "minified", "gzip", "ratio"))
+    for name in names:
+        with open(os.path.join(args.src, name), encoding="utf-8") as f:
+            src = f.read()
+        small = minify(src).encode() if name.endswith((".html", ".svg")) else src.encode()
+        if name.endswith(".css"):
+            small = _css(src).encode()
+        packed = compress(small)
+        with open(os.path.join(out_dir, name + ".gz"), "wb") as f:
+            f.write(packed)
+        size = len(src.encode())
+        print("{:<16} {:>8} {:>9} {:>7} {:>5.0f}%".format(
+            name, size, len(small), len(packed), 100 * len(packed) / size))
+        total[0] += size
+        total[1] += len(small)
+        total[2] += len(packed)
+    print("{:<16} {:>8} {:>9} {:>7} {:>5.0f}%".format(
+        "total", total[0], total[1], total[2], 100 * total[2] / max(1, total[0])))
+
+
+if __name__ == "__main__":
+    main()
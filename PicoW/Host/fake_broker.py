@@ -0,0 +1,213 @@
+"""
+Minimal MQTT 3.1.1 broker stand-in for exercising the firmware's MQTT code
+without Mosquitto.
+
+Supports CONNECT, PUBLISH (QoS 0/1/2), PUBREL, SUBSCRIBE/UNSUBSCRIBE with
++ and # wildcards, PINGREQ and DISCONNECT. Published messages are routed
+to matching subscribers at QoS 0. Every --report seconds a JSON line with
+message counts and rates is printed.
+
+    python fake_broker.py --port 1883
+    python fake_broker.py --restart-every 30 --down 5   # simulate broker restarts
+    python fake_broker.py --verbose                     # print every message
+    python fake_broker.py --no-ack                      # never ack QoS 1/2 (retransmit tests)
+"""
+import argparse
+import asyncio
+import json
+import struct
+import time
+
+
+def topic_matches(filt, topic):
+    f = filt.split("/")
+    t = topic.split("/")
+    for i, part in enumerate(f):
+        if part == "#":
+            return True
+        if i >= len(t):
+            return False
+        if part != "+" and part != t[i]:
+            return False
+    return len(f) == len(t)
+
+
+def encode_len(n):
+    out = bytearray()
+    while True:
+        b = n & 0x7F
+        n >>= 7
+        out.append(b | 0x80 if n else b)
+        if not n:
+            return bytes(out)
+
+
+def packet(first, body=b""):
+    return bytes([first]) + encode_len(len(body)) + body
+
+
+class Broker:
+    def __init__(self, args):
+        self.args = args
+        self.clients = {}        # writer -> {"id": str, "subs": set}
+        self.accepting = True
+        self.stats = {"connects": 0, "publish": 0, "bytes": 0, "puback": 0,
+                      "pubrec": 0, "pubcomp": 0, "pings": 0, "dup": 0, "routed": 0}
+        self.by_qos = [0, 0, 0]
+        self.last = dict(self.stats)
+        self.last_t = time.monotonic()
+
+    async def read_packet(self, reader):
+        hdr = await reader.readexactly(1)
+        n = 0
+        shift = 0
+        while True:
+            b = (await reader.readexactly(1))[0]
+            n |= (b & 0x7F) << shift
+            if not b & 0x80:
+                break
+            shift += 7
+        body = await reader.readexactly(n) if n else b""
+        return hdr[0], body
+
+    def route(self, topic, payload, source):
+        for w, info in list(self.clients.items()):
+            if w is source:
+                continue
+            if any(topic_matches(f, topic) for f in info["subs"]):
+                t = topic.encode()
+                w.write(packet(0x30, struct.pack("!H", len(t)) + t + payload))
+                self.stats["routed"] += 1
+
+    async def handle(self, reader, writer):
+        if not self.accepting:
+            writer.close()
+            return
+        info = {"id": "?", "subs": set()}
+        try:
+            op, body = await self.read_packet(reader)
+            if op & 0xF0 != 0x10:
+                return
+            plen = struct.unpack_from("!H", body, 0)[0]
+            idlen = struct.unpack_from("!H", body, 2 + plen + 4)[0]
+            info["id"] = body[2 + plen + 6:2 + plen + 6 + idlen].decode()
+            self.clients[writer] = info
+            self.stats["connects"] += 1
+            writer.write(b"\x20\x02\x00\x00")
+            if self.args.verbose:
+                print("CONNECT", info["id"])
+            while True:
+                op, body = await self.read_packet(reader)
+                kind = op & 0xF0
+                if kind == 0x30:
+                    qos = (op >> 1) & 3
+                    tlen = struct.unpack_from("!H", body, 0)[0]
+                    topic = body[2:2 + tlen].decode()
+                    pos = 2 + tlen
+                    pid = None
+                    if qos:
+                        pid = struct.unpack_from("!H", body, pos)[0]
+                        pos += 2
+                    payload = body[pos:]
+                    self.stats["publish"] += 1
+                    self.stats["bytes"] += 1 + len(encode_len(len(body))) + len(body)
+                    self.by_qos[qos] += 1
+                    if op & 0x08:
+                        self.stats["dup"] += 1
+                    if self.args.verbose:
+                        print("PUBLISH", topic, "qos", qos, payload[:80])
+                    if qos and self.args.no_ack:
+                        pass
+                    elif qos == 1:
+                        writer.write(packet(0x40, struct.pack("!H", pid)))
+                        self.stats["puback"] += 1
+                    elif qos == 2:
+                        writer.write(packet(0x50, struct.pack("!H", pid)))
+                        self.stats["pubrec"] += 1
+                    self.route(topic, payload, writer)
+                elif kind == 0x60:  # PUBREL
+                    writer.write(packet(0x70, body[:2]))
+                    self.stats["pubcomp"] += 1
+                elif kind == 0x40 or kind == 0x70:  # PUBACK / PUBCOMP from client
+                    pass
+                elif kind == 0x50:  # PUBREC from client -> PUBREL
+                    writer.write(packet(0x62, body[:2]))
+                elif kind == 0x80:  # SUBSCRIBE
+                    pid = body[:2]
+                    pos = 2
+                    granted = bytearray()
+                    while pos < len(body):
+                        tlen = struct.unpack_from("!H", body, pos)[0]
+                        info["subs"].add(body[pos + 2:pos + 2 + tlen].decode())
+                        granted.append(0)
+                        pos += 2 + tlen + 1
+                    writer.write(packet(0x90, pid + bytes(granted)))
+                elif kind == 0xA0:  # UNSUBSCRIBE
+                    pos = 2
+                    while pos < len(body):
+                        tlen = struct.unpack_from("!H", body, pos)[0]
+                        info["subs"].discard(body[pos + 2:pos + 2 + tlen].decode())
+                        pos += 2 + tlen
+                    writer.write(packet(0xB0, body[:2]))
+                elif kind == 0xC0:
+                    writer.write(b"\xd0\x00")
+                    self.stats["pings"] += 1
+                elif kind == 0xE0:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.clients.pop(writer, None)
+            writer.close()
+
+    async def restarts(self):
+        while True:
+            await asyncio.sleep(self.args.restart_every)
+            print(json.dumps({"event": "restart", "clients": len(self.clients)}))
+            self.accepting = False
+            for w in list(self.clients):
+                w.close()
+            self.clients.clear()
+            await asyncio.sleep(self.args.down)
+            self.accepting = True
+
+    async def report(self):
+        while True:
+            await asyncio.sleep(self.args.report)
+            now = time.monotonic()
+            dt = now - self.last_t
+            rate = (self.stats["publish"] - self.last["publish"]) / dt
+            bps = (self.stats["bytes"] - self.last["bytes"]) / dt
+            out = dict(self.stats, qos=self.by_qos, clients=len(self.clients),
+                       publish_per_s=round(rate, 1), bytes_per_s=round(bps, 1))
+            print(json.dumps(out), flush=True)
+            self.last = dict(self.stats)
+            self.last_t = now
+
+
+async def main(args):
+    broker = Broker(args)
+    server = await asyncio.start_server(broker.handle, args.host, args.port)
+    print("fake broker on {}:{}".format(args.host, args.port), flush=True)
+    tasks = [asyncio.create_task(broker.report())]
+    if args.restart_every:
+        tasks.append(asyncio.create_task(broker.restarts()))
+    async with server:
+        if args.duration:
+            await asyncio.sleep(args.duration)
+        else:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--host", default="0.0.0.0")
+    ap.add_argument("--port", type=int, default=1883)
+    ap.add_argument("--report", type=float, default=5.0)
+    ap.add_argument("--restart-every", type=float, default=0.0)
+    ap.add_argument("--down", type=float, default=3.0)
+    ap.add_argument("--duration", type=float, default=0.0)
+    ap.add_argument("--verbose", action="store_true")
+    ap.add_argument("--no-ack", action="store_true")
+    asyncio.run(main(ap.parse_args()))
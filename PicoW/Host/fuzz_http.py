@@ -0,0 +1,246 @@
+"""
+Fuzz and throughput checks for the firmware's HTTP request parser
+(PicoW/Code/httpreq.py), run on the host.
+
+  * round trip: random valid requests, delivered in random fragments,
+    must parse back to the same method, path, query, headers and body
+  * mutation: random byte flips, truncations and garbage must either
+    parse or raise HTTPError, never anything else, and never hang
+  * limits: oversized request line, headers, header count and body get
+    414 / 431 / 413
+  * throughput: requests parsed per second. The original decode-and-split
+    code is timed for reference; it only found the method, path and
+    cookie, so it is not a like-for-like comparison
+
+    python fuzz_http.py [iterations] [--seed N]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "Code"))
+
+import httpreq  # noqa: E402
+from httpreq import HTTPError, Request  # noqa: E402
+
+
+class Reader:
+    """Stream that hands out data in the given fragment sizes via readinto()."""
+
+    def __init__(self, data, rnd=None, max_frag=0):
+        self.data = data
+        self.pos = 0
+        self.rnd = rnd
+        self.max_frag = max_frag
+
+    async def readinto(self, mv):
+        n = len(mv)
+        if self.max_frag:
+            n = min(n, self.rnd.randint(1, self.max_frag))
+        chunk = self.data[self.pos:self.pos + n]
+        self.pos += len(chunk)
+        mv[:len(chunk)] = chunk
+        return len(chunk)
+
+
+class ReadOnlyReader(Reader):
+    """CPython-style stream without readinto(), to cover the fallback path."""
+
+    readinto = None
+
+    def __getattribute__(self, name):
+        if name == "readinto":
+            raise AttributeError(name)
+        return object.__getattribute__(self, name)
+
+    async def read(self, n):
+        chunk = self.data[self.pos:self.pos + n]
+        self.pos += len(chunk)
+        return chunk
+
+
+SAFE = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_.~"
+
+
+def quote(s, rnd):
+    out = []
+    for ch in s:
+        if ch in SAFE and rnd.random() > 0.2:
+            out.append(ch)
+        elif ch == " " and rnd.random() < 0.5:
+            out.append("+")
+        else:
+            out.extend("%{:02X}".format(b) for b in ch.encode())
+    return "".join(out)
+
+
+def rand_text(rnd, n, alphabet=SAFE + " /=&+%é€"):
+    return "".join(rnd.choice(alphabet) for _ in range(rnd.randint(0, n)))
+
+
+def make_request(rnd):
+    method = rnd.choice(["GET", "POST", "PUT", "DELETE"])
+    path = "/" + "/".join(rand_text(rnd, 8, SAFE) for _ in range(rnd.randint(0, 3)))
+    query = {}
+    for _ in range(rnd.randint(0, 4)):
+        query[rand_text(rnd, 6, SAFE) or "k"] = rand_text(rnd, 12)
+    headers = {}
+    for _ in range(rnd.randint(0, 10)):
+        headers["x-" + rand_text(rnd, 8, SAFE).lower() + str(len(headers))] = rand_text(rnd, 40, SAFE + " ;,=")
+    headers = {k: v.strip() for k, v in headers.items()}
+    body = b""
+    if method in ("POST", "PUT") and rnd.random() < 0.8:
+        body = os.urandom(rnd.randint(0, 3000))
+        headers["content-length"] = str(len(body))
+    target = path
+    if query:
+        target += "?" + "&".join(quote(k, rnd) + "=" + quote(v, rnd) for k, v in query.items())
+    eol = "\r\n" if rnd.random() < 0.9 else "\n"
+    lines = ["{} {} HTTP/1.1".format(method, target)]
+    lines += ["{}:{}{}".format(k.title(), " " * rnd.randint(0, 2), v) for k, v in headers.items()]
+    raw = (eol.join(lines) + eol + eol).encode() + body
+    return raw, (method, path, query, headers, body)
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(asyncio.wait_for(coro, 5))
+
+
+def round_trip(rnd, iterations):
+    req = Request()
+    skipped = 0
+    for _ in range(iterations):
+        raw, (method, path, query, headers, body) = make_request(rnd)
+        cls = ReadOnlyReader if rnd.random() < 0.2 else Reader
+        reader = cls(raw, rnd, rnd.choice([0, 1, 3, 17, 200]))
+        try:
+            assert run(req.read(reader))
+        except HTTPError as e:
+            # Large random headers legitimately exceed the limits
+            assert e.status in (413, 414, 431), (e.status, raw[:200])
+            skipped += 1
+            continue
+        assert req.method == method, (req.method, method)
+        assert req.path == path, (req.path, path)
+        assert req.query() == query, (req.query(), query)
+        assert req.headers == headers, (req.headers, headers)
+        assert bytes(req.body) == body
+    return skipped
+
+
+def mutate(rnd, raw):
+    raw = bytearray(raw)
+    for _ in range(rnd.randint(1, 8)):
+        op = rnd.random()
+        if op < 0.4 and raw:
+            raw[rnd.randrange(len(raw))] = rnd.randrange(256)
+        elif op < 0.6:
+            del raw[rnd.randrange(len(raw) + 1):]
+        elif op < 0.8:
+            pos = rnd.randrange(len(raw) + 1)
+            raw[pos:pos] = rnd.choice([b"\r\n", b"\n\n", b":", b"%", b"%zz", b" ", b"\x00",
+                                       b"Content-Length: -1\r\n", b"Content-Length: x\r\n",
+                                       b"Transfer-Encoding: chunked\r\n"])
+        else:
+            raw = bytearray(os.urandom(rnd.randint(0, 300)))
+    return bytes(raw)
+
+
+def mutation(rnd, iterations):
+    req = Request()
+    outcomes = {}
+    for _ in range(iterations):
+        raw, _ = make_request(rnd)
+        data = mutate(rnd, raw)
+        try:
+            ok = run(req.read(Reader(data, rnd, rnd.choice([0, 5]))))
+            key = "parsed" if ok else "closed"
+        except HTTPError as e:
+            key = e.status
+        except asyncio.TimeoutError:
+            raise AssertionError("parser hung on {!r}".format(data[:200]))
+        outcomes[key] = outcomes.get(key, 0) + 1
+    return outcomes
+
+
+def limits():
+    req = Request()
+    cases = [
+        (b"GET /" + b"a" * 3000 + b" HTTP/1.1\r\n\r\n", 414),
+        (b"GET / HTTP/1.1\r\nX: " + b"a" * 3000 + b"\r\n\r\n", 431),
+        (b"GET / HTTP/1.1\r\n" + b"".join(b"H%d: v\r\n" % i for i in range(httpreq.MAX_HEADERS + 1)) + b"\r\n", 431),
+        (b"POST / HTTP/1.1\r\nContent-Length: %d\r\n\r\n" % (httpreq.MAX_BODY + 1), 413),
+        (b"POST / HTTP/1.1\r\nContent-Length: 10\r\n\r\nshort", 400),
+        (b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n", 411),
+        (b"GET /\r\n\r\n", 400),
+        (b"GET / HTTP/1.1\r\nno colon\r\n\r\n", 400),
+    ]
+    for data, want in cases:
+        try:
+            run(req.read(Reader(data)))
+            got = "parsed"
+        except HTTPError as e:
+            got = e.status
+        assert got == want, (data[:60], got, want)
+    return len(cases)
+
+
+def legacy_parse(req):
+    # What webserver.py did before: decode once, split several times
+    line = req.split("\n")[0]
+    method, path = line.split()[:2]
+    for line in req.split("\r\n"):
+        if line.startswith("Cookie:") and "session=" in line:
+            line.split("session=")[1].strip()
+    body = req.split("\r\n\r\n", 1)[1]
+    return method, path, body
+
+
+def throughput(n):
+    raw = (b"GET /history?from=-3600&points=200 HTTP/1.1\r\nHost: 192.168.4.1\r\n"
+           b"User-Agent: Mozilla/5.0 (X11; Linux x86_64) Firefox/120.0\r\n"
+           b"Accept: */*\r\nAccept-Language: en-US,en;q=0.5\r\nAccept-Encoding: gzip, deflate\r\n"
+           b"Connection: keep-alive\r\nCookie: theme=dark; session=1234567890\r\nReferer: http://192.168.4.1/graph\r\n\r\n")
+    req = Request()
+
+    async def parse_all():
+        for _ in range(n):
+            await req.read(Reader(raw))
+            req.cookie("session")
+
+    t0 = time.perf_counter()
+    run(parse_all())
+    dt = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for _ in range(n):
+        legacy_parse(raw.decode())
+    dl = time.perf_counter() - t0
+    return n / dt, n / dl, len(raw)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("iterations", type=int, nargs="?", default=3000)
+    ap.add_argument("--seed", type=int, default=None)
+    args = ap.parse_args()
+    seed = args.seed if args.seed is not None else random.randrange(1 << 30)
+    rnd = random.Random(seed)
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    print("seed {}".format(seed))
+
+    skipped = round_trip(rnd, args.iterations)
+    print("round trip: {} requests ok ({} over limits)".format(args.iterations - skipped, skipped))
+    print("mutation:   {}".format(mutation(rnd, args.iterations)))
+    print("limits:     {} cases ok".format(limits()))
+    fast, legacy, size = throughput(20000)
+    print("throughput: {:.0f} req/s parsed ({} byte request; legacy split, "
+          "no header parsing or body handling: {:.0f} req/s)".format(
+        fast, size, legacy))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""
+Concurrent HTTP load driver for the PicoSens webserver.
+
+Runs under desktop CPython and points at either a Pico on the AP network
+or a copy of the firmware running on the host:
+
+    python loadtest.py --host 192.168.4.1 --clients 12 --duration 20
+    python loadtest.py --host 127.0.0.1 --port 8080 --slow 2
+
+Each client logs in once, then loops GET requests against the given paths.
+"--slow" opens extra connections that never send a request, to check that
+idle sockets are dropped by the read timeout and do not stall other clients.
+
+By default every request uses a new HTTP/1.0 connection. "--keepalive"
+reuses one HTTP/1.1 connection per client, "--pipeline N" additionally
+sends N requests before reading the responses, and "--compare" runs the
+plain and keep-alive variants back to back and prints both:
+
+    python loadtest.py --host 127.0.0.1 --port 8080 --clients 4 --compare
+"""
+import argparse
+import asyncio
+import json
+import time
+
+
+async def request(host, port, raw, timeout):
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        writer.write(raw)
+        await writer.drain()
+        resp = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    head = resp.split(b"\r\n", 1)[0].split()
+    status = int(head[1]) if len(head) > 1 else 0
+    return status, resp
+
+
+async def read_response(reader, timeout):
+    """Read one HTTP/1.1 response: Content-Length, chunked or until close."""
+    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)
+    lines = head.split(b"\r\n")
+    status = int(lines[0].split()[1])
+    headers = {}
+    for line in lines[1:]:
+        if b":" in line:
+            k, v = line.split(b":", 1)
+            headers[k.strip().lower()] = v.strip().lower()
+    if b"content-length" in headers:
+        body = await asyncio.wait_for(reader.readexactly(int(headers[b"content-length"])), timeout)
+    elif headers.get(b"transfer-encoding") == b"chunked":
+        body = b""
+        while True:
+            size = int((await asyncio.wait_for(reader.readuntil(b"\r\n"), timeout)).strip(), 16)
+            body += await asyncio.wait_for(reader.readexactly(size + 2), timeout)
+            if size == 0:
+                break
+    else:
+        body = await asyncio.wait_for(reader.read(), timeout)
+    return status, headers.get(b"connection") != b"close", body
+
+
+async def login(host, port, user, password, timeout):
+    body = "u={}&p={}".format(user, password)
+    raw = ("POST /dologin HTTP/1.0\r\nContent-Type: application/x-www-form-urlencoded\r\n"
+           "Content-Length: {}\r\n\r\n{}").format(len(body), body).encode()
+    status, resp = await request(host, port, raw, timeout)
+    for line in resp.split(b"\r\n"):
+        if line.lower().startswith(b"set-cookie:") and b"session=" in line:
+            return line.split(b"session=", 1)[1].split(b";", 1)[0].strip().decode()
+    raise RuntimeError("login failed (status {})".format(status))
+
+
+async def client(args, token, paths, stop, stats):
+    i = 0
+    while time.monotonic() < stop:
+        path = paths[i % len(paths)]
+        i += 1
+        raw = "GET {} HTTP/1.0\r\nCookie: session={}\r\n\r\n".format(path, token).encode()
+        t0 = time.monotonic()
+        try:
+            status, _ = await request(args.host, args.port, raw, args.timeout)
+        except Exception:
+            stats["errors"] += 1
+            await asyncio.sleep(0.1)
+            continue
+        stats["latency"].append(time.monotonic() - t0)
+        stats["status"][status] = stats["status"].get(status, 0) + 1
+        if args.interval:
+            await asyncio.sleep(args.interval)
+
+
+async def keepalive_client(args, token, paths, stop, stats):
+    i = 0
+    depth = max(1, args.pipeline)
+    conn = None
+    while time.monotonic() < stop:
+        try:
+            if conn is None:
+                conn = await asyncio.wait_for(asyncio.open_connection(args.host, args.port), args.timeout)
+                stats["connections"] += 1
+            reader, writer = conn
+            batch = []
+            for _ in range(depth):
+                batch.append("GET {} HTTP/1.1\r\nHost: {}\r\nCookie: session={}\r\n\r\n".format(
+                    paths[i % len(paths)], args.host, token))
+                i += 1
+            t0 = time.monotonic()
+            writer.write("".join(batch).encode())
+            await writer.drain()
+            alive = True
+            for _ in range(depth):
+                status, alive, _ = await read_response(reader, args.timeout)
+                stats["latency"].append(time.monotonic() - t0)
+                stats["status"][status] = stats["status"].get(status, 0) + 1
+                if not alive:
+                    break
+            if not alive:
+                writer.close()
+                conn = None
+        except Exception:
+            stats["errors"] += 1
+            if conn:
+                conn[1].close()
+            conn = None
+            await asyncio.sleep(0.1)
+            continue
+        if args.interval:
+            await asyncio.sleep(args.interval)
+    if conn:
+        conn[1].close()
+
+
+async def slow_client(args, stop, stats):
+    while time.monotonic() < stop:
+        try:
+            reader, writer = await asyncio.open_connection(args.host, args.port)
+        except Exception:
+            await asyncio.sleep(0.5)
+            continue
+        t0 = time.monotonic()
+        try:
+            await reader.read()
+            stats["slow_dropped"].append(time.monotonic() - t0)
+        except Exception:
+            pass
+        writer.close()
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run(args):
+    token = await login(args.host, args.port, args.user, args.password, args.timeout)
+    paths = args.paths.split(",")
+    stats = {"latency": [], "status": {}, "errors": 0, "slow_dropped": [], "connections": 0}
+    start = time.monotonic()
+    stop = start + args.duration
+    keepalive = args.keepalive or args.pipeline > 1
+    worker = keepalive_client if keepalive else client
+    tasks = [worker(args, token, paths, stop, stats) for _ in range(args.clients)]
+    tasks += [slow_client(args, stop, stats) for _ in range(args.slow)]
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - start
+
+    lat = stats["latency"]
+    return {
+        "mode": ("pipeline x{}".format(args.pipeline) if args.pipeline > 1 else
+                 "keep-alive" if keepalive else "close"),
+        "clients": args.clients,
+        "slow_clients": args.slow,
+        "duration_s": round(elapsed, 2),
+        "requests": len(lat),
+        "errors": stats["errors"],
+        "connections": stats["connections"] if keepalive else len(lat),
+        "status": stats["status"],
+        "req_per_s": round(len(lat) / elapsed, 2),
+        "latency_ms": {
+            "p50": round(percentile(lat, 0.50) * 1000, 1),
+            "p90": round(percentile(lat, 0.90) * 1000, 1),
+            "p99": round(percentile(lat, 0.99) * 1000, 1),
+            "max": round(max(lat) * 1000, 1) if lat else 0.0,
+        },
+        "slow_dropped_after_s": round(percentile(stats["slow_dropped"], 0.5), 2),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--host", default="192.168.4.1")
+    ap.add_argument("--port", type=int, default=80)
+    ap.add_argument("--user", default="admin")
+    ap.add_argument("--password", default="admin123")
+    ap.add_argument("--paths", default="/data,/digital")
+    ap.add_argument("--clients", type=int, default=8)
+    ap.add_argument("--slow", type=int, default=0)
+    ap.add_argument("--duration", type=float, default=10.0)
+    ap.add_argument("--interval", type=float, default=0.0, help="pause between requests per client")
+    ap.add_argument("--timeout", type=float, default=10.0)
+    ap.add_argument("--keepalive", action="store_true", help="reuse one HTTP/1.1 connection per client")
+    ap.add_argument("--pipeline", type=int, default=1, help="requests sent before reading responses")
+    ap.add_argument("--compare", action="store_true", help="run without and with keep-alive")
+    args = ap.parse_args()
+    if not args.compare:
+        print(json.dumps(asyncio.run(run(args)), indent=2))
+        return
+    results = []
+    for keepalive, pipeline in ((False, 1), (True, 1), (True, 4)):
+        args.keepalive, args.pipeline = keepalive, pipeline
+        results.append(asyncio.run(run(args)))
+    print("{:<14} {:>9} {:>11} {:>8} {:>8} {:>7}".format(
+        "mode", "req/s", "connections", "p50 ms", "p99 ms", "errors"))
+    for r in results:
+        print("{:<14} {:>9} {:>11} {:>8} {:>8} {:>7}".format(
+            r["mode"], r["req_per_s"], r["connections"], r["latency_ms"]["p50"],
+            r["latency_ms"]["p99"], r["errors"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Run the unmodified firmware on the host under CPython.
+
+The firmware (PicoW/Code) is copied to a scratch directory, so config and
+log writes stay out of the tree. Then main.py runs against the simulated
+machine, network, urandom and micropython modules in Host/sim, and the
+web server listens on 127.0.0.1. The simulated modules stick to the
+MicroPython subset, so they can go on MICROPYPATH for the unix port too.
+
+    python picosim.py                                  # until Ctrl-C, port 8080
+    python picosim.py --duration 30 --report sim.json  # stop and write stats
+    python picosim.py --adc 26=sine:1.5:1:20 --adc 27=noise:0.6:0.02 --din 15=square:0.5
+    python picosim.py --broker 127.0.0.1:1883          # MQTT to a local broker
+    python picosim.py --ticks-start 1073731824         # ticks_ms wraps 10 s after boot
+
+Waveforms: const:V, sine:MEAN:AMPL:PERIOD, noise:MEAN:SIGMA,
+ramp:LO:HI:PERIOD, step:LO:HI:AT (volts for --adc, 0/1 for --din,
+times in seconds).
+
+The report is JSON: sampling jitter, heap, per-route request timing and
+the firmware's own counters (logger, MQTT, static cache, sessions,
+alarms).
+bench_suite.py uses it.
+"""
+import argparse
+import asyncio
+import builtins
+import json
+import os
+import runpy
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CODE = os.path.join(HERE, "..", "Code")
+SIM = os.path.join(HERE, "sim")
+
+
+def waveform(machine, spec):
+    kind, *args = spec.split(":")
+    args = [float(a) for a in args]
+    return getattr(machine, kind)(*args)
+
+
+def prepare(args):
+    work = tempfile.mkdtemp(prefix="picosim-")
+    code = os.path.join(work, "code")
+    shutil.copytree(CODE, code, ignore=shutil.ignore_patterns("__pycache__", "*.gz"))
+    path = os.path.join(code, "config.json")
+    with open(path) as f:
+        cfg = json.load(f)
+    web = cfg.setdefault("web", {})
+    web["port"] = args.port
+    if args.rate_limit is not None:
+        web["rate_limit"] = args.rate_limit
+    mqtt = cfg.setdefault("mqtt", {})
+    if args.broker:
+        host, port = args.broker.rsplit(":", 1)
+        mqtt.update(enabled=True, broker=host, port=int(port))
+    else:
+        mqtt["enabled"] = False
+    if args.sample_ms:
+        cfg.setdefault("sampling", {})["interval_ms"] = args.sample_ms
+    with open(path, "w") as f:
+        json.dump(cfg, f)
+    return work, code
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class Probe:
+    """Wraps sampler.sample to time every acquisition."""
+
+    def __init__(self, sampler):
+        self.sampler = sampler
+        self.starts = []
+        self.busy_us = []
+        self.real = sampler.sample
+        sampler.sample = self.sample
+
+    def sample(self):
+        t0 = time.perf_counter()
+        self.starts.append(t0)
+        self.real()
+        self.busy_us.append((time.perf_counter() - t0) * 1e6)
+
+    def report(self):
+        period = self.sampler.SAMPLE_INTERVAL_MS
+        gaps = [(b - a) * 1000 for a, b in zip(self.starts, self.starts[1:])]
+        jitter = [abs(g - period) for g in gaps]
+        return {
+            "interval_ms": period,
+            "samples": len(self.starts),
+            "jitter_ms": {
+                "mean": round(sum(jitter) / len(jitter), 3) if jitter else 0.0,
+                "p99": round(percentile(jitter, 0.99), 3),
+                "max": round(max(jitter), 3) if jitter else 0.0,
+            },
+            "sample_us": {
+                "mean": round(sum(self.busy_us) / len(self.busy_us), 1) if self.busy_us else 0.0,
+                "max": round(max(self.busy_us), 1) if self.busy_us else 0.0,
+            },
+        }
+
+
+def collect(probe, started, tracing, reason):
+    import machine
+    import micropython
+    import alarms
+    import debug
+    import logger
+    import mqtt_client
+    import sessions
+    import static
+    import webserver
+    out = {
+        "stopped": reason,
+        "duration_s": round(time.monotonic() - started, 2),
+        "sampling": probe.report(),
+        "web": {
+            "routes": {r.path: {"count": r.count,
+                                "mean_ms": round(r.total_us / r.count / 1000, 2) if r.count else 0.0,
+                                "max_ms": round(r.max_us / 1000, 2)}
+                       for r in webserver.app.routes if r.count},
+            "sessions": sessions.count(),
+            "static_served": static.served,
+            "static_cache_hits": static.cache_hits,
+            "static_not_modified": static.not_modified,
+        },
+        "logger": {"errors": logger.errors, "records": sum(1 for _ in logger.iter_records())},
+        "alarms": {"tripped": alarms.tripped, "events": alarms.event_seq},
+        "log": {"messages": debug.seq, "dropped": debug.dropped, "persist_errors": debug.persist_errors},
+        "mqtt": {"connected": mqtt_client.connected, "reconnects": mqtt_client.reconnects,
+                 "dropped": mqtt_client.dropped, "queue": mqtt_client.queue_depth()},
+        "irq": {"edges": machine.irq_calls, "scheduled": micropython.scheduled,
+                "schedule_overflows": micropython.overflows},
+        "resets": machine.resets,
+        "heap": {},
+    }
+    try:
+        import resource
+        out["heap"]["maxrss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:
+        pass
+    if tracing:
+        import tracemalloc
+        current, peak = tracemalloc.get_traced_memory()
+        out["heap"]["traced_current"] = current
+        out["heap"]["traced_peak"] = peak
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--port", type=int, default=8080)
+    ap.add_argument("--duration", type=float, default=0.0, help="seconds, 0 = until Ctrl-C")
+    ap.add_argument("--report", help="write the JSON report here (default: stdout)")
+    ap.add_argument("--adc", action="append", default=[], metavar="GPIO=WAVE")
+    ap.add_argument("--din", action="append", default=[], metavar="GPIO=WAVE")
+    ap.add_argument("--broker", help="host:port; without it MQTT is disabled")
+    ap.add_argument("--rate-limit", type=int, help="override web.rate_limit (0 = off)")
+    ap.add_argument("--sample-ms", type=int, help="override sampling.interval_ms")
+    ap.add_argument("--ticks-start", type=int, default=0, help="first ticks_ms value")
+    ap.add_argument("--trace-heap", action="store_true", help="track Python heap (slower)")
+    ap.add_argument("--verbose", action="store_true", help="show firmware output")
+    ap.add_argument("--keep", action="store_true", help="keep the scratch directory")
+    args = ap.parse_args()
+
+    work, code = prepare(args)
+    sys.path[:0] = [SIM, code, HERE]
+    os.chdir(code)
+    if args.trace_heap:
+        import tracemalloc
+        tracemalloc.start()
+
+    import simclock
+    simclock.install(args.ticks_start)
+    import machine
+    import micropython
+    for spec in args.adc:
+        pin, wave = spec.split("=", 1)
+        machine.set_adc(int(pin), waveform(machine, wave))
+    for spec in args.din:
+        pin, wave = spec.split("=", 1)
+        machine.set_pin(int(pin), waveform(machine, wave))
+
+    stdout = sys.stdout
+    if not args.verbose:
+        sys.stdout = open(os.devnull, "w")
+    # Firmware sockets: umqtt expects MicroPython's read()/write() methods
+    import upy_socket
+    from umqtt import simple
+    simple.socket = upy_socket
+    import sampler
+    probe = Probe(sampler)
+
+    started = time.monotonic()
+    real_run = asyncio.run
+
+    def run(coro):
+        async def supervised():
+            micropython.attach(asyncio.get_running_loop())
+            machine.start()
+            await asyncio.wait_for(coro, args.duration or None)
+        real_run(supervised())
+
+    asyncio.run = run
+    reason = "duration"
+    try:
+        runpy.run_path("main.py", run_name="main")
+    except asyncio.TimeoutError:
+        pass
+    except machine.ResetRequested:
+        reason = "reset"
+    except KeyboardInterrupt:
+        reason = "interrupted"
+    finally:
+        asyncio.run = real_run
+        sys.stdout = stdout
+        builtins.print("picosim: stopped ({}), scratch dir {}".format(
+            reason, work if args.keep else "removed"), file=sys.stderr)
+
+    report = collect(probe, started, args.trace_heap, reason)
+    os.chdir(HERE)
+    if not args.keep:
+        shutil.rmtree(work)
+    text = json.dumps(report, indent=2)
+    if args.report:
+        with open(args.report, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""
+Simulated `machine` module for running the firmware off-device.
+
+Pins and ADC channels are looked up by the id the firmware passes in
+(Pin(15), ADC(26), Pin("LED")). Tests and picosim.py script them:
+
+    import machine
+    machine.set_adc(26, machine.sine(1.5, 0.5, 10))   # volts over time
+    machine.set_pin(15, machine.square(2.0))          # level over time
+    machine.pin(15).drive(1)                          # one edge, now
+
+Scripted inputs and timers are advanced by a 1 ms ticker thread started
+with start(). Pin and timer callbacks go through micropython.schedule, as
+soft IRQs do on the RP2040.
+
+Only the MicroPython subset of Python is used here.
+"""
+import math
+import random
+import time
+import _thread
+
+import micropython
+import simclock  # noqa: F401  (time.ticks_* on CPython)
+
+VREF = 3.3
+
+_pins = {}          # id -> Pin
+_pin_sources = {}   # id -> f(t) -> 0/1
+_adc_sources = {}   # id -> f(t) -> volts
+_timers = []
+_started = [0]
+_t0 = time.time()
+
+# Counters for reports
+irq_calls = 0
+resets = 0
+
+
+class ResetRequested(SystemExit):
+    pass
+
+
+def now():
+    """Seconds since the simulation started; what waveforms are evaluated at."""
+    return time.time() - _t0
+
+
+# --------------------------
+# Waveforms
+# --------------------------
+def constant(v):
+    return lambda t: v
+
+
+def sine(mean, amplitude, period_s):
+    return lambda t: mean + amplitude * math.sin(2 * math.pi * t / period_s)
+
+
+def noise(mean, sigma):
+    return lambda t: random.gauss(mean, sigma) if hasattr(random, "gauss") else \
+        mean + sigma * (random.random() * 2 - 1)
+
+
+def ramp(lo, hi, period_s):
+    return lambda t: lo + (hi - lo) * ((t % period_s) / period_s)
+
+
+def step(lo, hi, at_s):
+    return lambda t: hi if t >= at_s else lo
+
+
+def square(period_s, duty=0.5):
+    return lambda t: 1 if (t % period_s) < period_s * duty else 0
+
+
+def set_adc(channel, source):
+    """Drive ADC channel (GPIO number 26-28 or channel 0-2) with f(t) -> volts."""
+    _adc_sources[channel] = source
+
+
+def set_pin(pin_id, source):
+    """Drive an input pin with f(t) -> level; edges fire its IRQ handler."""
+    _pin_sources[pin_id] = source
+
+
+def pin(pin_id):
+    """The Pin object the firmware created for pin_id."""
+    return _pins[pin_id]
+
+
+# --------------------------
+# Peripherals
+# --------------------------
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, pin_id, mode=-1, pull=-1, value=None):
+        self.id = pin_id
+        self.mode = mode
+        self._value = 1 if pull == Pin.PULL_UP else 0
+        self._handler = None
+        self._trigger = 0
+        self._hard = False
+        if value is not None:
+            self._value = 1 if value else 0
+        old = _pins.get(pin_id)
+        if old is not None:
+            # Same pin constructed twice shares its level, like hardware
+            self._value = old._value
+        _pins[pin_id] = self
+
+    def __repr__(self):
+        return "Pin({})".format(self.id)
+
+    def init(self, mode=-1, pull=-1, value=None):
+        if mode != -1:
+            self.mode = mode
+        if value is not None:
+            self._value = 1 if value else 0
+
+    def value(self, v=None):
+        if v is None:
+            return self._value
+        self.drive(v)
+
+    def __call__(self, v=None):
+        return self.value(v)
+
+    def on(self):
+        self.drive(1)
+
+    def off(self):
+        self.drive(0)
+
+    def high(self):
+        self.drive(1)
+
+    def low(self):
+        self.drive(0)
+
+    def toggle(self):
+        self.drive(not self._value)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, hard=False):
+        self._handler = handler
+        self._trigger = trigger if handler else 0
+        self._hard = hard
+
+    def drive(self, v):
+        """Set the level; fires the IRQ handler on a matching edge."""
+        global irq_calls
+        v = 1 if v else 0
+        old = self._value
+        self._value = v
+        if v == old or self._handler is None:
+            return
+        if (v and self._trigger & Pin.IRQ_RISING) or (not v and self._trigger & Pin.IRQ_FALLING):
+            irq_calls += 1
+            if self._hard:
+                self._handler(self)
+            else:
+                micropython.schedule(self._handler, self)
+
+
+class ADC:
+    CORE_TEMP = 4
+
+    def __init__(self, pin_id):
+        if isinstance(pin_id, Pin):
+            pin_id = pin_id.id
+        self.channel = pin_id
+
+    def read_u16(self):
+        source = _adc_sources.get(self.channel)
+        v = source(now()) if source else 1.0 + random.random() * 0.02
+        v = min(max(v, 0.0), VREF)
+        # 12-bit converter scaled to 16 bits, as on the RP2040
+        return (int(v / VREF * 4095) << 4) | random.getrandbits(4)
+
+
+class Timer:
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, timer_id=-1, mode=PERIODIC, period=-1, freq=-1, callback=None):
+        self._callback = None
+        if callback is not None:
+            self.init(mode=mode, period=period, freq=freq, callback=callback)
+
+    def init(self, mode=PERIODIC, period=-1, freq=-1, callback=None):
+        if freq > 0:
+            period = 1000 / freq
+        self._mode = mode
+        self._period = max(period, 1)
+        self._next = time.ticks_add(time.ticks_ms(), int(self._period))
+        self._callback = callback
+        if self not in _timers:
+            _timers.append(self)
+
+    def deinit(self):
+        self._callback = None
+        if self in _timers:
+            _timers.remove(self)
+
+    def _poll(self, now_ms):
+        if self._callback is None or time.ticks_diff(now_ms, self._next) < 0:
+            return
+        cb = self._callback
+        if self._mode == Timer.PERIODIC:
+            self._next = time.ticks_add(self._next, int(self._period))
+        else:
+            self.deinit()
+        micropython.schedule(cb, self)
+
+
+class WDT:
+    def __init__(self, id=0, timeout=5000):
+        self.timeout = timeout
+        self.fed = 0
+
+    def feed(self):
+        self.fed += 1
+
+
+def reset():
+    global resets
+    resets += 1
+    raise ResetRequested("machine.reset()")
+
+
+def soft_reset():
+    reset()
+
+
+def freq(hz=None):
+    return 125000000
+
+
+def unique_id():
+    return b"\xe6\x61\x41\x04\x03\x2c\x52\x2e"
+
+
+def idle():
+    time.sleep(0.001)
+
+
+def disable_irq():
+    return 0
+
+
+def enable_irq(state=0):
+    pass
+
+
+# --------------------------
+# Ticker
+# --------------------------
+def _tick():
+    while True:
+        t = now()
+        try:
+            for pin_id in list(_pin_sources):
+                p = _pins.get(pin_id)
+                if p is not None:
+                    p.drive(_pin_sources[pin_id](t))
+            now_ms = time.ticks_ms()
+            for tm in list(_timers):
+                tm._poll(now_ms)
+        except RuntimeError:
+            # Schedule queue full: the event is lost, as on the device
+            pass
+        time.sleep(0.001)
+
+
+def start():
+    """Start advancing scripted pins and timers (once)."""
+    if not _started[0]:
+        _started[0] = 1
+        _thread.start_new_thread(_tick, ())
@@ -0,0 +1,76 @@
+"""
+Simulated `micropython` module for CPython. (MicroPython has the real one
+built in and never imports this file.)
+
+schedule() runs callbacks on the asyncio loop thread, like the RP2040
+runs soft IRQ handlers between bytecodes of the main program, and has the
+same small queue: it raises RuntimeError when the queue is full.
+"""
+import threading
+
+QUEUE_DEPTH = 8
+
+_loop = None
+_pending = [0]
+_lock = threading.Lock()
+
+# Counters for reports
+scheduled = 0
+overflows = 0
+
+
+def const(x):
+    return x
+
+
+def native(f):
+    return f
+
+
+viper = native
+
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+
+def opt_level(level=None):
+    return 0
+
+
+def mem_info(verbose=False):
+    pass
+
+
+def heap_lock():
+    return 0
+
+
+def heap_unlock():
+    return 0
+
+
+def attach(loop):
+    """Run scheduled callbacks on loop from now on."""
+    global _loop
+    _loop = loop
+
+
+def _run(func, arg):
+    with _lock:
+        _pending[0] -= 1
+    func(arg)
+
+
+def schedule(func, arg):
+    global scheduled, overflows
+    with _lock:
+        if _pending[0] >= QUEUE_DEPTH:
+            overflows += 1
+            raise RuntimeError("schedule queue full")
+        _pending[0] += 1
+        scheduled += 1
+    if _loop is None or _loop.is_closed():
+        _run(func, arg)
+    else:
+        _loop.call_soon_threadsafe(_run, func, arg)
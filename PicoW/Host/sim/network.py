@@ -0,0 +1,50 @@
+"""Simulated `network` module: interfaces come up at once and report 127.0.0.1."""
+STA_IF = 0
+AP_IF = 1
+
+STAT_IDLE = 0
+STAT_CONNECTING = 1
+STAT_GOT_IP = 3
+
+
+class WLAN:
+    def __init__(self, interface=STA_IF):
+        self.interface = interface
+        self._active = False
+        self._config = {"essid": "", "password": "", "channel": 1}
+        self._ifconfig = ("127.0.0.1", "255.0.0.0", "127.0.0.1", "127.0.0.1")
+        self._connected = False
+
+    def active(self, state=None):
+        if state is None:
+            return self._active
+        self._active = bool(state)
+
+    def config(self, *args, **kwargs):
+        if args:
+            return self._config.get(args[0])
+        self._config.update(kwargs)
+
+    def ifconfig(self, cfg=None):
+        if cfg is None:
+            return self._ifconfig
+        # Addresses are accepted but the host keeps serving on loopback
+        self._ifconfig = ("127.0.0.1",) + tuple(cfg[1:])
+
+    def connect(self, ssid=None, key=None):
+        self._config["essid"] = ssid
+        self._connected = True
+
+    def disconnect(self):
+        self._connected = False
+
+    def isconnected(self):
+        return self._connected if self.interface == STA_IF else self._active
+
+    def status(self, param=None):
+        if param == "rssi":
+            return -50
+        return STAT_GOT_IP if self.isconnected() else STAT_IDLE
+
+    def scan(self):
+        return []
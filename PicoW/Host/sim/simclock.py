@@ -0,0 +1,57 @@
+"""
+MicroPython's time.ticks_* functions for CPython, installed on the `time`
+module on import. Ticks wrap at 2**30 like on the RP2040; START_MS moves
+the starting point, e.g. to just before a wrap to flush out code that
+compares tick values directly instead of with ticks_diff().
+"""
+import time
+
+TICKS_PERIOD = 1 << 30
+TICKS_MAX = TICKS_PERIOD - 1
+START_MS = 0
+
+_mono = getattr(time, "monotonic", time.time)
+_base = _mono()
+
+
+def ticks_ms():
+    return (int((_mono() - _base) * 1000) + START_MS) & TICKS_MAX
+
+
+def ticks_us():
+    return (int((_mono() - _base) * 1000000) + START_MS * 1000) & TICKS_MAX
+
+
+def ticks_cpu():
+    return ticks_us()
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & TICKS_MAX
+
+
+def ticks_diff(a, b):
+    d = (a - b) & TICKS_MAX
+    return d - TICKS_PERIOD if d & (TICKS_PERIOD >> 1) else d
+
+
+def sleep_ms(ms):
+    time.sleep(ms / 1000)
+
+
+def sleep_us(us):
+    time.sleep(us / 1000000)
+
+
+def install(start_ms=0):
+    """Put the functions on the time module; start_ms sets the first tick value."""
+    global START_MS, _base
+    START_MS = start_ms
+    _base = _mono()
+    if not hasattr(time, "ticks_ms") or getattr(time.ticks_ms, "__module__", "") == __name__:
+        for name in ("ticks_ms", "ticks_us", "ticks_cpu", "ticks_add", "ticks_diff",
+                     "sleep_ms", "sleep_us"):
+            setattr(time, name, globals()[name])
+
+
+install()
@@ -0,0 +1,2 @@
+"""Simulated `urandom` module backed by the host's random."""
+from random import getrandbits, randint, randrange, random, choice, uniform, seed  # noqa: F401
@@ -0,0 +1,188 @@
+"""
+Memory soak test for the session store (PicoW/Code/sessions.py).
+
+Offline (default): drives sessions.py with a simulated clock through
+thousands of logins, page loads and logouts spread over simulated days,
+and samples the Python heap with tracemalloc. The session table and the
+heap must stay flat; the old unbounded dict is measured afterwards for
+comparison.
+
+    python soak_sessions.py [logins]
+
+Against a server (a Pico or the firmware running on the host), logs in
+repeatedly over HTTP and checks that the oldest sessions are evicted,
+logout invalidates the token and the server keeps answering:
+
+    python soak_sessions.py 2000 --host 192.168.4.1
+"""
+import argparse
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CODE = os.path.join(HERE, "..", "Code")
+
+
+def soak_offline(n, seed):
+    import debug
+    debug.CONSOLE = False
+    import sessions
+    rnd = random.Random(seed)
+    clock = [1700000000]
+    sessions.time.time = lambda: clock[0]
+
+    live = []
+    samples = []
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    t0 = time.perf_counter()
+    checks = 0
+    for i in range(1, n + 1):
+        clock[0] += rnd.randint(1, 120)
+        token = sessions.new()
+        live.append(token)
+        assert sessions.check(token)
+        # A few page loads on recent sessions, some logouts
+        for _ in range(rnd.randint(0, 5)):
+            sessions.check(rnd.choice(live[-16:]))
+            checks += 1
+        if rnd.random() < 0.2:
+            sessions.end(live.pop())
+        if len(live) > 64:
+            del live[:32]
+        assert sessions.count() <= sessions.MAX_SESSIONS
+        if i % (n // 10 or 1) == 0:
+            heap = tracemalloc.get_traced_memory()[0] - base
+            samples.append((i, sessions.count(), heap))
+    dt = time.perf_counter() - t0
+    tracemalloc.stop()
+
+    # What the old store (one dict entry per login, never removed) holds
+    tracemalloc.start()
+    legacy = {}
+    for _ in range(n):
+        legacy[str(rnd.getrandbits(32))] = True
+    legacy_heap = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    # Expiry: an idle session dies after IDLE_S, any session after TTL_S
+    token = sessions.new()
+    clock[0] += sessions.IDLE_S
+    assert not sessions.check(token), "idle session survived"
+    token = sessions.new()
+    for _ in range(sessions.TTL_S // (sessions.IDLE_S // 2) + 1):
+        clock[0] += sessions.IDLE_S // 2
+        sessions.check(token)
+    assert not sessions.check(token), "session outlived TTL"
+    token = sessions.new()
+    clock[0] -= 3600
+    assert not sessions.check(token), "session survived clock going back"
+    token = sessions.new()
+    sessions.end(token)
+    assert not sessions.check(token), "logout did not invalidate"
+
+    return samples, {"created": sessions.created, "evicted": sessions.evicted,
+                     "expired": sessions.expired, "legacy_heap": legacy_heap,
+                     "ops_per_s": int((n + checks) / dt)}
+
+
+def http(host, port, raw, timeout=5):
+    s = socket.create_connection((host, port), timeout)
+    try:
+        s.sendall(raw)
+        data = b""
+        while True:
+            chunk = s.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+    finally:
+        s.close()
+    return data
+
+
+def status(resp):
+    head = resp.split(b"\r\n", 1)[0].split()
+    return int(head[1]) if len(head) > 1 else 0
+
+
+def login(host, port, user, password):
+    body = "u={}&p={}".format(user, password).encode()
+    resp = http(host, port, b"POST /dologin HTTP/1.0\r\nContent-Type: application/x-www-form-urlencoded\r\n"
+                b"Content-Length: %d\r\n\r\n" % len(body) + body)
+    for line in resp.split(b"\r\n"):
+        if line.lower().startswith(b"set-cookie: session="):
+            return line.split(b"=", 1)[1].split(b";", 1)[0]
+    raise SystemExit("login failed: {!r}".format(resp[:200]))
+
+
+def get(host, port, path, token):
+    return status(http(host, port, b"GET %s HTTP/1.0\r\nCookie: session=%s\r\n\r\n" % (path.encode(), token)))
+
+
+def soak_http(args):
+    first = login(args.host, args.port, args.user, args.password)
+    t0 = time.perf_counter()
+    retries = 0
+    for i in range(args.logins):
+        try:
+            token = login(args.host, args.port, args.user, args.password)
+        except OSError:
+            retries += 1
+            time.sleep(0.5)
+            continue
+        if i % 200 == 0:
+            print("  {} logins, /data -> {}".format(i, get(args.host, args.port, "/data", token)))
+        time.sleep(args.interval)
+    dt = time.perf_counter() - t0
+    print("logins: {} in {:.1f} s ({} connection errors)".format(args.logins, dt, retries))
+    print("first session after soak: /data -> {} (401 = evicted)".format(
+        get(args.host, args.port, "/data", first)))
+    token = login(args.host, args.port, args.user, args.password)
+    before = get(args.host, args.port, "/data", token)
+    http(args.host, args.port, b"GET /logout HTTP/1.0\r\nCookie: session=%s\r\n\r\n" % token)
+    print("logout: /data {} before, {} after".format(before, get(args.host, args.port, "/data", token)))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("logins", type=int, nargs="?", default=5000)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--host")
+    ap.add_argument("--port", type=int, default=80)
+    ap.add_argument("--user", default="admin")
+    ap.add_argument("--password", default="admin123")
+    ap.add_argument("--interval", type=float, default=0.01, help="pause between logins")
+    args = ap.parse_args()
+
+    if args.host:
+        soak_http(args)
+        return
+
+    work = tempfile.mkdtemp(prefix="picosens-sessions-")
+    shutil.copy(os.path.join(CODE, "def_config.json"), work)
+    os.chdir(work)
+    sys.path[:0] = [CODE, os.path.join(HERE, "sim")]
+    import simclock  # noqa: F401  (time.ticks_* for the firmware modules)
+    try:
+        samples, stats = soak_offline(args.logins, args.seed)
+    finally:
+        os.chdir(HERE)
+        shutil.rmtree(work)
+    print("{:>8} {:>10} {:>12}".format("logins", "sessions", "heap bytes"))
+    for row in samples:
+        print("{:>8} {:>10} {:>12}".format(*row))
+    print("old unbounded dict after {} logins: {} bytes".format(args.logins, stats["legacy_heap"]))
+    print("created {created}, evicted {evicted}, expired {expired}; "
+          "{ops_per_s} login/check ops per second".format(**stats))
+    print("expiry, clock and logout checks ok")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+CPython socket module with the read()/write() stream methods MicroPython
+sockets have, so firmware code such as umqtt.simple runs on the host:
+
+    from umqtt import simple
+    import upy_socket
+    simple.socket = upy_socket
+
+Every write() is one send on the real socket; the module-level counters
+let benchmarks compare how many syscalls and bytes a code path costs.
+"""
+import socket as _socket
+
+getaddrinfo = _socket.getaddrinfo
+
+writes = 0
+written = 0
+
+
+def reset_counters():
+    global writes, written
+    writes = 0
+    written = 0
+
+
+class socket:
+    def __init__(self, *args):
+        self.s = _socket.socket(*args)
+
+    def settimeout(self, t):
+        self.s.settimeout(t)
+
+    def setblocking(self, flag):
+        self.s.setblocking(flag)
+
+    def connect(self, addr):
+        self.s.connect(addr)
+        # Code under test issues its own writes; without this Nagle plus
+        # delayed ACK adds ~40 ms to every acknowledged round trip.
+        self.s.setsockopt(_socket.IPPROTO_TCP, _socket.TCP_NODELAY, 1)
+
+    def close(self):
+        self.s.close()
+
+    def write(self, buf, n=None):
+        global writes, written
+        if isinstance(buf, str):
+            buf = buf.encode()
+        if n is not None:
+            buf = memoryview(buf)[:n]
+        self.s.sendall(buf)
+        writes += 1
+        written += len(buf)
+        return len(buf)
+
+    def read(self, n):
+        out = b""
+        while len(out) < n:
+            try:
+                d = self.s.recv(n - len(out))
+            except BlockingIOError:
+                # Non-blocking poll (check_msg): nothing there yet
+                if not out:
+                    return None
+                continue
+            if not d:
+                break
+            out += d
+        return out